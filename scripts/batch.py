@@ -0,0 +1,261 @@
+# =======================
+# 📦 Imports & Librairies
+# =======================
+import argparse
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+import geopandas as gpd
+import requests
+
+from config import POI_CONFIG, MOTEUR_ISOCHRONES_CONFIG
+from fonctions_api import rechercher_poi, calculer_isochrone
+from fonctions_basiques import normaliser_resultats, calculer_donnees_socio
+from fonctions_cartographie import transfo_geodataframe, creer_carte_enrichie
+from passerelle_api import creer_limiteurs_partages, installer_limiteurs
+from planification_requetes import (STRATEGIES, choisir_plan, couverture_effective, executer_plan_par_lots,
+                                    executer_requete, filtrer_resultats_zone, planifier_recherche)
+
+# Point d'entrée sans interface : analyse "enseignes × départements" en parallèle (un processus par
+# département), avec une table GeoParquet et une carte HTML autonome par zone.
+#
+# Exemple (depuis le dossier scripts/) :
+#   python batch.py --enseignes "Carrefour, Lidl" --departements 69 01 38 --sortie ../resultats/batch
+#
+# L'état d'avancement est enregistré dans <sortie>/progression.json : relancer la même commande après
+# un arrêt ne traite que les départements non terminés.
+
+# =======================
+# 📁 Chemins par défaut
+# =======================
+PATH_COMMUNES_FRANCE = "../data/Communes_France_Metro.xlsx"
+PATH_IRIS_SOCIO = "../data/iris_socio_data_final.parquet"
+PATH_COEFF_TRAFIC = "../data/coefficient_temps_trajet.xlsx"
+FICHIER_PROGRESSION = "progression.json"
+
+# Données de référence, chargées une fois par processus (voir initialiser_processus)
+_REFERENCES = {}
+
+
+# =======================
+# 📥 Chargement des données
+# =======================
+def initialiser_processus(path_communes, path_iris_socio, path_coeff_trafic, limiteurs=None):
+    """
+    Charge les données de référence dans le processus de travail.
+
+    :param limiteurs: Limiteurs de débit communs à tous les processus (voir creer_limiteurs_partages) :
+        la politique d'usage de Nominatim (1 requête/s) vaut pour le batch entier, pas par processus.
+    """
+    if limiteurs:
+        installer_limiteurs(limiteurs)
+    # Un processus par département : les isochrones locales n'ouvrent pas de pool imbriqué
+    MOTEUR_ISOCHRONES_CONFIG["processus"] = 1
+    df_communes = pd.read_excel(path_communes)
+    df_communes['Num_Dep'] = df_communes['Num_Dep'].astype(str)
+    _REFERENCES['communes'] = df_communes
+    _REFERENCES['iris'] = gpd.read_parquet(path_iris_socio)
+    try:
+        _REFERENCES['coefficients'] = pd.read_excel(path_coeff_trafic)
+    except FileNotFoundError:
+        _REFERENCES['coefficients'] = pd.DataFrame(columns=['ville', 'coefficient'])
+
+
+# =======================
+# 🗺️ Analyse d'un département
+# =======================
+def analyser_departement(code_dep, parametres):
+    """
+    Recherche, POI, couche socio et carte pour un département ; écrit les fichiers de sortie.
+
+    :return: Dictionnaire récapitulatif (compteurs, erreurs, durée).
+    """
+    debut = time.time()
+    dossier = os.path.join(parametres['sortie'], code_dep)
+    os.makedirs(dossier, exist_ok=True)
+    df_communes, df_iris = _REFERENCES['communes'], _REFERENCES['iris']
+
+    # --- Données socio-économiques du département (contours aussi utilisés par la planification) ---
+    df_iris_dep = df_iris[df_iris['IRIS'].str.slice(0, 2) == code_dep]
+    donnees_socio = calculer_donnees_socio(df_iris_dep, df_communes) if not df_iris_dep.empty else {}
+    gdf_socio = donnees_socio.get(parametres['maille'])
+    if gdf_socio is not None:
+        gdf_socio.to_parquet(os.path.join(dossier, f"socio_{parametres['maille'].lower()}.parquet"))
+
+    # --- Recherche des établissements, selon le plan de requêtes retenu (voir planification_requetes) ---
+    noms_dep = df_communes[df_communes['Num_Dep'].str.zfill(2) == code_dep]['Nom_Dep'].dropna().unique().tolist()
+    plan = choisir_plan(planifier_recherche(parametres['enseignes'], 'Département', noms_dep, df_communes,
+                                            donnees_socio.get('Département'), donnees_socio.get('Commune')),
+                        parametres['strategie'])
+    if plan is None:
+        raise RuntimeError(f"Département {code_dep} absent du référentiel des communes")
+
+    def requete_avec_pause(requete):
+        resultats_requete = executer_requete(requete)
+        if parametres['pause']:
+            time.sleep(parametres['pause'])
+        return resultats_requete
+
+    resultats, erreurs, saturees = [], [], []
+    for _, resultats_lot, erreurs_lot, saturees_lot in executer_plan_par_lots(plan["requetes"],
+                                                                              fonction_requete=requete_avec_pause):
+        resultats.extend(resultats_lot)
+        erreurs.extend(erreurs_lot)
+        saturees.extend(saturees_lot)
+    if not resultats and erreurs:
+        # Aucune réponse exploitable : le département reste à refaire au prochain lancement
+        raise RuntimeError(f"Toutes les recherches ont échoué ({len(erreurs)} erreur(s)) : {erreurs[0]}")
+    df_etab = filtrer_resultats_zone(pd.DataFrame(resultats), plan["zone"], plan["communes"])
+    gdf_etab = gpd.GeoDataFrame()
+    df_etab, rapport_doublons = normaliser_resultats(df_etab)
+    if not df_etab.empty:
+        gdf_etab = transfo_geodataframe(df_etab, "longitude", "latitude")
+        gdf_etab.to_parquet(os.path.join(dossier, "etablissements.parquet"))
+
+    # --- Points d'intérêt autour des établissements ---
+    gdf_poi = gpd.GeoDataFrame()
+    if parametres['poi'] and not gdf_etab.empty:
+        bounds = gdf_etab.total_bounds
+        marge = 0.05
+        bbox_poi = (bounds[0] - marge, bounds[1] - marge, bounds[2] + marge, bounds[3] + marge)
+        liste_gdf_poi = []
+        for categorie in parametres['poi']:
+            try:
+                gdf_resultat = rechercher_poi(bbox_poi, POI_CONFIG[categorie]['tags'])
+            except requests.exceptions.RequestException as e:
+                erreurs.append(e)
+                continue
+            if not gdf_resultat.empty:
+                gdf_resultat['categorie'] = categorie
+                liste_gdf_poi.append(gdf_resultat)
+            time.sleep(parametres['pause'])
+        if liste_gdf_poi:
+            gdf_poi = gpd.GeoDataFrame(pd.concat(liste_gdf_poi, ignore_index=True), crs="EPSG:4326")
+            gdf_poi.to_parquet(os.path.join(dossier, "poi.parquet"))
+
+    # --- Carte HTML autonome ---
+    if not gdf_etab.empty:
+        lat_centre, lon_centre = gdf_etab['latitude'].mean(), gdf_etab['longitude'].mean()
+    elif gdf_socio is not None and not gdf_socio.empty:
+        centre = gdf_socio.to_crs("EPSG:4326").union_all().centroid
+        lat_centre, lon_centre = centre.y, centre.x
+    else:
+        lat_centre, lon_centre = 46.6, 2.4
+
+    carte, _, _, _ = creer_carte_enrichie(
+        gdf_etablissements=gdf_etab, lat_centre=lat_centre, lon_centre=lon_centre,
+        gdf_socio=gdf_socio, colonne_socio=parametres['indicateur'] if gdf_socio is not None else None,
+        nom_indicateur_socio=parametres['indicateur'], gdf_poi=gdf_poi,
+        mode_affichage_etablissements=parametres['mode'], rayon_cercles=parametres['rayon'],
+        temps_isochrones=parametres['temps'], df_coefficients=_REFERENCES['coefficients'],
+        fonction_isochrone=calculer_isochrone, alerte=print, moteur_isochrones=parametres['moteur_isochrones']
+    )
+    carte.save(os.path.join(dossier, "carte.html"))
+
+    return {"strategie": plan["strategie"], "nb_requetes": plan["nb_requetes"],
+            "couverture": round(couverture_effective(plan["nb_requetes"], saturees) * plan["couverture"], 3),
+            "nb_etablissements": len(gdf_etab),
+            "nb_doublons_retires": sum(rapport_doublons.values()), "nb_poi": len(gdf_poi),
+            "erreurs": [str(e) for e in erreurs], "duree_s": round(time.time() - debut, 1)}
+
+
+# =======================
+# 💾 Suivi de progression
+# =======================
+def charger_progression(chemin, parametres):
+    """Charge l'état d'un run précédent s'il a été lancé avec les mêmes paramètres."""
+    if not os.path.exists(chemin):
+        return {"parametres": parametres, "departements": {}}
+    with open(chemin, encoding="utf-8") as f:
+        progression = json.load(f)
+    if progression.get("parametres") != parametres:
+        raise SystemExit(f"{chemin} provient d'un run aux paramètres différents : "
+                         "changez de dossier de sortie ou utilisez --recommencer.")
+    return progression
+
+
+def enregistrer_progression(chemin, progression):
+    """Écrit l'état d'avancement de manière atomique (un arrêt brutal ne corrompt pas le fichier)."""
+    chemin_tmp = chemin + ".tmp"
+    with open(chemin_tmp, "w", encoding="utf-8") as f:
+        json.dump(progression, f, ensure_ascii=False, indent=2)
+    os.replace(chemin_tmp, chemin)
+
+
+# =======================
+# 🚀 Point d'entrée
+# =======================
+def lire_arguments():
+    parser = argparse.ArgumentParser(description="Analyse concurrentielle OSM en batch, par département.")
+    parser.add_argument("--enseignes", required=True, help="Noms d'établissements séparés par des virgules")
+    parser.add_argument("--departements", nargs="+", required=True, help="Codes des départements (ex: 01 69 2A)")
+    parser.add_argument("--sortie", default="../resultats/batch", help="Dossier de sortie")
+    parser.add_argument("--processus", type=int, default=2, help="Nombre de processus en parallèle")
+    parser.add_argument("--pause", type=float, default=0.0,
+                        help="Délai supplémentaire (s) entre deux requêtes d'un processus ; le débit des API "
+                             "est déjà limité pour l'ensemble des processus (voir PASSERELLE_CONFIG)")
+    parser.add_argument("--strategie", default="auto", choices=["auto", *STRATEGIES],
+                        help="Stratégie de requêtes (auto : la moins coûteuse à couverture complète)")
+    parser.add_argument("--mode", default="Points", choices=["Points", "Cercles d'influence", "Isochrones"])
+    parser.add_argument("--rayon", type=int, default=1000, help="Rayon des cercles d'influence (m)")
+    parser.add_argument("--temps", type=int, default=10, help="Temps de trajet des isochrones (min)")
+    parser.add_argument("--moteur-isochrones", default="ORS", choices=["ORS", "Local"],
+                        help="Serveur ORS ou graphe routier local (voir moteur_isochrones.py)")
+    parser.add_argument("--poi", nargs="*", default=[], choices=list(POI_CONFIG.keys()), help="Catégories de POI")
+    parser.add_argument("--maille", default="Commune", choices=["IRIS", "Commune", "Département"])
+    parser.add_argument("--indicateur", default="Revenu_median", help="Colonne socio-économique de la carte")
+    parser.add_argument("--recommencer", action="store_true", help="Ignore la progression d'un run précédent")
+    parser.add_argument("--communes", default=PATH_COMMUNES_FRANCE)
+    parser.add_argument("--iris", default=PATH_IRIS_SOCIO)
+    parser.add_argument("--coefficients", default=PATH_COEFF_TRAFIC)
+    return parser.parse_args()
+
+
+def main():
+    args = lire_arguments()
+    parametres = {
+        "enseignes": [nom.strip() for nom in args.enseignes.split(",") if nom.strip()],
+        "sortie": args.sortie, "pause": args.pause, "strategie": args.strategie, "mode": args.mode, "rayon": args.rayon,
+        "temps": args.temps, "moteur_isochrones": args.moteur_isochrones, "poi": args.poi,
+        "maille": args.maille, "indicateur": args.indicateur
+    }
+    departements = [code.zfill(2) for code in args.departements]
+    for chemin in (args.communes, args.iris):
+        if not os.path.exists(chemin):
+            raise SystemExit(f"Fichier de référence introuvable : {chemin}")
+    os.makedirs(args.sortie, exist_ok=True)
+
+    chemin_progression = os.path.join(args.sortie, FICHIER_PROGRESSION)
+    if args.recommencer and os.path.exists(chemin_progression):
+        os.remove(chemin_progression)
+    progression = charger_progression(chemin_progression, parametres)
+    a_traiter = [code for code in departements
+                 if progression["departements"].get(code, {}).get("statut") != "termine"]
+    print(f"{len(departements) - len(a_traiter)} département(s) déjà terminé(s), {len(a_traiter)} à traiter.")
+
+    with multiprocessing.Manager() as manager, \
+            ProcessPoolExecutor(max_workers=args.processus, initializer=initialiser_processus,
+                                initargs=(args.communes, args.iris, args.coefficients,
+                                          creer_limiteurs_partages(manager))) as executor:
+        futures = {executor.submit(analyser_departement, code, parametres): code for code in a_traiter}
+        for future in as_completed(futures):
+            code = futures[future]
+            try:
+                progression["departements"][code] = {"statut": "termine", **future.result()}
+                print(f"✅ {code} : {progression['departements'][code]['nb_etablissements']} établissement(s)")
+            except Exception as e:
+                progression["departements"][code] = {"statut": "erreur", "message": str(e)}
+                print(f"❌ {code} : {e}")
+            enregistrer_progression(chemin_progression, progression)
+
+    nb_erreurs = sum(1 for etat in progression["departements"].values() if etat["statut"] == "erreur")
+    if nb_erreurs:
+        print(f"{nb_erreurs} département(s) en erreur : relancez la commande pour les reprendre.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,431 @@
+# =======================
+# 📦 Imports & Librairies
+# =======================
+import argparse
+import hashlib
+import json
+import logging
+import os
+import platform
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+
+# Banc d'essai des chemins critiques de l'application, sur données synthétiques et avec des
+# serveurs locaux qui imitent Nominatim, Overpass et ORS (latence réglable).
+#
+# Exemple (depuis le dossier scripts/) :
+#   python benchmark.py --echelle region --latence-ms 50 --sortie ../resultats/bench.json
+#   python benchmark.py --echelle region --comparer ../resultats/bench.json
+#
+# Le rapport JSON contient, pour chaque cas, les temps (min / médiane / max) et le pic mémoire
+# Python (tracemalloc, mesuré sur une exécution séparée pour ne pas fausser les temps).
+
+ECHELLES = {
+    "petite": {"nb_departements": 2, "communes_par_departement": 10, "iris_par_commune": 5, "nb_etablissements": 50},
+    "region": {"nb_departements": 12, "communes_par_departement": 60, "iris_par_commune": 8, "nb_etablissements": 500},
+    "france": {"nb_departements": 96, "communes_par_departement": 100, "iris_par_commune": 5, "nb_etablissements": 5000}
+}
+
+COLONNES_COMPTAGE = [
+    'Nb_menages_total', 'Pop_15_24_ans', 'Pop_25_54_ans', 'Pop_55_79_ans', 'Pop_80_ans_plus',
+    'Nb_menages_sans_famille', 'Nb_menages_famille', 'Menages_couple_sans_enfant',
+    'Menages_couple_avec_enfant', 'Menages_monoparental', 'Menages_agriculteurs_CS1',
+    'Menages_artisans_commercants_CS2', 'Menages_cadres_prof_intelectuelles_CS3',
+    'Menages_prof_intermediaires_CS4', 'Menages_employes_CS5', 'Menages_ouvriers_CS6',
+    'Menages_retraites_CS7', 'Menages_autres_sans_act_pro_CS8'
+]
+
+
+# =======================
+# 🧪 Données synthétiques
+# =======================
+def generer_donnees_synthetiques(nb_departements, communes_par_departement, iris_par_commune,
+                                 nb_etablissements, graine=0):
+    """
+    Génère des communes, des IRIS (polygones en Lambert-93) et des établissements fictifs.
+
+    :return: Tuple (df_communes, gdf_iris, gdf_etablissements).
+    """
+    rng = np.random.default_rng(graine)
+    cote_iris = 1500  # mètres
+    lignes_communes, lignes_iris, geometries = [], [], []
+
+    for d in range(nb_departements):
+        code_dep = f"{d + 1:02d}"
+        # Les départements sont disposés en damier sur l'emprise de la métropole
+        x_dep = 150000 + (d % 10) * 100000
+        y_dep = 6200000 + (d // 10) * 100000
+        for c in range(communes_par_departement):
+            nom_ville = f"Commune_{code_dep}_{c:03d}"
+            lignes_communes.append({"Num_Dep": d + 1, "Nom_Dep": f"Departement_{code_dep}", "Nom_Ville": nom_ville,
+                                    "Nom_Region": f"Region_{d // 8:02d}"})
+            x_com = x_dep + (c % 10) * 9000
+            y_com = y_dep + (c // 10) * 9000
+            for i in range(iris_par_commune):
+                centre = shapely.Point(x_com + (i % 3) * cote_iris, y_com + (i // 3) * cote_iris)
+                # Polygones à une cinquantaine de sommets, proches de la complexité des IRIS réels
+                geometries.append(centre.buffer(cote_iris / 2, quad_segs=12))
+                lignes_iris.append({"IRIS": f"{code_dep}{c:03d}{i:04d}", "NOM_COM": nom_ville})
+
+    df_communes = pd.DataFrame(lignes_communes)
+    gdf_iris = gpd.GeoDataFrame(lignes_iris, geometry=geometries, crs="EPSG:2154")
+    nb_iris = len(gdf_iris)
+    for col in COLONNES_COMPTAGE:
+        valeurs = rng.gamma(2.0, 150.0, nb_iris)
+        valeurs[rng.random(nb_iris) < 0.05] = np.nan  # Données partielles, comme dans le fichier INSEE
+        gdf_iris[col] = valeurs
+    gdf_iris['Taux_pauvrete'] = rng.uniform(5, 30, nb_iris)
+    gdf_iris['Revenu_median'] = rng.normal(22000, 4000, nb_iris)
+
+    centres = gdf_iris.geometry.centroid.to_crs("EPSG:4326")
+    tirage = rng.integers(0, nb_iris, nb_etablissements)
+    enseignes = np.array(["Enseigne A", "Enseigne B", "Enseigne C"])
+    gdf_etablissements = gpd.GeoDataFrame({
+        "nom_etablissement": enseignes[rng.integers(0, len(enseignes), nb_etablissements)],
+        "ville": gdf_iris['NOM_COM'].to_numpy()[tirage],
+        "adresse_simplifiee": [f"{n}, Rue Fictive, Commune" for n in range(nb_etablissements)],
+        "latitude": centres.y.to_numpy()[tirage] + rng.normal(0, 0.005, nb_etablissements),
+        "longitude": centres.x.to_numpy()[tirage] + rng.normal(0, 0.005, nb_etablissements)
+    })
+    gdf_etablissements = gdf_etablissements.set_geometry(
+        gpd.points_from_xy(gdf_etablissements['longitude'], gdf_etablissements['latitude']), crs="EPSG:4326")
+    return df_communes, gdf_iris, gdf_etablissements
+
+
+def generer_graphe_synthetique(emprise, chemin, pas_min_m=300, nb_max_par_cote=800, graine=0):
+    """
+    Génère un réseau routier en grille (vitesses aléatoires de 30 à 90 km/h) couvrant l'emprise
+    (min_lon, min_lat, max_lon, max_lat) et l'enregistre au format du moteur d'isochrones local.
+    """
+    from moteur_isochrones import graphe_depuis_aretes
+
+    rng = np.random.default_rng(graine)
+    min_lon, min_lat, max_lon, max_lat = emprise
+    cos_lat = np.cos(np.radians((min_lat + max_lat) / 2))
+    pas_m = max(pas_min_m, (max_lon - min_lon) * 111_000 * cos_lat / nb_max_par_cote,
+                (max_lat - min_lat) * 111_000 / nb_max_par_cote)
+    lons = np.arange(min_lon - 0.05, max_lon + 0.05, pas_m / (111_000 * cos_lat))
+    lats = np.arange(min_lat - 0.05, max_lat + 0.05, pas_m / 111_000)
+    nb_lignes, nb_colonnes = len(lats), len(lons)
+    grille_lat, grille_lon = np.meshgrid(lats, lons, indexing="ij")
+    indices = np.arange(nb_lignes * nb_colonnes).reshape(nb_lignes, nb_colonnes)
+    # Arêtes horizontales et verticales, dans les deux sens
+    paires = [(indices[:, :-1].ravel(), indices[:, 1:].ravel()), (indices[:-1, :].ravel(), indices[1:, :].ravel())]
+    origines = np.concatenate([np.concatenate([a, b]) for a, b in paires])
+    destinations = np.concatenate([np.concatenate([b, a]) for a, b in paires])
+    temps_s = pas_m / (rng.uniform(30, 90, len(origines)) / 3.6)
+    np.savez_compressed(chemin, **graphe_depuis_aretes(grille_lon.ravel(), grille_lat.ravel(),
+                                                       origines, destinations, temps_s))
+    return len(grille_lon.ravel())
+
+
+# =======================
+# 🌐 Serveurs factices
+# =======================
+class _GestionnaireAPI(BaseHTTPRequestHandler):
+    """Répond comme Nominatim (/search), Overpass (/api/interpreter) et ORS (/ors/v2/isochrones/...)."""
+    latence = 0.0
+    resultats_par_requete = 5
+
+    def log_message(self, format, *args):
+        pass
+
+    def _repondre(self, contenu):
+        corps = json.dumps(contenu).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(corps)))
+        self.end_headers()
+        self.wfile.write(corps)
+
+    def _graine(self, texte):
+        return int(hashlib.md5(texte.encode()).hexdigest()[:8], 16)
+
+    def do_GET(self):
+        time.sleep(self.latence)
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        if url.path.endswith("/search"):
+            requete = params.get("q", [""])[0]
+            viewbox = params.get("viewbox", [""])[0]
+            rng = np.random.default_rng(self._graine(requete + viewbox))
+            if viewbox:  # Recherche bornée : résultats répartis dans l'emprise
+                min_lon, min_lat, max_lon, max_lat = map(float, viewbox.split(","))
+                points = [(rng.uniform(min_lat, max_lat), rng.uniform(min_lon, max_lon), f"Commune {k}")
+                          for k in range(self.resultats_par_requete)]
+            else:
+                lat, lon = rng.uniform(43, 50), rng.uniform(-1, 7)
+                points = [(lat + rng.normal(0, 0.01), lon + rng.normal(0, 0.01), requete.split(",")[1].strip())
+                          for _ in range(self.resultats_par_requete)]
+            self._repondre([{
+                "name": requete.split(",")[0], "lat": str(lat), "lon": str(lon),
+                "display_name": f"{k}, Rue Fictive, Quartier, {ville}, France", "address": {"city": ville}
+            } for k, (lat, lon, ville) in enumerate(points)])
+        elif url.path.endswith("/health"):
+            self._repondre({"status": "ready"})
+        elif url.path.endswith("/interpreter"):
+            rng = np.random.default_rng(self._graine(params.get("data", [""])[0]))
+            self._repondre({"elements": [
+                {"type": "node", "lat": rng.uniform(43, 50), "lon": rng.uniform(-1, 7), "tags": {"name": f"POI {k}"}}
+                for k in range(self.resultats_par_requete * 10)]})
+        else:
+            self.send_error(404)
+
+    def do_POST(self):
+        time.sleep(self.latence)
+        longueur = int(self.headers.get("Content-Length", 0))
+        contenu = self.rfile.read(longueur)
+        if self.path.endswith("/interpreter"):
+            # Recherche d'enseignes par zone : des établissements pour chaque nom du motif name~"..."
+            requete = parse_qs(contenu.decode()).get("data", [""])[0]
+            noms = re.search(r'\["name"~"(.*?)",i\]', requete).group(1).replace("\\", "").split("|")
+            rng = np.random.default_rng(self._graine(requete))
+            self._repondre({"elements": [
+                {"type": "node", "lat": rng.uniform(43, 50), "lon": rng.uniform(-1, 7),
+                 "tags": {"name": nom, "addr:street": "Rue Fictive", "addr:city": f"Commune {k}"}}
+                for nom in noms for k in range(self.resultats_par_requete * 20)]})
+            return
+        corps = json.loads(contenu or b"{}")
+        if "isochrones" not in self.path:
+            self.send_error(404)
+            return
+        lon, lat = corps["locations"][0]
+        rayon = corps["range"][0] / 3600 * 40 / 111  # ~40 km/h, en degrés
+        angles = np.linspace(0, 2 * np.pi, 120)
+        anneau = [[lon + rayon * np.cos(a) * (0.8 + 0.2 * np.sin(5 * a)), lat + rayon * np.sin(a)] for a in angles]
+        anneau.append(anneau[0])
+        self._repondre({"type": "FeatureCollection", "features": [
+            {"type": "Feature", "properties": {"value": corps["range"][0]},
+             "geometry": {"type": "Polygon", "coordinates": [anneau]}}]})
+
+
+def demarrer_serveurs_factices(latence_ms=0, resultats_par_requete=5):
+    """
+    Démarre un serveur HTTP local imitant les trois API et redirige l'application vers lui.
+
+    :return: Le serveur (à arrêter avec .shutdown()).
+    """
+    gestionnaire = type("Gestionnaire", (_GestionnaireAPI,),
+                        {"latence": latence_ms / 1000, "resultats_par_requete": resultats_par_requete})
+    serveur = ThreadingHTTPServer(("127.0.0.1", 0), gestionnaire)
+    threading.Thread(target=serveur.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{serveur.server_address[1]}"
+    os.environ["URL_NOMINATIM"] = f"{base}/search"
+    os.environ["URL_OVERPASS"] = f"{base}/api/interpreter"
+    os.environ["URL_ORS_ISOCHRONES"] = f"{base}/ors/v2/isochrones/driving-car"
+    os.environ.setdefault("PASSERELLE_LIMITES", "0")  # Débits des API publiques sans objet en local
+    return serveur
+
+
+# =======================
+# ⏱️ Mesures
+# =======================
+def mesurer(fonction, repetitions, preparation=None):
+    """
+    Chronomètre une fonction sur plusieurs répétitions puis mesure son pic mémoire.
+
+    :param preparation: Fonction appelée avant chaque exécution (ex: vidage du cache), hors chronométrage.
+    :return: Dictionnaire des mesures, plus les éventuelles métriques retournées par la fonction.
+    """
+    temps, metriques = [], {}
+    for _ in range(repetitions):
+        if preparation:
+            preparation()
+        debut = time.perf_counter()
+        metriques = fonction() or {}
+        temps.append(time.perf_counter() - debut)
+
+    if preparation:
+        preparation()
+    tracemalloc.start()
+    fonction()
+    _, pic = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {"min_s": round(min(temps), 4), "mediane_s": round(statistics.median(temps), 4),
+            "max_s": round(max(temps), 4), "repetitions": repetitions,
+            "pic_memoire_mo": round(pic / 1024 ** 2, 2), **metriques}
+
+
+def duree_import(modules):
+    """Durée d'import de modules dans un processus Python neuf (en secondes), comme au démarrage du serveur."""
+    code = f"import time; debut = time.perf_counter(); import {', '.join(modules)}; print(time.perf_counter() - debut)"
+    sortie = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    return round(float(sortie.stdout.strip().splitlines()[-1]), 3)
+
+
+def executer_benchmarks(echelle, repetitions, cas_selectionnes=None):
+    """Exécute les cas de benchmark et retourne leurs mesures."""
+    # Imports tardifs : les URL des API doivent être redirigées avant le chargement des modules
+    from config import POI_CONFIG, MOTEUR_ISOCHRONES_CONFIG
+    from fonctions_basiques import preparer_donnees_socio
+    from fonctions_cartographie import (executer_requete_en_cache, rechercher_poi_osm,
+                                        calculer_isochrone_et_cacher, calculer_isochrones_locales_en_cache,
+                                        creer_carte_enrichie, couche_socio_serialisee,
+                                        couche_etablissements_serialisee, couche_poi_serialisee)
+    from planification_requetes import planifier_recherche, executer_plan_par_lots
+
+    df_communes, gdf_iris, gdf_etablissements = generer_donnees_synthetiques(**ECHELLES[echelle])
+    df_communes_str = df_communes.assign(Num_Dep=df_communes['Num_Dep'].astype(str))
+    dict_geodatas = preparer_donnees_socio(gdf_iris, df_communes_str)
+    gdf_socio = dict_geodatas["Commune"]
+    deps = sorted(df_communes['Nom_Dep'].unique())
+    plans = {p["strategie"]: p for p in planifier_recherche(["Enseigne A", "Enseigne B"], 'Département', deps,
+                                                             df_communes, dict_geodatas["Département"])}
+    bbox = tuple(gdf_etablissements.total_bounds)
+    gdf_iso = gdf_etablissements.head(min(len(gdf_etablissements), 200))
+    MOTEUR_ISOCHRONES_CONFIG["graphe"] = os.path.join(tempfile.mkdtemp(), "graphe_routier.npz")
+    nb_noeuds = generer_graphe_synthetique(tuple(gdf_iso.total_bounds), MOTEUR_ISOCHRONES_CONFIG["graphe"])
+
+    def carte(mode, socio=True, moteur='ORS'):
+        m, _, _, _ = creer_carte_enrichie(
+            gdf_etablissements=gdf_iso if mode == 'Isochrones' else gdf_etablissements,
+            lat_centre=46.6, lon_centre=2.4, gdf_socio=gdf_socio if socio else None,
+            colonne_socio='Revenu_median', nom_indicateur_socio='Revenu médian (€)',
+            mode_affichage_etablissements=mode, rayon_cercles=1000, temps_isochrones=10,
+            moteur_isochrones=moteur)
+        return m
+
+    def vider_couches():
+        for fonction in (couche_socio_serialisee, couche_etablissements_serialisee, couche_poi_serialisee):
+            fonction.clear()
+
+    carte_html = carte('Points')
+
+    cas = {
+        # Imports de main.py pour la page d'accueil, puis de la page OSM (chargée à la navigation)
+        "import_accueil": (lambda: {"duree_import_s": duree_import(["interface", "prechauffage", "page_acceuil"])},
+                           None),
+        "import_page_osm": (lambda: {"duree_import_s": duree_import(["page_osm"])}, None),
+        "preparer_donnees_socio": (
+            lambda: {"nb_iris": len(preparer_donnees_socio(gdf_iris, df_communes_str)["IRIS"])},
+            preparer_donnees_socio.clear),
+        **{f"recherche_plan_{strategie}": (
+            lambda plan=plan: {"nb_requetes": plan["nb_requetes"], "nb_resultats": sum(
+                len(r) for _, r, _, _ in executer_plan_par_lots(plan["requetes"],
+                                                                fonction_requete=executer_requete_en_cache))},
+            executer_requete_en_cache.clear) for strategie, plan in plans.items()},
+        "rechercher_poi_osm": (
+            lambda: {"nb_poi": sum(len(rechercher_poi_osm(bbox, c['tags'])) for c in POI_CONFIG.values())},
+            rechercher_poi_osm.clear),
+        "calculer_isochrone_et_cacher": (
+            lambda: {"nb_isochrones": sum(calculer_isochrone_et_cacher(r.longitude, r.latitude, 600) is not None
+                                          for r in gdf_iso.itertuples())},
+            calculer_isochrone_et_cacher.clear),
+        "creer_carte_enrichie_points": (lambda: {"nb_couches": len(carte('Points')._children)}, vider_couches),
+        "creer_carte_enrichie_cercles": (lambda: {"nb_couches": len(carte("Cercles d'influence")._children)},
+                                         vider_couches),
+        # Rerun sans changement de paramètres : couches reprises du cache, seul l'assemblage est refait
+        "creer_carte_enrichie_cercles_rerun": (
+            lambda: {"taille_html_mo": round(len(carte("Cercles d'influence").get_root().render()) / 1024 ** 2, 2)},
+            lambda: carte("Cercles d'influence")),
+        "creer_carte_enrichie_isochrones": (lambda: {"nb_couches": len(carte('Isochrones', socio=False)._children)},
+                                            vider_couches),
+        "creer_carte_enrichie_isochrones_locales": (
+            lambda: {"nb_noeuds_graphe": nb_noeuds,
+                     "nb_couches": len(carte('Isochrones', socio=False, moteur='Local')._children)},
+            lambda: (vider_couches(), calculer_isochrones_locales_en_cache.clear())),
+        "serialisation_html": (lambda: {"taille_html_mo": round(len(carte_html.get_root().render()) / 1024 ** 2, 2)},
+                               None)
+    }
+
+    resultats = {}
+    for nom, (fonction, preparation) in cas.items():
+        if cas_selectionnes and nom not in cas_selectionnes:
+            continue
+        print(f"⏱️  {nom}...", flush=True)
+        resultats[nom] = mesurer(fonction, repetitions, preparation)
+    return resultats
+
+
+# =======================
+# 📊 Rapport
+# =======================
+def _commit_courant():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def comparer_rapports(rapport, reference, seuil=0.10):
+    """
+    Affiche l'évolution des médianes et pics mémoire par rapport à un rapport de référence.
+
+    :return: Liste des cas en régression au-delà du seuil relatif.
+    """
+    regressions = []
+    print(f"\nComparaison avec {reference['meta'].get('commit')} (seuil {seuil:.0%}) :")
+    for nom, mesure in rapport["resultats"].items():
+        ancienne = reference["resultats"].get(nom)
+        if not ancienne:
+            continue
+        ecart_temps = mesure["mediane_s"] / ancienne["mediane_s"] - 1 if ancienne["mediane_s"] else 0
+        ecart_memoire = (mesure["pic_memoire_mo"] / ancienne["pic_memoire_mo"] - 1
+                         if ancienne["pic_memoire_mo"] else 0)
+        statut = "⚠️" if ecart_temps > seuil or ecart_memoire > seuil else "  "
+        if statut != "  ":
+            regressions.append(nom)
+        print(f"{statut} {nom:<34} temps {ecart_temps:+7.1%}   mémoire {ecart_memoire:+7.1%}")
+    return regressions
+
+
+def lire_arguments():
+    parser = argparse.ArgumentParser(description="Benchmark des chemins critiques de l'application.")
+    parser.add_argument("--echelle", default="petite", choices=list(ECHELLES.keys()))
+    parser.add_argument("--repetitions", type=int, default=3)
+    parser.add_argument("--latence-ms", type=float, default=20, help="Latence simulée des API (ms)")
+    parser.add_argument("--resultats-par-requete", type=int, default=5, help="Réponses par requête Nominatim")
+    parser.add_argument("--cas", nargs="*", help="Ne lancer que ces cas")
+    parser.add_argument("--sortie", help="Fichier JSON du rapport")
+    parser.add_argument("--comparer", help="Rapport JSON de référence")
+    parser.add_argument("--seuil", type=float, default=0.10, help="Seuil relatif de régression")
+    return parser.parse_args()
+
+
+def main():
+    args = lire_arguments()
+    logging.getLogger("streamlit").setLevel(logging.ERROR)
+    serveur = demarrer_serveurs_factices(args.latence_ms, args.resultats_par_requete)
+    try:
+        resultats = executer_benchmarks(args.echelle, args.repetitions, args.cas)
+    finally:
+        serveur.shutdown()
+
+    rapport = {
+        "meta": {"commit": _commit_courant(), "date": datetime.now().isoformat(timespec="seconds"),
+                 "python": platform.python_version(), "echelle": args.echelle, **ECHELLES[args.echelle],
+                 "latence_ms": args.latence_ms, "repetitions": args.repetitions},
+        "resultats": resultats
+    }
+    print(json.dumps(rapport, ensure_ascii=False, indent=2))
+    if args.sortie:
+        os.makedirs(os.path.dirname(os.path.abspath(args.sortie)), exist_ok=True)
+        with open(args.sortie, "w", encoding="utf-8") as f:
+            json.dump(rapport, f, ensure_ascii=False, indent=2)
+
+    if args.comparer:
+        with open(args.comparer, encoding="utf-8") as f:
+            reference = json.load(f)
+        if comparer_rapports(rapport, reference, args.seuil):
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
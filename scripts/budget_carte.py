@@ -0,0 +1,153 @@
+# ==============================================
+# 📦 Imports & Librairies
+# ==============================================
+import numpy as np
+import pandas as pd
+import shapely
+from config import BUDGET_CARTE_CONFIG
+
+# Budget de volume de la carte : la taille du HTML envoyé au navigateur est prédite couche par
+# couche (nombre d'entités et de sommets, modèle de BUDGET_CARTE_CONFIG) avant tout rendu. Au-delà
+# du budget, le rendu est dégradé par étapes, de la moins visible à la plus visible :
+#   1. simplification des polygones socio-économiques ;
+#   2. regroupement des marqueurs (établissements, puis POI) ;
+#   3. maille socio-économique plus grossière ;
+#   4. agrégation des points sur une grille (établissements, puis POI).
+
+# ==============================================
+# Section estimation
+# ==============================================
+
+def cellules_agregation(gdf_points):
+    """
+    Regroupe des points (EPSG:4326) par cellule de la grille d'agrégation (pas_agregation_m).
+
+    :return: DataFrame (cx, cy, lat, lon, nb) : une ligne par cellule occupée, position moyenne des points.
+    """
+    pas = BUDGET_CARTE_CONFIG["pas_agregation_m"]
+    latitudes, longitudes = gdf_points.geometry.y.to_numpy(), gdf_points.geometry.x.to_numpy()
+    cellules = pd.DataFrame({"lat": latitudes, "lon": longitudes,
+                             "cy": np.floor(latitudes * 110_540 / pas),
+                             "cx": np.floor(longitudes * 111_320 * np.cos(np.radians(latitudes)) / pas)})
+    return cellules.groupby(["cx", "cy"], as_index=False).agg(lat=("lat", "mean"), lon=("lon", "mean"),
+                                                             nb=("lat", "size"))
+
+
+def formater_volume(octets):
+    """Volume lisible : en Ko sous 1 Mo, en Mo au-delà."""
+    return f"{octets / 1024:.0f} Ko" if octets < 1024 ** 2 else f"{octets / 1024 ** 2:.1f} Mo"
+
+
+def _nb(gdf):
+    return 0 if gdf is None else len(gdf)
+
+
+def estimer_volume(gdf_socio=None, gdf_etablissements=None, mode_affichage='Points', gdf_poi=None,
+                   rendu_etablissements='detail', rendu_poi='detail', resultat_scoring=None):
+    """
+    Prédit le volume sérialisé de chaque couche de la carte, sans la construire.
+
+    :return: Dictionnaire {couche: octets estimés}.
+    """
+    octets = BUDGET_CARTE_CONFIG["octets"]
+    volume = {"fond": octets["fond"]}
+    if _nb(gdf_socio):
+        nb_sommets = int(shapely.get_num_coordinates(gdf_socio.geometry.values).sum())
+        volume["socio"] = len(gdf_socio) * octets["socio_entite"] + nb_sommets * octets["socio_sommet"]
+
+    nb_etablissements = _nb(gdf_etablissements)
+    if nb_etablissements:
+        if rendu_etablissements == 'agregation':
+            volume["etablissements"] = len(cellules_agregation(gdf_etablissements)) * octets["cellule"]
+        else:
+            par_etablissement = {'Cercles d\'influence': octets["cercle"],
+                                 'Isochrones': octets["isochrone"]}.get(mode_affichage, 0)
+            par_etablissement += octets["marqueur"] if rendu_etablissements == 'detail' else octets["marqueur_regroupe"]
+            volume["etablissements"] = nb_etablissements * par_etablissement
+
+    if _nb(gdf_poi):
+        volume["poi"] = {'detail': len(gdf_poi) * octets["poi"], 'regroupement': len(gdf_poi) * octets["poi_regroupe"],
+                         'agregation': len(cellules_agregation(gdf_poi)) * octets["cellule"]}[rendu_poi]
+
+    if resultat_scoring is not None:
+        volume["scoring"] = int(np.size(resultat_scoring["score"])) * octets["scoring_cellule"]
+    return volume
+
+
+# ==============================================
+# Section adaptation au budget
+# ==============================================
+
+def adapter_au_budget(gdf_socio=None, gdf_etablissements=None, mode_affichage='Points', gdf_poi=None,
+                      resultat_scoring=None, maille_socio=None, socio_plus_grossier=None, budget_octets=None):
+    """
+    Choisit le rendu de chaque couche pour tenir dans le budget, en appliquant les dégradations
+    dans l'ordre jusqu'à ce que l'estimation passe sous le budget.
+
+    :param maille_socio: Maille de gdf_socio (pour le message de dégradation).
+    :param socio_plus_grossier: Fonction (maille) -> (GeoDataFrame, maille) de la maille plus grossière
+        couvrant la même vue, ou (None, None) s'il n'y en a pas.
+    :param budget_octets: Budget en octets (BUDGET_CARTE_CONFIG["budget_mo"] par défaut).
+    :return: Dictionnaire {gdf_socio, maille_socio, tolerance_socio_m, rendu_etablissements, rendu_poi,
+        volume_estime (par couche), volume_initial (total), budget_octets, degradations (libellés)}.
+    """
+    budget_octets = budget_octets or BUDGET_CARTE_CONFIG["budget_mo"] * 1024 ** 2
+    etat = {"gdf_socio": gdf_socio, "maille_socio": maille_socio, "tolerance_socio_m": 0,
+            "rendu_etablissements": 'detail', "rendu_poi": 'detail'}
+
+    def estimer():
+        return estimer_volume(etat["gdf_socio"], gdf_etablissements, mode_affichage, gdf_poi,
+                              etat["rendu_etablissements"], etat["rendu_poi"], resultat_scoring)
+
+    volume = estimer()
+    volume_initial, degradations = sum(volume.values()), []
+
+    def simplifier(tolerance_m, gdf=None):
+        gdf = etat["gdf_socio"] if gdf is None else gdf
+        etat["gdf_socio"] = gdf.assign(geometry=gdf.geometry.simplify(tolerance_m, preserve_topology=True))
+        etat["tolerance_socio_m"] = tolerance_m
+        return f"Contours de la couche socio simplifiés ({tolerance_m} m)"
+
+    def regrouper(couche, libelle):
+        etat[couche] = 'regroupement'
+        return f"{libelle} regroupés (clusters)"
+
+    def agreger(couche, libelle):
+        etat[couche] = 'agregation'
+        return f"{libelle} agrégés par cellule de {BUDGET_CARTE_CONFIG['pas_agregation_m'] / 1000:g} km"
+
+    def grossir_maille():
+        maille_avant = etat["maille_socio"]
+        gdf, maille = socio_plus_grossier(maille_avant)
+        if gdf is None:
+            return None
+        etat["gdf_socio"], etat["maille_socio"] = gdf, maille
+        if etat["tolerance_socio_m"]:
+            simplifier(etat["tolerance_socio_m"], gdf)  # La nouvelle maille garde la simplification déjà retenue
+        return f"Couche socio affichée à la maille {maille} au lieu de {maille_avant}"
+
+    # Étapes : (applicable ?, action retournant le libellé de la dégradation, ou None si sans effet)
+    etapes = [(lambda t=t: _nb(etat["gdf_socio"]) > 0, lambda t=t: simplifier(t))
+              for t in BUDGET_CARTE_CONFIG["tolerances_simplification_m"]]
+    etapes += [(lambda: _nb(gdf_etablissements) > 0, lambda: regrouper("rendu_etablissements", "Établissements")),
+               (lambda: _nb(gdf_poi) > 0, lambda: regrouper("rendu_poi", "Points d'intérêt"))]
+    etapes += [(lambda: _nb(etat["gdf_socio"]) > 0 and socio_plus_grossier is not None, grossir_maille)] * 2
+    etapes += [(lambda: _nb(gdf_etablissements) > 0, lambda: agreger("rendu_etablissements", "Établissements")),
+               (lambda: _nb(gdf_poi) > 0, lambda: agreger("rendu_poi", "Points d'intérêt"))]
+
+    for applicable, action in etapes:
+        if sum(volume.values()) <= budget_octets:
+            break
+        if not applicable():
+            continue
+        etat_avant = dict(etat)
+        libelle = action()
+        nouveau_volume = estimer() if libelle else volume
+        if sum(nouveau_volume.values()) < sum(volume.values()):
+            volume = nouveau_volume
+            degradations.append(libelle)
+        else:
+            etat.update(etat_avant)  # Sans gain (ex: agrégation de points isolés), on garde le rendu précédent
+
+    return {**etat, "volume_estime": volume, "volume_initial": volume_initial, "budget_octets": budget_octets,
+            "degradations": degradations}
@@ -1,10 +1,108 @@
 # Dictionnaire de configuration centralisé pour les Points d'Intérêt (POI)
+# La clé "poids" mesure la capacité de chaque catégorie à générer du flux (utilisée par le scoring des emplacements).
 POI_CONFIG = {
-    "Gares":         {"tags": {"railway": "station"},    "singular": "Gare",         "icon": {'icon': 'train', 'color': 'darkblue', 'prefix': 'fa'}},
-    "Écoles":        {"tags": {"amenity": "school"},     "singular": "École",        "icon": {'icon': 'graduation-cap', 'color': 'green', 'prefix': 'fa'}},
-    "Universités":   {"tags": {"amenity": "university"}, "singular": "Université",   "icon": {'icon': 'university', 'color': 'darkgreen', 'prefix': 'fa'}},
-    "Hôpitaux":      {"tags": {"amenity": "hospital"},   "singular": "Hôpital",      "icon": {'icon': 'hospital', 'color': 'red', 'prefix': 'fa'}},
-    "Pharmacies":    {"tags": {"amenity": "pharmacy"},   "singular": "Pharmacie",    "icon": {'icon': 'plus-square', 'color': 'pink', 'prefix': 'fa'}},
-    "Mairies":       {"tags": {"amenity": "townhall"},   "singular": "Mairie",       "icon": {'icon': 'landmark', 'color': 'orange', 'prefix': 'fa'}},
-    "Supermarchés":  {"tags": {"shop": "supermarket"},  "singular": "Supermarché",  "icon": {'icon': 'shopping-cart', 'color': 'purple', 'prefix': 'fa'}}
-}
\ No newline at end of file
+    "Gares":         {"tags": {"railway": "station"},    "singular": "Gare",         "poids": 3.0, "icon": {'icon': 'train', 'color': 'darkblue', 'prefix': 'fa'}},
+    "Écoles":        {"tags": {"amenity": "school"},     "singular": "École",        "poids": 1.0, "icon": {'icon': 'graduation-cap', 'color': 'green', 'prefix': 'fa'}},
+    "Universités":   {"tags": {"amenity": "university"}, "singular": "Université",   "poids": 2.0, "icon": {'icon': 'university', 'color': 'darkgreen', 'prefix': 'fa'}},
+    "Hôpitaux":      {"tags": {"amenity": "hospital"},   "singular": "Hôpital",      "poids": 2.0, "icon": {'icon': 'hospital', 'color': 'red', 'prefix': 'fa'}},
+    "Pharmacies":    {"tags": {"amenity": "pharmacy"},   "singular": "Pharmacie",    "poids": 0.5, "icon": {'icon': 'plus-square', 'color': 'pink', 'prefix': 'fa'}},
+    "Mairies":       {"tags": {"amenity": "townhall"},   "singular": "Mairie",       "poids": 1.0, "icon": {'icon': 'landmark', 'color': 'orange', 'prefix': 'fa'}},
+    "Supermarchés":  {"tags": {"shop": "supermarket"},  "singular": "Supermarché",  "poids": 2.0, "icon": {'icon': 'shopping-cart', 'color': 'purple', 'prefix': 'fa'}}
+}
+
+# Paramètres par défaut du scoring des emplacements (zones blanches)
+SCORING_CONFIG = {
+    "resolution_m": 200,            # Taille d'une cellule de la grille
+    "rayon_population_m": 2000,     # Rayon de captation de la population
+    "rayon_concurrence_m": 3000,    # Rayon d'influence d'un concurrent
+    "rayon_poi_m": 800,             # Rayon d'influence d'un générateur de flux
+    "poids": {"population": 1.0, "concurrence": 1.0, "poi": 0.5},
+    "nb_sites": 10,                 # Nombre de sites candidats retenus
+    "distance_min_sites_m": 1500,   # Écart minimal entre deux sites candidats
+    "couleurs": ['#2c7bb6', '#ffffbf', '#d7191c']
+}
+
+# Instrumentation des performances (voir instrumentation.py)
+INSTRUMENTATION_CONFIG = {
+    "actif": True,                                  # Journalisation de chaque exécution de page
+    "journal": "../logs/instrumentation.jsonl",     # Fichier JSON lines, agrégé par instrumentation.py
+    "taille_max_octets": 10 * 1024 ** 2             # Au-delà, le journal est archivé (.1) et recommencé
+}
+
+# Planification des requêtes de recherche d'établissements (voir planification_requetes.py)
+PLANIFICATION_CONFIG = {
+    "limite_communes": 200,         # Plafond historique de la stratégie "une requête par commune"
+    "limite_nominatim": 40,         # Nombre maximal de résultats renvoyés par Nominatim
+    "taille_tuile_km": 25,          # Côté des tuiles de la stratégie par emprise (viewbox)
+    "profondeur_max_tuiles": 2,     # Subdivisions successives d'une tuile saturée
+    "cout_nominatim_s": 1.0,        # Coût estimé d'une requête Nominatim (politique d'usage : 1 req/s)
+    "cout_overpass_s": 10.0,        # Coût fixe estimé d'une requête Overpass
+    "cout_overpass_par_dep_s": 3.0, # Surcoût Overpass par département couvert
+    # Objets retenus par la requête Overpass, en plus des commerces (shop=*) : les autres objets
+    # (voies, arrêts, lieux-dits...) partagent souvent le nom d'une enseigne ("Rue du Carrefour")
+    "amenites_commerciales": ["restaurant", "fast_food", "cafe", "bar", "pub", "fuel", "pharmacy",
+                              "bank", "car_rental", "car_wash", "cinema", "marketplace"]
+}
+
+# Passerelle commune aux sessions pour les API externes (voir passerelle_api.py) :
+# débit soutenu (requêtes/s) et rafale autorisée, par service
+PASSERELLE_CONFIG = {
+    "nominatim": {"debit_par_s": 1.0, "rafale": 1},    # Politique d'usage Nominatim : 1 requête/s
+    "overpass": {"debit_par_s": 0.5, "rafale": 2},     # Instance publique : 2 emplacements par IP
+    "ors": {"debit_par_s": 20.0, "rafale": 20}         # Instance ORS locale
+}
+
+# Client OpenRouteService : disjoncteur et sonde de santé (voir fonctions_api.py)
+ORS_CONFIG = {
+    "timeout_s": 10,                # Délai maximal d'un calcul d'isochrone
+    "seuil_echecs": 3,              # Échecs consécutifs avant ouverture du disjoncteur
+    "delai_reessai_s": 30,          # Durée d'ouverture avant une nouvelle sonde
+    "intervalle_sonde_s": 60,       # Sonde périodique quand le service est réputé disponible
+    "timeout_sonde_s": 2,           # Délai maximal de la sonde de santé
+    "vitesse_repli_kmh": 30         # Vitesse des cercles de repli (mode dégradé)
+}
+
+# Moteur d'isochrones local sur graphe routier (voir moteur_isochrones.py)
+MOTEUR_ISOCHRONES_CONFIG = {
+    "graphe": "../data/graphe_routier.npz",   # Graphe CSR produit par moteur_isochrones.py
+    "vitesse_defaut_kmh": 50,                 # Vitesse des voies sans maxspeed ni moyenne par type
+    "voies_carrossables": ["motorway", "motorway_link", "trunk", "trunk_link", "primary", "primary_link",
+                           "secondary", "secondary_link", "tertiary", "tertiary_link", "unclassified",
+                           "residential", "living_street", "road"],  # Valeurs highway conservées
+    "acces_interdits": ["no", "private"],     # Valeurs access écartées
+    "ratio_enveloppe": 0.3,                   # Concavité de l'enveloppe des nœuds atteints (0 à 1)
+    "marge_m": 150,                           # Marge autour des nœuds atteints
+    "pas_ancrage_m": 600,                     # Semis de nœuds intérieurs conservés pour l'enveloppe
+    "distance_max_reseau_m": 2000,            # Au-delà, l'établissement est jugé hors du graphe
+    "processus": 4,                           # Processus pour le calcul de nombreuses isochrones
+    "seuil_parallelisme": 20                  # Nombre d'isochrones à partir duquel on parallélise
+}
+
+# Couche socio-économique chargée selon la partie visible de la carte (voir fonctions_basiques.py)
+AFFICHAGE_SOCIO_CONFIG = {
+    "mailles_par_zoom": [(12, "IRIS"), (9, "Commune"), (0, "Département")],  # (zoom minimal, maille)
+    "max_polygones": 2500,      # Plafond de polygones chargés ; au-delà, maille plus grossière ou troncature
+    "marge_emprise": 0.25,      # Emprise chargée élargie de cette fraction autour de la vue
+    "pas_emprise_deg": 0.05     # Emprise arrondie à cette grille : un léger déplacement ne recharge rien
+}
+
+# Budget de volume de la carte envoyée au navigateur (voir budget_carte.py)
+BUDGET_CARTE_CONFIG = {
+    "budget_mo": 10,                        # Au-delà, le rendu est dégradé automatiquement
+    "tolerances_simplification_m": [250, 1000],   # Simplifications successives de la couche socio
+    "pas_agregation_m": 2000,               # Cellules de la grille d'agrégation des points
+    # Modèle de volume sérialisé (octets), calibré sur les fragments produits par fonctions_cartographie
+    "octets": {
+        "fond": 8_000,                  # Carte, tuiles, contrôle des couches
+        "socio_entite": 350,            # Par polygone (propriétés, style, infobulle)
+        "socio_sommet": 41,             # Par sommet de polygone
+        "marqueur": 1_300,              # Marqueur d'établissement avec popup et infobulle
+        "cercle": 490,                  # Cercle d'influence
+        "isochrone": 7_100,             # Isochrone (~150 sommets)
+        "marqueur_regroupe": 140,       # Établissement dans un FastMarkerCluster
+        "poi": 820,                     # Icône de POI avec infobulle
+        "poi_regroupe": 80,             # POI dans un FastMarkerCluster
+        "cellule": 700,                 # Cellule de la grille d'agrégation
+        "scoring_cellule": 2            # Cellule de la grille de score (image PNG)
+    }
+}
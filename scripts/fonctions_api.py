@@ -0,0 +1,324 @@
+# ==============================================
+# 📦 Imports & Librairies
+# ==============================================
+import os
+import re
+import threading
+import time
+import requests
+import pandas as pd
+import geopandas as gpd
+from config import ORS_CONFIG, PLANIFICATION_CONFIG
+from instrumentation import enregistrer_requete, compter
+from passerelle_api import cle_requete, executer
+
+# Fonctions d'accès aux API géospatiales (Nominatim, Overpass, ORS), sans dépendance à Streamlit :
+# elles lèvent ou retournent les erreurs au lieu de les afficher, pour être réutilisées
+# par l'application comme par les traitements en ligne de commande (batch.py).
+
+# Les adresses des services peuvent être redirigées par variables d'environnement
+# (instance Nominatim/ORS interne, serveurs factices du benchmark...).
+URL_NOMINATIM = os.environ.get("URL_NOMINATIM", "https://nominatim.openstreetmap.org/search")
+URL_OVERPASS = os.environ.get("URL_OVERPASS", "http://overpass-api.de/api/interpreter")
+URL_ORS_ISOCHRONES = os.environ.get("URL_ORS_ISOCHRONES", "http://localhost:8080/ors/v2/isochrones/driving-car")
+URL_ORS_SANTE = os.environ.get("URL_ORS_SANTE", URL_ORS_ISOCHRONES.split("/isochrones")[0] + "/health")
+HEADERS_NOMINATIM = {"User-Agent": "Streamlit_App_Geo"}
+
+
+def _requete_http(service, methode, url, **kwargs):
+    """
+    Exécute une requête HTTP via la passerelle commune (fusion des requêtes identiques, limitation
+    du débit par service) et l'enregistre dans l'instrumentation (durée, octets, statut).
+    """
+    def appel():
+        debut = time.perf_counter()
+        statut, octets = None, 0
+        try:
+            response = requests.request(methode, url, **kwargs)
+            statut, octets = response.status_code, len(response.content)
+            return response
+        finally:
+            enregistrer_requete(service, time.perf_counter() - debut, octets, statut)
+
+    return executer(service, cle_requete(methode, url, **kwargs), appel)
+
+
+# ==============================================
+# Section Nominatim (établissements)
+# ==============================================
+
+def requete_nominatim(nom, ville, max_etablissements=50):
+    """
+    Interroge Nominatim pour une enseigne dans une commune.
+
+    :return: Liste de dictionnaires au format des résultats de recherche.
+    :raises requests.exceptions.RequestException: En cas d'échec de la requête.
+    """
+    params = {"q": f"{nom}, {ville}, France", "format": "json", "limit": max_etablissements, "addressdetails": 1}
+    response = _requete_http("nominatim", "GET", URL_NOMINATIM, params=params, headers=HEADERS_NOMINATIM, timeout=20)
+    response.raise_for_status()
+    return [_resultat_nominatim(resultat, nom, ville) for resultat in response.json()]
+
+
+def requete_nominatim_emprise(nom, viewbox, max_etablissements=40):
+    """
+    Interroge Nominatim pour une enseigne dans une emprise rectangulaire (recherche bornée).
+
+    :param viewbox: Tuple (min_lon, min_lat, max_lon, max_lat).
+    :raises requests.exceptions.RequestException: En cas d'échec de la requête.
+    """
+    params = {"q": nom, "format": "json", "limit": max_etablissements, "addressdetails": 1, "countrycodes": "fr",
+              "viewbox": ",".join(str(round(c, 5)) for c in viewbox), "bounded": 1}
+    response = _requete_http("nominatim", "GET", URL_NOMINATIM, params=params, headers=HEADERS_NOMINATIM, timeout=20)
+    response.raise_for_status()
+    return [_resultat_nominatim(resultat, nom) for resultat in response.json()]
+
+
+def _resultat_nominatim(resultat, nom, ville=""):
+    """Convertit une réponse Nominatim au format des résultats de recherche (adresse structurée incluse)."""
+    adresse = resultat.get("address", {})
+    ville_osm = adresse.get("city") or adresse.get("town") or adresse.get("village") or adresse.get("municipality")
+    return {"nom_etablissement": nom, "ville": ville_osm or ville,
+            "nom_OSM": resultat.get("name", "N/A"), "adresse": resultat.get("display_name", ""),
+            "latitude": float(resultat.get("lat", 0)), "longitude": float(resultat.get("lon", 0)),
+            "osm_id": f"{resultat['osm_type']}/{resultat['osm_id']}" if resultat.get("osm_id") else None,
+            "numero": adresse.get("house_number"), "voie": adresse.get("road") or adresse.get("pedestrian")}
+
+
+def rechercher_etablissements(noms_etablissements, villes, max_etablissements=50, pause=0):
+    """
+    Recherche chaque enseigne dans chaque commune.
+
+    :param pause: Délai (s) entre deux requêtes, pour respecter la politique d'usage de Nominatim.
+    :return: Tuple (DataFrame des résultats, liste des erreurs rencontrées).
+    """
+    donnees, erreurs = [], []
+    for nom in noms_etablissements:
+        for ville in villes:
+            try:
+                donnees.extend(requete_nominatim(nom, ville, max_etablissements))
+            except requests.exceptions.RequestException as e:
+                erreurs.append(e)
+            if pause:
+                time.sleep(pause)
+    return pd.DataFrame(donnees), erreurs
+
+
+# ==============================================
+# Section Overpass (points d'intérêt)
+# ==============================================
+
+def rechercher_poi(bounding_box, tags_a_chercher):
+    """
+    Interroge l'API Overpass pour trouver des POI dans une zone géographique donnée.
+
+    :param bounding_box: Tuple (min_lon, min_lat, max_lon, max_lat)
+    :param tags_a_chercher: Dictionnaire de tags, ex: {"amenity": "school"}
+    :return: Un GeoDataFrame avec les POI trouvés.
+    :raises requests.exceptions.RequestException: En cas d'échec de la requête.
+    """
+    bbox_str = f"{bounding_box[1]},{bounding_box[0]},{bounding_box[3]},{bounding_box[2]}"
+
+    query_parts = []
+    for tag_key, tag_value in tags_a_chercher.items():
+        query_parts.append(f'node["{tag_key}"="{tag_value}"]({bbox_str});way["{tag_key}"="{tag_value}"]({bbox_str});')
+
+    full_query = f"""
+    [out:json][timeout:25];
+    (
+      {''.join(query_parts)}
+    );
+    out center;
+    """
+
+    response = _requete_http("overpass", "GET", URL_OVERPASS, params={'data': full_query})
+    response.raise_for_status()
+    data = response.json()
+
+    pois = []
+    for element in data.get('elements', []):
+        lon = element.get('lon')
+        lat = element.get('lat')
+        # Pour les 'ways' (routes, bâtiments), Overpass peut retourner le centre
+        if 'center' in element:
+            lon = element['center'].get('lon')
+            lat = element['center'].get('lat')
+
+        if lon and lat:
+            pois.append({
+                'name': element.get('tags', {}).get('name', 'N/A'),
+                'latitude': lat,
+                'longitude': lon
+            })
+
+    if not pois:
+        return gpd.GeoDataFrame()
+
+    df_pois = pd.DataFrame(pois)
+    return gpd.GeoDataFrame(
+        df_pois,
+        geometry=gpd.points_from_xy(df_pois['longitude'], df_pois['latitude']),
+        crs="EPSG:4326"
+    )
+
+
+def requete_overpass_enseignes(noms_etablissements, codes_departements):
+    """
+    Recherche en une seule requête Overpass toutes les enseignes dans les départements donnés
+    (zones administratives de niveau 6, par code INSEE), sur les tags name et brand des seuls
+    objets commerciaux (shop=*, amenity commerciale de PLANIFICATION_CONFIG).
+
+    :return: Liste de dictionnaires au format des résultats de recherche. La ville n'est renseignée
+        que si l'objet porte addr:city (voir planification_requetes.completer_villes).
+    :raises requests.exceptions.RequestException: En cas d'échec de la requête.
+    """
+    motif = "|".join(re.escape(nom) for nom in noms_etablissements)
+    motif = motif.replace("\\", "\\\\").replace('"', '\\"')  # Échappement dans une chaîne Overpass QL
+    codes = "|".join(codes_departements)
+    amenites = "|".join(PLANIFICATION_CONFIG["amenites_commerciales"])
+    selecteurs = [f'nwr{filtre}["{tag}"~"{motif}",i](area.zone);'
+                  for filtre in ('["shop"]', f'["amenity"~"^({amenites})$"]') for tag in ("name", "brand")]
+    full_query = f"""
+    [out:json][timeout:180];
+    area["ref:INSEE"~"^({codes})$"]["admin_level"="6"]["boundary"="administrative"]->.zone;
+    (
+      {''.join(selecteurs)}
+    );
+    out center tags;
+    """
+    response = _requete_http("overpass", "POST", URL_OVERPASS, data={'data': full_query}, timeout=200)
+    response.raise_for_status()
+
+    # Overpass filtre par sous-chaîne : on ne garde que les enseignes trouvées comme mot entier
+    motifs = [(nom, re.compile(rf"\b{re.escape(nom)}\b", re.IGNORECASE)) for nom in noms_etablissements]
+    resultats = []
+    for element in response.json().get('elements', []):
+        tags = element.get('tags', {})
+        lon, lat = element.get('lon'), element.get('lat')
+        if 'center' in element:
+            lon, lat = element['center'].get('lon'), element['center'].get('lat')
+        texte = f"{tags.get('name', '')} {tags.get('brand', '')}"
+        nom = next((n for n, motif_nom in motifs if motif_nom.search(texte)), None)
+        if lon is None or lat is None or nom is None:
+            continue
+        ville = tags.get('addr:city', '')
+        adresse = [tags.get('addr:housenumber'), tags.get('addr:street'), ville, tags.get('addr:postcode'), "France"]
+        resultats.append({"nom_etablissement": nom, "ville": ville, "nom_OSM": tags.get('name', 'N/A'),
+                          "adresse": ", ".join(a for a in adresse if a),
+                          "latitude": float(lat), "longitude": float(lon),
+                          "osm_id": f"{element.get('type')}/{element.get('id')}" if element.get('id') else None,
+                          "numero": tags.get('addr:housenumber'), "voie": tags.get('addr:street')})
+    return resultats
+
+
+# ==============================================
+# Section OpenRouteService (isochrones)
+# ==============================================
+
+class ORSIndisponible(requests.exceptions.RequestException):
+    """Levée sans appel réseau quand le disjoncteur ORS est ouvert."""
+
+
+class DisjoncteurORS:
+    """
+    Disjoncteur du service ORS, commun au processus : il s'ouvre après plusieurs échecs consécutifs
+    (ou une sonde de santé négative) et fait alors échouer immédiatement les appels. Passé le délai
+    de réessai, une sonde de santé décide de sa refermeture.
+
+    États : "ferme" (appels normaux), "ouvert" (échec immédiat).
+    """
+
+    def __init__(self):
+        self.verrou = threading.Lock()
+        self.etat, self.echecs_consecutifs = "ferme", 0
+        self.derniere_sonde, self.ouverture = None, None
+        self.dernier_message = None
+
+    def _sonder(self):
+        """Interroge l'endpoint de santé d'ORS ; True si le service est prêt."""
+        try:
+            response = _requete_http("ors_sante", "GET", URL_ORS_SANTE, timeout=ORS_CONFIG["timeout_sonde_s"])
+            response.raise_for_status()
+            return response.json().get("status") == "ready"
+        except (requests.exceptions.RequestException, ValueError) as e:
+            self.dernier_message = f"Sonde de santé : {e}"
+            return False
+
+    def autoriser(self):
+        """
+        Indique si un appel peut partir, en lançant la sonde de santé au premier appel, à intervalle
+        régulier, puis après le délai de réessai quand le disjoncteur est ouvert.
+        """
+        maintenant = time.monotonic()
+        with self.verrou:
+            if self.etat == "ouvert":
+                sonder = maintenant - self.ouverture >= ORS_CONFIG["delai_reessai_s"]
+            else:
+                sonder = self.derniere_sonde is None or \
+                    maintenant - self.derniere_sonde >= ORS_CONFIG["intervalle_sonde_s"]
+            if sonder:
+                self.derniere_sonde = maintenant
+                if self.etat == "ouvert":
+                    self.ouverture = maintenant  # Une seule sonde par délai de réessai
+        if sonder:
+            disponible = self._sonder()
+            with self.verrou:
+                if disponible:
+                    self.etat, self.echecs_consecutifs = "ferme", 0
+                else:
+                    self.etat, self.ouverture = "ouvert", time.monotonic()
+        return self.etat == "ferme"
+
+    def signaler_succes(self):
+        with self.verrou:
+            self.etat, self.echecs_consecutifs = "ferme", 0
+
+    def signaler_echec(self, erreur):
+        with self.verrou:
+            self.echecs_consecutifs += 1
+            self.dernier_message = str(erreur)
+            if self.echecs_consecutifs >= ORS_CONFIG["seuil_echecs"] and self.etat == "ferme":
+                self.etat, self.ouverture = "ouvert", time.monotonic()
+
+    def etat_courant(self):
+        """Résumé de l'état (pour affichage) : état, échecs consécutifs, dernier message d'erreur."""
+        with self.verrou:
+            return {"etat": self.etat, "echecs_consecutifs": self.echecs_consecutifs,
+                    "message": self.dernier_message}
+
+
+DISJONCTEUR_ORS = DisjoncteurORS()
+
+
+def calculer_isochrone(longitude, latitude, temps_secondes):
+    """
+    Appelle l'API ORS et retourne la feature GeoJSON de l'isochrone (ou None si vide, ou si ORS
+    refuse le point : erreur client, ex. point non routable).
+
+    :raises ORSIndisponible: Sans appel réseau, si le disjoncteur ORS est ouvert.
+    :raises requests.exceptions.RequestException: En cas d'échec du service (délai, erreur 5xx...).
+    """
+    if not DISJONCTEUR_ORS.autoriser():
+        compter("ors.echecs_immediats")
+        raise ORSIndisponible("Service ORS indisponible (disjoncteur ouvert)")
+    try:
+        response = _requete_http("ors", "POST", URL_ORS_ISOCHRONES,
+                                 json={"locations": [[longitude, latitude]], "range": [temps_secondes]},
+                                 headers={'Content-Type': 'application/json'}, timeout=ORS_CONFIG["timeout_s"])
+        response.raise_for_status()
+    except requests.exceptions.HTTPError as e:
+        # Une erreur client (ex: point non routable) ne met pas en cause la disponibilité du service :
+        # pas d'isochrone pour ce point, sans mode dégradé (hors surcharge : 408, 429)
+        statut = e.response.status_code if e.response is not None else None
+        if statut is not None and statut < 500 and statut not in (408, 429):
+            DISJONCTEUR_ORS.signaler_succes()
+            compter("ors.erreurs_client")
+            return None
+        DISJONCTEUR_ORS.signaler_echec(e)
+        raise
+    except requests.exceptions.RequestException as e:
+        DISJONCTEUR_ORS.signaler_echec(e)
+        raise
+    DISJONCTEUR_ORS.signaler_succes()
+    features = response.json().get('features')
+    return features[0] if features else None
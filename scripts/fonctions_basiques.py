@@ -1,36 +1,46 @@
 # ==============================================
 # 📦 Imports & Librairies
 # ==============================================
+import warnings
 import pandas as pd
 import streamlit as st
 import numpy as np
 import geopandas as gpd
+import shapely
+from config import AFFICHAGE_SOCIO_CONFIG
+from instrumentation import suivre_cache, marquer_calcul
 
 # ==============================================
 # Section chargement des données
 # ==============================================
 
+@suivre_cache("etablissements")
 @st.cache_data(show_spinner=False)
 def charger_etablissements(path_etablissement):
     """Charge les données des établissements depuis un fichier Parquet."""
+    marquer_calcul("etablissements")
     try:
         return pd.read_parquet(path_etablissement)
     except FileNotFoundError:
         st.error(f"Fichier des établissements introuvable : {path_etablissement}")
         return pd.DataFrame()
 
+@suivre_cache("centres_departements")
 @st.cache_data(show_spinner=False)
 def charger_centres_departements(path_centres_dpt):
     """Charge les données des centres de départements depuis un fichier Excel."""
+    marquer_calcul("centres_departements")
     try:
         return pd.read_excel(path_centres_dpt)
     except FileNotFoundError:
         st.error(f"Fichier des centres de départements introuvable : {path_centres_dpt}")
         return pd.DataFrame()
 
+@suivre_cache("communes")
 @st.cache_data(show_spinner=False)
 def charger_communes(path_communes):
     """Charge les données des communes depuis un fichier Excel."""
+    marquer_calcul("communes")
     try:
         df = pd.read_excel(path_communes)
         if 'Num_Dep' in df.columns:
@@ -43,18 +53,22 @@ def charger_communes(path_communes):
         st.error(f"Fichier des communes introuvable : {path_communes}")
         return pd.DataFrame()
 
+@suivre_cache("iris_socio")
 @st.cache_data(show_spinner=False)
 def charger_donnees_iris_socio(path_iris_socio):
     """Charge le GeoDataFrame des données IRIS depuis un fichier Parquet."""
+    marquer_calcul("iris_socio")
     try:
         return gpd.read_parquet(path_iris_socio)
     except FileNotFoundError:
         st.error(f"Fichier de données socio-économiques introuvable au chemin : {path_iris_socio}")
         return None
 
+@suivre_cache("coefficients_trafic")
 @st.cache_data(show_spinner=False)
 def charger_coefficients_trafic(path_coeff_trafic):
     """Charge la table des coefficients de trafic par ville."""
+    marquer_calcul("coefficients_trafic")
     try:
         return pd.read_excel(path_coeff_trafic)
     except FileNotFoundError:
@@ -98,16 +112,85 @@ def choix_centre_departement(data, centres_departements):
 # Fonctions pour la page OSM (OPTIMISÉES)
 # ==============================================
 
-def extraction_adresse_OSM(ligne_etab):
-    """Extrait une adresse simplifiée et définit une précision de géocodage pour la sortie OSM."""
-    adresse_ini = ligne_etab["adresse"].split(", ")
-    if adresse_ini[0].isdigit():
-        adresse_simp = ", ".join(adresse_ini[:4])
-        precision_geocodage = "numero"
-    else:
-        adresse_simp = ", ".join(adresse_ini[:3])
-        precision_geocodage = "voie"
-    return pd.Series([adresse_simp, precision_geocodage])
+def normaliser_adresses(df_etab):
+    """
+    Ajoute une adresse simplifiée et une précision de géocodage, de manière vectorisée : à partir de
+    l'adresse structurée (numéro, voie) quand elle existe, sinon du découpage de l'adresse complète.
+    """
+    df_etab = df_etab.copy()
+    parties = df_etab["adresse"].fillna("").str.split(", ", n=4, expand=True).reindex(columns=range(5))
+    commence_par_numero = parties[0].str.isdigit().fillna(False)
+    adresse_decoupee = parties[0].str.cat(parties[[1, 2]], sep=", ", na_rep="").where(
+        ~commence_par_numero, parties[0].str.cat(parties[[1, 2, 3]], sep=", ", na_rep="")).str.rstrip(", ")
+
+    numero = df_etab["numero"] if "numero" in df_etab else pd.Series(None, index=df_etab.index, dtype=object)
+    voie = df_etab["voie"] if "voie" in df_etab else pd.Series(None, index=df_etab.index, dtype=object)
+    adresse_structuree = (numero.fillna("").astype(str) + " " + voie.fillna("").astype(str)).str.strip() \
+        + ", " + df_etab["ville"].fillna("").astype(str)
+    structuree = voie.notna()
+
+    df_etab["adresse_simplifiee"] = adresse_structuree.where(structuree, adresse_decoupee)
+    df_etab["precision_geocodage"] = np.where(numero.notna() | (~structuree & commence_par_numero),
+                                              "numero", "voie")
+    return df_etab
+
+
+def dedoublonner_etablissements(df_etab, tolerance_m=50):
+    """
+    Supprime les établissements retournés plusieurs fois (requêtes voisines) : même identifiant OSM,
+    puis même enseigne à moins de tolerance_m mètres d'un établissement conservé (hachage spatial sur
+    une grille de ce pas, comparaison avec les cellules voisines). La comparaison se fait avec les
+    établissements conservés, pas de proche en proche : dans une chaîne A-B-C espacée de 40 m, seul
+    B est retiré.
+
+    :return: Tuple (DataFrame dédoublonné, dictionnaire du nombre de doublons retirés par critère).
+    """
+    rapport = {"identifiant_osm": 0, "proximite": 0}
+    if df_etab.empty:
+        return df_etab, rapport
+
+    if "osm_id" in df_etab:
+        doublons_id = df_etab["osm_id"].notna() & df_etab.duplicated("osm_id")
+        rapport["identifiant_osm"] = int(doublons_id.sum())
+        df_etab = df_etab[~doublons_id]
+    df_etab = df_etab.reset_index(drop=True)
+
+    # Coordonnées locales en mètres (approximation équirectangulaire, suffisante à cette échelle)
+    y = df_etab["latitude"].to_numpy() * 110_540
+    x = df_etab["longitude"].to_numpy() * 111_320 * np.cos(np.radians(df_etab["latitude"].to_numpy()))
+    points = pd.DataFrame({"idx": df_etab.index, "enseigne": df_etab["nom_etablissement"].str.lower(),
+                           "x": x, "y": y, "cx": np.floor(x / tolerance_m).astype(np.int64),
+                           "cy": np.floor(y / tolerance_m).astype(np.int64)})
+
+    # Chaque point est comparé aux points de même enseigne de sa cellule et des 8 voisines
+    voisins = pd.concat([points.assign(cx=points["cx"] + dx, cy=points["cy"] + dy)
+                         for dx in (-1, 0, 1) for dy in (-1, 0, 1)])
+    paires = voisins.merge(points, on=["enseigne", "cx", "cy"], suffixes=("", "_autre"))
+    paires = paires[(paires["idx_autre"] < paires["idx"])
+                    & (np.hypot(paires["x"] - paires["x_autre"], paires["y"] - paires["y_autre"]) <= tolerance_m)]
+    # Parcours dans l'ordre des index : un point n'est retiré que si un point antérieur proche a été
+    # conservé (ses voisins antérieurs sont tous tranchés quand vient son tour)
+    paires = paires.sort_values(["idx", "idx_autre"])
+    conserve = np.ones(len(df_etab), dtype=bool)
+    for idx, idx_autre in zip(paires["idx"].to_numpy(), paires["idx_autre"].to_numpy()):
+        if conserve[idx_autre]:
+            conserve[idx] = False
+    doublons_proches = ~conserve
+    rapport["proximite"] = int(doublons_proches.sum())
+    return df_etab[~doublons_proches].reset_index(drop=True), rapport
+
+
+def normaliser_resultats(df_etab, tolerance_m=50):
+    """
+    Étape de normalisation des résultats de recherche, avant cartographie : dédoublonnage
+    puis adresses simplifiées.
+
+    :return: Tuple (DataFrame normalisé, rapport du dédoublonnage).
+    """
+    df_etab, rapport = dedoublonner_etablissements(df_etab, tolerance_m)
+    if df_etab.empty:
+        return df_etab, rapport
+    return normaliser_adresses(df_etab), rapport
 
 def choix_centre_OSM(data):
     """Laisse à l'utilisateur le choix de la ville pour centrer la carte."""
@@ -119,19 +202,31 @@ def choix_centre_OSM(data):
     return lat_centre, lon_centre
 
 
+@suivre_cache("preparation_socio")
 @st.cache_data(show_spinner=False)
 def preparer_donnees_socio(_df_iris_base, _df_communes_france):
     """
     Nettoie, enrichit, simplifie et prépare les données socio-économiques en gérant
     les données partielles et les populations nulles.
     """
-    df = _df_iris_base.copy()
+    marquer_calcul("preparation_socio")
+    return calculer_donnees_socio(_df_iris_base, _df_communes_france, alerte=st.warning)
+
+
+def calculer_donnees_socio(df_iris_base, df_communes_france, alerte=warnings.warn):
+    """
+    Cœur de preparer_donnees_socio, sans cache ni interface (réutilisé par le mode batch).
+
+    :param alerte: Fonction appelée avec le message en cas d'avertissement.
+    :return: Dictionnaire {"IRIS", "Commune", "Département"} de GeoDataFrames.
+    """
+    df = df_iris_base.copy()
     try:
         df['geometry'] = df['geometry'].simplify(tolerance=100, preserve_topology=True)
     except Exception as e:
-        st.warning(f"Avertissement lors de la simplification des géométries : {e}")
+        alerte(f"Avertissement lors de la simplification des géométries : {e}")
 
-    df_ref_deps = _df_communes_france[['Num_Dep', 'Nom_Dep']].drop_duplicates()
+    df_ref_deps = df_communes_france[['Num_Dep', 'Nom_Dep']].drop_duplicates()
     df_ref_deps['Num_Dep'] = df_ref_deps['Num_Dep'].astype(str).str.zfill(2)
 
     df['CODE_COM'] = df['IRIS'].str.slice(0, 5)
@@ -227,4 +322,101 @@ def preparer_donnees_socio(_df_iris_base, _df_communes_france):
             colonnes_presentes = [col for col in cols_a_vider_final if col in dframe.columns]
             dframe.loc[lignes_a_modifier, colonnes_presentes] = np.nan
 
-    return {"IRIS": df, "Commune": df_commune, "Département": df_departement}
\ No newline at end of file
+    return {"IRIS": df, "Commune": df_commune, "Département": df_departement}
+
+# ==============================================
+# Section couche socio selon la vue de la carte
+# ==============================================
+
+MAILLES_SOCIO = ['IRIS', 'Commune', 'Département']  # De la plus fine à la plus grossière
+
+
+def maille_pour_zoom(zoom):
+    """Maille socio-économique adaptée au niveau de zoom de la carte."""
+    return next(maille for zoom_min, maille in AFFICHAGE_SOCIO_CONFIG["mailles_par_zoom"] if zoom >= zoom_min)
+
+
+def zoom_pour_emprise(emprise, largeur_px=800):
+    """Niveau de zoom (tuiles web de 256 px) qui fait tenir l'emprise (EPSG:4326) dans la largeur de la carte."""
+    largeur_deg = max(emprise[2] - emprise[0], (emprise[3] - emprise[1]) * 1.5, 1e-3)
+    return int(np.clip(np.floor(np.log2(largeur_px * 360 / (256 * largeur_deg))), 1, 18))
+
+
+def emprise_de_chargement(emprise):
+    """
+    Élargit l'emprise visible d'une marge puis l'arrondit vers l'extérieur sur une grille fixe :
+    les petits déplacements de la carte donnent la même emprise, donc la même couche en cache.
+    """
+    config = AFFICHAGE_SOCIO_CONFIG
+    min_lon, min_lat, max_lon, max_lat = emprise
+    marge_lon, marge_lat = (max_lon - min_lon) * config["marge_emprise"], (max_lat - min_lat) * config["marge_emprise"]
+    pas = config["pas_emprise_deg"]
+    return (float(np.floor((min_lon - marge_lon) / pas) * pas), float(np.floor((min_lat - marge_lat) / pas) * pas),
+            float(np.ceil((max_lon + marge_lon) / pas) * pas), float(np.ceil((max_lat + marge_lat) / pas) * pas))
+
+
+@suivre_cache("index_socio")
+@st.cache_resource(show_spinner=False)
+def index_spatial_socio(cle, _gdf):
+    """
+    Index spatial (STRtree) des polygones d'une maille, construit une fois par processus
+    (cache_resource : l'index est partagé, sans copie, entre les reruns et les sessions).
+
+    :param cle: Clé de l'index (maille, nombre d'entités, emprise totale).
+    """
+    marquer_calcul("index_socio")
+    return shapely.STRtree(_gdf.geometry.values)
+
+
+def _polygones_dans_emprise(gdf, maille, emprise):
+    """Indices des polygones de la maille qui touchent l'emprise (EPSG:4326)."""
+    index = index_spatial_socio((maille, len(gdf), tuple(gdf.total_bounds)), gdf)
+    boite = gpd.GeoSeries([shapely.box(*emprise)], crs="EPSG:4326").to_crs(gdf.crs).iloc[0]
+    return np.sort(index.query(boite, predicate="intersects")), boite
+
+
+def selectionner_socio_visible(dict_geodatas, maille, emprise, zoom):
+    """
+    Sélectionne les polygones socio-économiques à afficher pour la vue courante de la carte.
+
+    :param maille: Maille demandée, ou "Automatique" pour la déduire du zoom.
+    :param emprise: Emprise visible (min_lon, min_lat, max_lon, max_lat) en EPSG:4326.
+    :return: Tuple (GeoDataFrame ou None, maille retenue, informations sur la sélection).
+    """
+    max_polygones = AFFICHAGE_SOCIO_CONFIG["max_polygones"]
+    emprise_chargee = emprise_de_chargement(emprise)
+    automatique = maille == "Automatique"
+    maille_depart = maille_pour_zoom(zoom) if automatique else maille
+    # En automatique, on passe à une maille plus grossière tant que le plafond est dépassé
+    candidates = MAILLES_SOCIO[MAILLES_SOCIO.index(maille_depart):] if automatique else [maille_depart]
+    candidates = [m for m in candidates if dict_geodatas.get(m) is not None]
+    if not candidates:
+        return None, maille_depart, {"nb_polygones": 0, "nb_dans_emprise": 0, "tronque": False}
+
+    for maille_retenue in candidates:
+        gdf = dict_geodatas[maille_retenue]
+        indices, boite = _polygones_dans_emprise(gdf, maille_retenue, emprise_chargee)
+        if len(indices) <= max_polygones:
+            break
+
+    info = {"nb_polygones": len(indices), "nb_dans_emprise": len(indices), "tronque": False,
+            "maille_demandee": maille_depart, "emprise": emprise_chargee}
+    if len(indices) > max_polygones:
+        # Plafond dépassé même à la maille la plus grossière : on garde les polygones les plus centraux
+        distances = shapely.distance(gdf.geometry.values[indices], shapely.centroid(boite))
+        indices = np.sort(indices[np.argsort(distances, kind="stable")[:max_polygones]])
+        info.update(nb_polygones=len(indices), tronque=True)
+    return gdf.iloc[indices], maille_retenue, info
+
+
+def socio_maille_superieure(dict_geodatas, maille, emprise, zoom):
+    """
+    Sélection de la vue à la maille immédiatement plus grossière (utilisée par adapter_au_budget).
+
+    :return: Tuple (GeoDataFrame, maille), ou (None, None) si la maille est déjà la plus grossière.
+    """
+    if maille not in MAILLES_SOCIO or maille == MAILLES_SOCIO[-1]:
+        return None, None
+    gdf, maille_superieure, _ = selectionner_socio_visible(
+        dict_geodatas, MAILLES_SOCIO[MAILLES_SOCIO.index(maille) + 1], emprise, zoom)
+    return (gdf, maille_superieure) if gdf is not None else (None, None)
@@ -1,12 +1,26 @@
+import atexit
+import hashlib
 import folium
+import folium.plugins
 import geopandas as gpd
+import numpy as np
 import pandas as pd
 import requests
-import time
 import streamlit as st
 import branca.colormap as cm
-from streamlit_folium import st_folium
-from config import POI_CONFIG
+from branca.element import CssLink, Element, JavascriptLink
+from folium.elements import JSCSSMixin
+from concurrent.futures.process import BrokenProcessPool
+from jinja2 import Template
+from streamlit_folium import st_folium, _get_header, _get_html, _get_map_string
+from config import POI_CONFIG, ORS_CONFIG, MOTEUR_ISOCHRONES_CONFIG, BUDGET_CARTE_CONFIG
+from budget_carte import cellules_agregation
+from fonctions_scoring import (couches_scoring, zone_depuis_departements, preparer_population_scoring,
+                               calculer_scores_grille, selectionner_meilleurs_sites)
+from fonctions_api import rechercher_poi, calculer_isochrone
+from planification_requetes import executer_requete, planifier_recherche
+from moteur_isochrones import calculer_isochrones_locales, creer_pool_isochrones
+from instrumentation import suivre_cache, marquer_calcul, mesurer
 
 
 # ==============================================
@@ -73,47 +87,102 @@ def choix_carte(data, lat_centre, lon_centre):
 # Section des fonctions pour la page OSM (OPTIMISÉES)
 # =================================================================
 
-@st.cache_data
-def recherche_etablissements_osm(noms_etablissements, villes, max_etablissements=50):
-    """Recherche des établissements via Nominatim et met le résultat en cache."""
-    url, headers, donnees = "https://nominatim.openstreetmap.org/search", {"User-Agent": "Streamlit_App_Geo"}, []
-    if len(villes) > 200:
-        st.warning(f"Recherche limitée aux 200 premières communes sur {len(villes)}.")
-        villes = villes[:200]
-    for nom in noms_etablissements:
-        for ville in villes:
-            params = {"q": f"{nom}, {ville}, France", "format": "json", "limit": max_etablissements,
-                      "addressdetails": 1}
-            try:
-                response = requests.get(url, params=params, headers=headers, timeout=20)
-                response.raise_for_status()
-                for resultat in response.json():
-                    donnees.append({"nom_etablissement": nom, "ville": resultat.get("address", {}).get("city", ville),
-                                    "nom_OSM": resultat.get("name", "N/A"), "adresse": resultat.get("display_name", ""),
-                                    "latitude": float(resultat.get("lat", 0)),
-                                    "longitude": float(resultat.get("lon", 0))})
-            except requests.exceptions.RequestException as e:
-                st.error(f"Erreur Nominatim : {e}")
-    df = pd.DataFrame(donnees)
-    if not df.empty:
-        st.success(f"{len(df)} établissement(s) trouvé(s).")
-    else:
-        st.info("Aucun établissement trouvé.")
-    return df
+@suivre_cache("plan_recherche")
+@st.cache_data(show_spinner=False, max_entries=32)
+def planifier_recherche_en_cache(noms_etablissements, maille, selection_geo, _df_communes, _df_departements=None,
+                                 _gdf_communes=None):
+    """
+    Plans de requêtes d'une sélection (voir planification_requetes.py), avec cache : l'union des
+    départements et le découpage en tuiles ne sont refaits qu'au changement d'enseignes ou de zone.
 
+    :param noms_etablissements, selection_geo: Tuples, seuls pris en compte par le cache avec la maille
+        (les données de référence sont chargées une fois pour toutes).
+    """
+    marquer_calcul("plan_recherche")
+    return planifier_recherche(list(noms_etablissements), maille, list(selection_geo), _df_communes,
+                               _df_departements, _gdf_communes)
 
-@st.cache_data
+
+@suivre_cache("scoring")
+@st.cache_resource(show_spinner=False, max_entries=4)
+def scorer_emplacements_en_cache(codes_deps, categories_poi, parametres, nb_sites, cle_concurrents,
+                                 _df_departements, _df_iris, _gdf_concurrents):
+    """
+    Scoring des emplacements d'une zone (union des départements, POI de la zone, grille de scores,
+    sites candidats), mis en cache sur ses entrées : un rerun (déplacement de la carte, mode
+    d'affichage...) ne refait ni les requêtes ni les convolutions. cache_resource : les grilles,
+    volumineuses, sont partagées sans copie (elles ne sont que lues).
+
+    :param codes_deps, categories_poi: Tuples.
+    :param cle_concurrents: Empreinte des concurrents (voir empreinte_gdf).
+    :return: Tuple (résultat de calculer_scores_grille, sites candidats), ou (None, None) si la zone est vide.
+    """
+    marquer_calcul("scoring")
+    zone = zone_depuis_departements(_df_departements, list(codes_deps))
+    if zone is None:
+        return None, None
+    bbox_zone = gpd.GeoSeries([zone], crs="EPSG:3857").to_crs("EPSG:4326").total_bounds
+    liste_gdf_poi = []
+    for categorie in categories_poi:
+        gdf_resultat = rechercher_poi_osm(tuple(bbox_zone), POI_CONFIG[categorie]['tags'])
+        if not gdf_resultat.empty:
+            gdf_resultat['categorie'] = categorie
+            liste_gdf_poi.append(gdf_resultat)
+    gdf_poi = pd.concat(liste_gdf_poi, ignore_index=True) if liste_gdf_poi else None
+
+    resultat = calculer_scores_grille(zone, preparer_population_scoring(_df_iris), gdf_concurrents=_gdf_concurrents,
+                                      gdf_poi=gdf_poi, parametres=parametres)
+    return resultat, selectionner_meilleurs_sites(resultat, nb_sites)
+
+
+@suivre_cache("requete_planifiee")
+@st.cache_data(show_spinner=False)
+def executer_requete_en_cache(requete):
+    """Exécute une requête d'un plan de recherche (voir planification_requetes.py), avec cache."""
+    marquer_calcul("requete_planifiee")
+    return executer_requete(requete)
+
+
+@suivre_cache("isochrones")
+@st.cache_data(show_spinner=False)
 def calculer_isochrone_et_cacher(longitude, latitude, temps_secondes):
-    """Appelle l'API ORS et met le résultat en cache."""
+    """
+    Appelle l'API ORS et met le résultat en cache. Les erreurs (dont ORSIndisponible) sont propagées
+    pour ne pas être mises en cache : l'appelant bascule alors sur un cercle de repli.
+    """
+    marquer_calcul("isochrones")
+    return calculer_isochrone(longitude, latitude, temps_secondes)
+
+
+@st.cache_resource(show_spinner=False)
+def pool_isochrones(chemin_graphe, processus):
+    """
+    Pool de calcul des isochrones locales, créé au premier calcul et partagé entre les reruns et
+    les sessions (cache_resource) ; ses processus sont arrêtés avec le serveur.
+    """
+    pool = creer_pool_isochrones(chemin_graphe, processus)
+    atexit.register(pool.shutdown, wait=False, cancel_futures=True)
+    return pool
+
+
+@suivre_cache("isochrones_locales")
+@st.cache_data(show_spinner=False)
+def calculer_isochrones_locales_en_cache(points, chemin_graphe):
+    """
+    Calcule les isochrones de tous les établissements sur le graphe routier local, en parallèle.
+
+    :param points: Tuple de tuples (longitude, latitude, temps_secondes).
+    """
+    marquer_calcul("isochrones_locales")
+    processus = MOTEUR_ISOCHRONES_CONFIG["processus"]
     try:
-        response = requests.post("http://localhost:8080/ors/v2/isochrones/driving-car",
-                                 json={"locations": [[longitude, latitude]], "range": [temps_secondes]},
-                                 headers={'Content-Type': 'application/json'}, timeout=30)
-        response.raise_for_status()
-        if response.json().get('features'): return response.json()['features'][0]
-    except requests.exceptions.RequestException as e:
-        st.error(f"Erreur de calcul isochrone : {e}")
-    return None
+        return calculer_isochrones_locales(chemin_graphe, list(points), processus,
+                                           pool=pool_isochrones(chemin_graphe, processus))
+    except BrokenProcessPool:
+        # Un processus de calcul a disparu (ex: mémoire) : le pool est recréé pour cet appel et les suivants
+        pool_isochrones.clear()
+        return calculer_isochrones_locales(chemin_graphe, list(points), processus,
+                                           pool=pool_isochrones(chemin_graphe, processus))
 
 
 # Dictionnaire pour associer une icône à chaque type de POI
@@ -128,6 +197,7 @@ POI_ICONS = {
 }
 
 
+@suivre_cache("poi")
 @st.cache_data
 def rechercher_poi_osm(bounding_box, tags_a_chercher):
     """
@@ -137,171 +207,467 @@ def rechercher_poi_osm(bounding_box, tags_a_chercher):
     :param tags_a_chercher: Dictionnaire de tags, ex: {"amenity": "school"}
     :return: Un GeoDataFrame avec les POI trouvés.
     """
-    overpass_url = "http://overpass-api.de/api/interpreter"
-    bbox_str = f"{bounding_box[1]},{bounding_box[0]},{bounding_box[3]},{bounding_box[2]}"
-
-    query_parts = []
-    for tag_key, tag_value in tags_a_chercher.items():
-        query_parts.append(f'node["{tag_key}"="{tag_value}"]({bbox_str});way["{tag_key}"="{tag_value}"]({bbox_str});')
-
-    full_query = f"""
-    [out:json][timeout:25];
-    (
-      {''.join(query_parts)}
-    );
-    out center;
-    """
-
+    marquer_calcul("poi")
     try:
-        response = requests.get(overpass_url, params={'data': full_query})
-        response.raise_for_status()
-        data = response.json()
-
-        pois = []
-        for element in data.get('elements', []):
-            lon = element.get('lon')
-            lat = element.get('lat')
-            # Pour les 'ways' (routes, bâtiments), Overpass peut retourner le centre
-            if 'center' in element:
-                lon = element['center'].get('lon')
-                lat = element['center'].get('lat')
-
-            if lon and lat:
-                pois.append({
-                    'name': element.get('tags', {}).get('name', 'N/A'),
-                    'latitude': lat,
-                    'longitude': lon
-                })
-
-        if not pois:
-            return gpd.GeoDataFrame()
-
-        df_pois = pd.DataFrame(pois)
-        gdf = gpd.GeoDataFrame(
-            df_pois,
-            geometry=gpd.points_from_xy(df_pois['longitude'], df_pois['latitude']),
-            crs="EPSG:4326"
-        )
-        return gdf
-
+        return rechercher_poi(bounding_box, tags_a_chercher)
     except requests.exceptions.RequestException as e:
         st.error(f"Erreur de requête Overpass : {e}")
         return gpd.GeoDataFrame()
 
 
+# ==============================================
+# Section couches sérialisées (mémoïsation par couche)
+# ==============================================
+# Chaque couche de la carte est rendue une fois en fragments HTML/JS (sans carte cible), mis en
+# cache selon ses seules entrées : un rerun qui ne touche qu'une couche (ex: rayon des cercles) ne
+# reconstruit et ne resérialise que celle-ci. Les fragments référencent une carte fictive dont le
+# nom est remplacé, au rendu, par celui de la carte réelle.
+
+NOM_CARTE_FRAGMENT = "carte_fragment_0"
+
+
+class _CoucheNonMemorisable(Exception):
+    """Transporte le résultat d'une couche qui ne doit pas être mise en cache (ex: mode dégradé)."""
+
+    def __init__(self, resultat):
+        super().__init__("Couche non mémorisable")
+        self.resultat = resultat
+
+
+class _FragmentBrut(Element):
+    """Fragment déjà rendu : inséré tel quel, sans repasser par le moteur de templates."""
+
+    def __init__(self, contenu):
+        super().__init__()
+        self.contenu = contenu
+
+    def render(self, **kwargs):
+        return self.contenu
+
+
+class CoucheSerialisee(JSCSSMixin, folium.map.Layer):
+    """
+    Couche déjà rendue en fragments (voir serialiser_couche), réinsérée telle quelle dans une carte.
+
+    Les fragments de script passent par la macro script du modèle, comme pour tout élément folium :
+    st_folium reconstruit la carte à partir de ces macros et n'envoie pas figure.script. Les
+    bibliothèques JS/CSS sont exposées via default_js/default_css (JSCSSMixin), que st_folium collecte.
+    """
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+            {{ this.script_couche() }}
+        {% endmacro %}
+        """)
+
+    def __init__(self, couche):
+        super().__init__(name=couche["nom"], overlay=couche["overlay"], control=couche["control"],
+                         show=couche["show"])
+        self.couche = couche
+        self.default_js = list(couche["js"])
+        self.default_css = list(couche["css"])
+
+    def get_name(self):
+        # Nom de la variable JavaScript de la couche : utilisé par le LayerControl
+        return self.couche["variable"]
+
+    def script_couche(self):
+        nom_carte = self._parent.get_name()
+        return "\n".join(contenu.replace(NOM_CARTE_FRAGMENT, nom_carte) for _, contenu in self.couche["script"])
+
+    def render(self, **kwargs):
+        # Pas de Layer.render : l'ajout de la couche à la carte fait déjà partie des fragments
+        figure = self.get_root()
+        nom_carte = self._parent.get_name()
+        for nom, url in self.default_js:
+            figure.header.add_child(JavascriptLink(url), name=nom)
+        for nom, url in self.default_css:
+            figure.header.add_child(CssLink(url), name=nom)
+        for partie in ("header", "html"):
+            for nom, contenu in self.couche[partie]:
+                getattr(figure, partie).add_child(_FragmentBrut(contenu.replace(NOM_CARTE_FRAGMENT, nom_carte)),
+                                                  name=nom)
+        figure.script.add_child(_FragmentBrut(self._template.module.script(self, kwargs)), name=self.get_name())
+
+
+def _bibliotheques(element):
+    """Bibliothèques JS et CSS (listes de (nom, url)) requises par un élément folium et ses descendants."""
+    js, css = {}, {}
+    elements = [element]
+    while elements:
+        courant = elements.pop()
+        if isinstance(courant, JSCSSMixin):
+            js.update(courant.default_js)
+            css.update(courant.default_css)
+        elements.extend(courant._children.values())
+    return list(js.items()), list(css.items())
+
+
+def serialiser_couche(couche):
+    """
+    Rend une couche folium (et ses enfants) hors de toute carte réelle.
+
+    :return: Dictionnaire des fragments header/html/script (listes de (nom, contenu)), des
+        bibliothèques JS/CSS requises et des attributs de la couche (variable JavaScript, nom,
+        overlay, control, show).
+    """
+    carte = folium.Map(tiles=None)
+    carte._name, carte._id = "carte", "fragment_0"
+    couche.add_to(carte)
+    figure = carte.get_root()
+    existants = {partie: set(getattr(figure, partie)._children) for partie in ("header", "html", "script")}
+    js, css = _bibliotheques(couche)
+    couche.render()
+    fragments = {partie: [(nom, element.render()) for nom, element in getattr(figure, partie)._children.items()
+                          if nom not in existants[partie]]
+                 for partie in ("header", "html", "script")}
+    # Les liens de bibliothèques du header sont remplacés par default_js/default_css
+    liens = {nom for nom, _ in js + css}
+    fragments["header"] = [(nom, contenu) for nom, contenu in fragments["header"] if nom not in liens]
+    octets = sum(len(contenu.encode()) for partie in fragments.values() for _, contenu in partie)
+    return {**fragments, "js": js, "css": css, "variable": couche.get_name(), "nom": couche.layer_name,
+            "overlay": couche.overlay, "control": couche.control, "show": couche.show, "octets": octets}
+
+
+def volume_carte(carte):
+    """
+    Estimation du volume (octets) de la carte envoyée au navigateur, sans la rendre : taille des
+    fragments des couches sérialisées, mesurée une fois à leur mise en cache, plus le fond de carte
+    du modèle de BUDGET_CARTE_CONFIG. Le volume réel est donné par volume_transmis.
+    """
+    return BUDGET_CARTE_CONFIG["octets"]["fond"] + sum(
+        enfant.couche["octets"] for enfant in carte._children.values() if isinstance(enfant, CoucheSerialisee))
+
+
+def volume_transmis(carte):
+    """
+    Volume (octets) réellement transmis par st_folium : script Leaflet, en-tête (sans les liens vers
+    les bibliothèques) et html de la carte. Appeler après st_folium : la génération du script
+    renomme les éléments de la carte.
+    """
+    return sum(len(partie.encode()) for partie in (_get_map_string(carte), _get_header(carte), _get_html(carte)))
+
+
+def empreinte_gdf(gdf, colonnes=()):
+    """Empreinte rapide d'un (Geo)DataFrame pour les clés de cache : index, colonnes choisies, emprises."""
+    if gdf is None or gdf.empty:
+        return None
+    donnees = gdf[[c for c in colonnes if c in gdf.columns]]
+    if isinstance(gdf, gpd.GeoDataFrame) and gdf.geometry.name in gdf.columns:
+        donnees = pd.concat([donnees, gdf.geometry.bounds.round(6)], axis=1)
+    valeurs = pd.util.hash_pandas_object(donnees, index=True).to_numpy()
+    return len(gdf), hashlib.md5(valeurs.tobytes()).hexdigest()
+
+
+@suivre_cache("couche_socio")
+@st.cache_data(show_spinner=False, max_entries=16)
+def couche_socio_serialisee(cle, _gdf_socio, colonne_socio, nom_indicateur_socio):
+    """
+    Couche choroplèthe socio-économique, sérialisée.
+
+    :param cle: Empreinte des données (voir empreinte_gdf), seule prise en compte par le cache.
+    :return: Tuple (couche sérialisée ou None, colormap, info de valeur unique).
+    """
+    marquer_calcul("couche_socio")
+    colormap, single_value_info = None, None
+    gdf_socio = _gdf_socio
+    if colonne_socio not in gdf_socio.columns:
+        gdf_socio[colonne_socio] = pd.NA
+
+    gdf_socio_clean = gdf_socio.dropna(subset=['geometry']).copy()
+    if gdf_socio_clean.empty:
+        return None, colormap, single_value_info
+
+    valeurs_non_nulles = gdf_socio_clean[colonne_socio].dropna()
+    if valeurs_non_nulles.nunique() > 1:
+        min_val, max_val = valeurs_non_nulles.min(), valeurs_non_nulles.max()
+        colormap = cm.LinearColormap(colors=['#ffffcc', '#fd8d3c', '#800026'], vmin=min_val, vmax=max_val)
+        colormap.caption = nom_indicateur_socio or colonne_socio
+    elif valeurs_non_nulles.nunique() == 1:
+        single_value_info = {"label": nom_indicateur_socio, "value": valeurs_non_nulles.iloc[0]}
+
+    tooltip_col_name = f"{colonne_socio}_display"
+    gdf_socio_clean[tooltip_col_name] = gdf_socio_clean[colonne_socio].apply(
+        lambda x: "ND" if pd.isna(x) else f"{x:,.0f}".replace(",", " "))
+
+    def style_function(feature):
+        value = feature['properties'].get(colonne_socio)
+        if pd.isna(value):
+            return {'fillColor': '#cccccc', 'color': '#999999', 'weight': 1, 'fillOpacity': 0.6}
+        if colormap:
+            return {'fillColor': colormap(value), 'color': 'black', 'weight': 1, 'fillOpacity': 0.7}
+        if single_value_info:
+            return {'fillColor': '#800026', 'color': 'black', 'weight': 1, 'fillOpacity': 0.7}
+        return {'fillOpacity': 0, 'weight': 0}
+
+    cle_nom = 'NOM_COM' if 'NOM_COM' in gdf_socio_clean.columns else 'NOM_DEP'
+    # Seules les propriétés lues par le style et l'infobulle sont transmises au navigateur
+    gdf_socio_clean = gdf_socio_clean[[cle_nom, colonne_socio, tooltip_col_name, 'geometry']]
+    tooltip = folium.features.GeoJsonTooltip(
+        fields=[cle_nom, tooltip_col_name],
+        aliases=['Zone:', f'{nom_indicateur_socio or colonne_socio}:'],
+        labels=True,
+        style=("background-color: white; color: black; font-family: arial; font-size: 14px; padding: 10px;")
+    )
+
+    couche = folium.GeoJson(gdf_socio_clean, name="Données Socio-Éco", style_function=style_function, tooltip=tooltip)
+    return serialiser_couche(couche), colormap, single_value_info
+
+
+def _popup_etablissement(row):
+    return folium.Popup(f"<b>{row.get('nom_etablissement', 'N/A')}</b><br>{row.get('adresse_simplifiee', 'N/A')}",
+                        max_width=300)
+
+
+# Rendu côté navigateur des marqueurs regroupés : chaque point porte [lat, lon, couleur, infobulle, popup]
+_CALLBACK_MARQUEUR_REGROUPE = """
+function (row) {
+    var marker = L.circleMarker(new L.LatLng(row[0], row[1]),
+        {radius: 6, color: row[2], fillColor: row[2], fill: true, fillOpacity: 0.9});
+    if (row[3]) { marker.bindTooltip(row[3]); }
+    if (row[4]) { marker.bindPopup(row[4], {maxWidth: 300}); }
+    return marker;
+};
+"""
+
+
+def _ajouter_marqueurs_regroupes(couche, latitudes, longitudes, couleurs, infobulles, popups, nom):
+    """Ajoute des marqueurs regroupés (FastMarkerCluster) : une ligne de données par point au lieu d'un objet."""
+    donnees = [[round(float(lat), 6), round(float(lon), 6), couleur, infobulle, popup]
+               for lat, lon, couleur, infobulle, popup in zip(latitudes, longitudes, couleurs, infobulles, popups)]
+    folium.plugins.FastMarkerCluster(donnees, callback=_CALLBACK_MARQUEUR_REGROUPE, name=nom,
+                                     control=False).add_to(couche)
+
+
+def _ajouter_cellules_agregees(couche, gdf_points, libelle, couleur='#3a3a3a'):
+    """Affiche un cercle par cellule de la grille d'agrégation, de taille croissante avec le nombre de points."""
+    for cellule in cellules_agregation(gdf_points).itertuples():
+        folium.CircleMarker([cellule.lat, cellule.lon], radius=float(4 + 3 * np.sqrt(cellule.nb)), color=couleur,
+                            weight=1, fill=True, fill_color=couleur, fill_opacity=0.6,
+                            tooltip=f"{cellule.nb} {libelle}").add_to(couche)
+
+
+def _ajouter_cercle_repli(couche, row, couleur, temps_secondes, infobulle):
+    """Mode dégradé des isochrones : cercle d'influence de rayon équivalent au temps de trajet."""
+    rayon_repli = temps_secondes / 3600 * ORS_CONFIG["vitesse_repli_kmh"] * 1000
+    folium.Circle([row.geometry.y, row.geometry.x], radius=rayon_repli, color=couleur, fill=True,
+                  fill_color=couleur, fill_opacity=0.15, dash_array='6 6', tooltip=infobulle).add_to(couche)
+
+
+@suivre_cache("couche_etablissements")
+@st.cache_data(show_spinner=False, max_entries=32)
+def couche_etablissements_serialisee(cle, _gdf_etablissements, mode_affichage_etablissements, rayon_cercles,
+                                     temps_isochrones, cle_coefficients, _df_coefficients, moteur_isochrones,
+                                     _fonction_isochrone, _alerte, rendu='detail'):
+    """
+    Couche des établissements pour un mode d'affichage, sérialisée. En mode dégradé (isochrones
+    remplacées par des cercles de repli), le résultat est retourné sans être mis en cache.
+
+    :param cle, cle_coefficients: Empreintes des établissements et des coefficients de trafic.
+    :param rendu: 'detail' (un marqueur par établissement), 'regroupement' (marqueurs regroupés)
+        ou 'agregation' (comptage par cellule de grille, sans cercles ni isochrones).
+    :return: Tuple (couche sérialisée, légende des enseignes).
+    """
+    marquer_calcul("couche_etablissements")
+    gdf_etablissements, df_coefficients, fonction_isochrone = _gdf_etablissements, _df_coefficients, _fonction_isochrone
+    fg_etablissements = folium.FeatureGroup(name="Établissements", show=True)
+    couleurs = ['#e41a1c', '#377eb8', '#4daf4a', '#984ea3', '#ff7f00', '#ffff33', '#a65628', '#f781bf']
+    legend_enseignes = {nom: couleurs[i % len(couleurs)] for i, nom in
+                        enumerate(gdf_etablissements['nom_etablissement'].unique())}
+    if rendu == 'agregation':
+        _ajouter_cellules_agregees(fg_etablissements, gdf_etablissements, "établissement(s)")
+        return serialiser_couche(fg_etablissements), legend_enseignes
+    nb_isochrones_repli, nb_hors_graphe = 0, 0
+    if mode_affichage_etablissements == 'Isochrones':
+        # Temps de trajet par établissement, corrigé du coefficient de trafic de sa ville
+        coefficients = {} if df_coefficients is None else dict(
+            zip(df_coefficients['ville'].str.lower(), df_coefficients['coefficient']))
+        villes = gdf_etablissements['ville'] if 'ville' in gdf_etablissements else [''] * len(gdf_etablissements)
+        temps_secondes = [temps_isochrones * coefficients.get(str(ville).lower(), 0.9) * 60 for ville in villes]
+        if moteur_isochrones == 'Local':
+            features_locales = calculer_isochrones_locales_en_cache(
+                tuple(zip(gdf_etablissements.geometry.x, gdf_etablissements.geometry.y, temps_secondes)),
+                MOTEUR_ISOCHRONES_CONFIG["graphe"])
+    lignes = [] if mode_affichage_etablissements == 'Points' and rendu != 'detail' else gdf_etablissements.iterrows()
+    for position, (_, row) in enumerate(lignes):
+        color = legend_enseignes.get(row['nom_etablissement'], 'gray')
+        if mode_affichage_etablissements == 'Points' and rendu == 'detail':
+            folium.CircleMarker([row.geometry.y, row.geometry.x], radius=6, color=color, fill=True,
+                                fill_color=color, fill_opacity=0.9, popup=_popup_etablissement(row),
+                                tooltip=row['nom_etablissement']).add_to(fg_etablissements)
+        elif mode_affichage_etablissements == 'Cercles d\'influence':
+            folium.Circle([row.geometry.y, row.geometry.x], radius=rayon_cercles, color=color, fill=True,
+                          fill_color=color, fill_opacity=0.2).add_to(fg_etablissements)
+            if rendu == 'detail':
+                folium.CircleMarker([row.geometry.y, row.geometry.x], radius=4, color=color, fill=True,
+                                    fill_color=color, fill_opacity=0.9, popup=_popup_etablissement(row),
+                                    tooltip=row['nom_etablissement']).add_to(fg_etablissements)
+        elif mode_affichage_etablissements == 'Isochrones':
+            if moteur_isochrones == 'Local':
+                feature = features_locales[position]
+                if feature is None:
+                    # Établissement hors du graphe routier : même repli que pour ORS, sans empêcher le cache
+                    nb_hors_graphe += 1
+                    _ajouter_cercle_repli(fg_etablissements, row, color, temps_secondes[position],
+                                          "Cercle de repli (hors du graphe routier)")
+                    continue
+            else:
+                try:
+                    feature = fonction_isochrone(row.geometry.x, row.geometry.y, temps_secondes[position])
+                except requests.exceptions.RequestException:
+                    nb_isochrones_repli += 1
+                    _ajouter_cercle_repli(fg_etablissements, row, color, temps_secondes[position],
+                                          "Cercle de repli (ORS indisponible)")
+                    continue
+            if feature: folium.GeoJson(feature,
+                                       style_function=lambda x, c=color: {'fillColor': c, 'color': c, 'weight': 2,
+                                                                          'fillOpacity': 0.25}).add_to(
+                fg_etablissements)
+    if rendu == 'regroupement':
+        _ajouter_marqueurs_regroupes(
+            fg_etablissements, gdf_etablissements.geometry.y, gdf_etablissements.geometry.x,
+            gdf_etablissements['nom_etablissement'].map(legend_enseignes).fillna('gray'),
+            gdf_etablissements['nom_etablissement'],
+            "<b>" + gdf_etablissements['nom_etablissement'].astype(str) + "</b><br>"
+            + (gdf_etablissements['adresse_simplifiee'].fillna('N/A').astype(str)
+               if 'adresse_simplifiee' in gdf_etablissements else 'N/A'), "Établissements (regroupés)")
+    elif mode_affichage_etablissements == 'Isochrones':
+        for _, row in gdf_etablissements.iterrows():
+            color = legend_enseignes.get(row['nom_etablissement'], 'gray')
+            folium.CircleMarker([row.geometry.y, row.geometry.x], radius=4, color=color, fill=True,
+                                fill_color=color, fill_opacity=0.9, popup=_popup_etablissement(row),
+                                tooltip=row['nom_etablissement']).add_to(fg_etablissements)
+
+    resultat = serialiser_couche(fg_etablissements), legend_enseignes
+    if nb_hors_graphe and _alerte:
+        _alerte(f"{nb_hors_graphe} établissement(s) sur {len(gdf_etablissements)} hors du graphe routier local : "
+                f"affiché(s) avec un cercle de repli.")
+    if nb_isochrones_repli:
+        if _alerte:
+            _alerte(f"Service d'isochrones indisponible : {nb_isochrones_repli} établissement(s) sur "
+                    f"{len(gdf_etablissements)} affiché(s) avec un cercle de repli (isochrones en cache conservées).")
+        raise _CoucheNonMemorisable(resultat)
+    return resultat
+
+
+@suivre_cache("couche_poi")
+@st.cache_data(show_spinner=False, max_entries=16)
+def couche_poi_serialisee(cle, _gdf_poi, rendu='detail'):
+    """
+    Couche des points d'intérêt, sérialisée (cle : empreinte des POI).
+
+    :param rendu: 'detail' (icônes), 'regroupement' (marqueurs regroupés) ou 'agregation' (comptage par cellule).
+    """
+    marquer_calcul("couche_poi")
+    fg_poi = folium.FeatureGroup(name="Points d'Intérêt", show=True)
+    if rendu == 'agregation':
+        _ajouter_cellules_agregees(fg_poi, _gdf_poi, "point(s) d'intérêt", couleur='#1f78b4')
+        return serialiser_couche(fg_poi)
+    for categorie, gdf_categorie in _gdf_poi.groupby('categorie'):
+        config = POI_CONFIG.get(categorie, {})
+        icon_config = config.get('icon', {'icon': 'info-sign', 'color': 'gray', 'prefix': 'glyphicon'})
+        singular_name = config.get('singular', categorie)
+        if rendu == 'regroupement':
+            _ajouter_marqueurs_regroupes(fg_poi, gdf_categorie.geometry.y, gdf_categorie.geometry.x,
+                                         [icon_config['color']] * len(gdf_categorie),
+                                         f"{singular_name}: " + gdf_categorie['name'].astype(str), [None] * len(gdf_categorie),
+                                         f"Points d'Intérêt - {categorie}")
+            continue
+
+        for _, poi in gdf_categorie.iterrows():
+            folium.Marker(
+                location=[poi.geometry.y, poi.geometry.x],
+                tooltip=f"{singular_name}: {poi['name']}",
+                icon=folium.Icon(
+                    icon=icon_config['icon'],
+                    color=icon_config['color'],
+                    prefix=icon_config.get('prefix', 'glyphicon')
+                )
+            ).add_to(fg_poi)
+    return serialiser_couche(fg_poi)
+
+
+@suivre_cache("couche_scoring")
+@st.cache_data(show_spinner=False, max_entries=8)
+def couches_scoring_serialisees(cle, _resultat_scoring, _gdf_sites):
+    """
+    Couches du scoring (image du score encodée en PNG, sites candidats), sérialisées.
+
+    :param cle: Empreintes du score et des sites, seules prises en compte par le cache.
+    """
+    marquer_calcul("couche_scoring")
+    return [serialiser_couche(couche) for couche in couches_scoring(_resultat_scoring, _gdf_sites)]
+
+
 def creer_carte_enrichie(gdf_etablissements, lat_centre, lon_centre,
                          gdf_socio=None, colonne_socio=None, nom_indicateur_socio=None,
                          gdf_poi=None,
                          mode_affichage_etablissements='Points', rayon_cercles=1000, temps_isochrones=10,
-                         df_coefficients=None):
+                         df_coefficients=None, resultat_scoring=None, gdf_sites=None,
+                         fonction_isochrone=None, alerte=st.warning, moteur_isochrones='ORS', zoom_depart=11,
+                         rendu_etablissements='detail', rendu_poi='detail', tolerance_socio_m=0):
     """
-    Version finale : Crée une carte complète avec toutes les couches et corrections.
+    Version finale : Crée une carte complète avec toutes les couches et corrections. Les couches
+    socio-économique, établissements et POI sont assemblées à partir de fragments mis en cache.
+
+    :param fonction_isochrone: Fonction (longitude, latitude, temps_secondes) -> feature GeoJSON ou None.
+        Par défaut, l'appel ORS mis en cache par Streamlit ; le mode batch fournit sa propre version.
+        Si elle lève une RequestException (ORS en panne, disjoncteur ouvert), l'établissement est
+        représenté par un cercle de repli dont le rayon correspond au temps de trajet.
+    :param alerte: Fonction appelée avec le message résumant le mode dégradé des isochrones.
+    :param moteur_isochrones: 'ORS' (serveur, via fonction_isochrone) ou 'Local' (graphe routier de
+        MOTEUR_ISOCHRONES_CONFIG, toutes les isochrones calculées d'un bloc en parallèle) ; un
+        établissement hors du graphe reçoit le même cercle de repli.
+    :param zoom_depart: Niveau de zoom initial de la carte.
+    :param rendu_etablissements, rendu_poi: 'detail', 'regroupement' ou 'agregation' (voir adapter_au_budget).
+    :param tolerance_socio_m: Simplification appliquée à gdf_socio (voir adapter_au_budget), prise en compte
+        dans la clé de cache de la couche : l'empreinte ne porte que sur les emprises des polygones.
     """
-    m = folium.Map(location=[lat_centre, lon_centre], zoom_start=11, tiles="OpenStreetMap")
+    fonction_isochrone = fonction_isochrone or calculer_isochrone_et_cacher
+    m = folium.Map(location=[lat_centre, lon_centre], zoom_start=zoom_depart, tiles="OpenStreetMap")
 
     legend_enseignes, colormap, single_value_info = {}, None, None
 
     # --- Couche Socio-économique ---
-    if gdf_socio is not None and not gdf_socio.empty and colonne_socio:
-        if colonne_socio not in gdf_socio.columns:
-            gdf_socio[colonne_socio] = pd.NA
-
-        gdf_socio_clean = gdf_socio.dropna(subset=['geometry']).copy()
-
-        if not gdf_socio_clean.empty:
-            valeurs_non_nulles = gdf_socio_clean[colonne_socio].dropna()
-            if valeurs_non_nulles.nunique() > 1:
-                min_val, max_val = valeurs_non_nulles.min(), valeurs_non_nulles.max()
-                colormap = cm.LinearColormap(colors=['#ffffcc', '#fd8d3c', '#800026'], vmin=min_val, vmax=max_val)
-                colormap.caption = nom_indicateur_socio or colonne_socio
-            elif valeurs_non_nulles.nunique() == 1:
-                single_value_info = {"label": nom_indicateur_socio, "value": valeurs_non_nulles.iloc[0]}
-
-            tooltip_col_name = f"{colonne_socio}_display"
-            gdf_socio_clean[tooltip_col_name] = gdf_socio_clean[colonne_socio].apply(
-                lambda x: "ND" if pd.isna(x) else f"{x:,.0f}".replace(",", " "))
-
-            def style_function(feature):
-                value = feature['properties'].get(colonne_socio)
-                if pd.isna(value):
-                    return {'fillColor': '#cccccc', 'color': '#999999', 'weight': 1, 'fillOpacity': 0.6}
-                if colormap:
-                    return {'fillColor': colormap(value), 'color': 'black', 'weight': 1, 'fillOpacity': 0.7}
-                if single_value_info:
-                    return {'fillColor': '#800026', 'color': 'black', 'weight': 1, 'fillOpacity': 0.7}
-                return {'fillOpacity': 0, 'weight': 0}
-
-            cle_nom = 'NOM_COM' if 'NOM_COM' in gdf_socio_clean.columns else 'NOM_DEP'
-            tooltip = folium.features.GeoJsonTooltip(
-                fields=[cle_nom, tooltip_col_name],
-                aliases=['Zone:', f'{nom_indicateur_socio or colonne_socio}:'],
-                labels=True,
-                style=("background-color: white; color: black; font-family: arial; font-size: 14px; padding: 10px;")
-            )
-
-            folium.GeoJson(
-                gdf_socio_clean, name="Données Socio-Éco", style_function=style_function, tooltip=tooltip
-            ).add_to(m)
+    with mesurer("carte.couche_socio", nb_entites=0 if gdf_socio is None else len(gdf_socio)):
+        if gdf_socio is not None and not gdf_socio.empty and colonne_socio:
+            couche, colormap, single_value_info = couche_socio_serialisee(
+                (empreinte_gdf(gdf_socio, [colonne_socio]), tolerance_socio_m), gdf_socio, colonne_socio,
+                nom_indicateur_socio)
+            if couche is not None:
+                CoucheSerialisee(couche).add_to(m)
 
     # --- Couche des Établissements ---
-    if gdf_etablissements is not None and not gdf_etablissements.empty:
-        fg_etablissements = folium.FeatureGroup(name="Établissements", show=True).add_to(m)
-        couleurs = ['#e41a1c', '#377eb8', '#4daf4a', '#984ea3', '#ff7f00', '#ffff33', '#a65628', '#f781bf']
-        legend_enseignes = {nom: couleurs[i % len(couleurs)] for i, nom in
-                            enumerate(gdf_etablissements['nom_etablissement'].unique())}
-        for _, row in gdf_etablissements.iterrows():
-            color = legend_enseignes.get(row['nom_etablissement'], 'gray')
-            popup = folium.Popup(
-                f"<b>{row.get('nom_etablissement', 'N/A')}</b><br>{row.get('adresse_simplifiee', 'N/A')}",
-                max_width=300)
-            if mode_affichage_etablissements == 'Points':
-                folium.CircleMarker([row.geometry.y, row.geometry.x], radius=6, color=color, fill=True,
-                                    fill_color=color, fill_opacity=0.9, popup=popup,
-                                    tooltip=row['nom_etablissement']).add_to(fg_etablissements)
-            elif mode_affichage_etablissements == 'Cercles d\'influence':
-                folium.Circle([row.geometry.y, row.geometry.x], radius=rayon_cercles, color=color, fill=True,
-                              fill_color=color, fill_opacity=0.2).add_to(fg_etablissements)
-                folium.CircleMarker([row.geometry.y, row.geometry.x], radius=4, color=color, fill=True,
-                                    fill_color=color, fill_opacity=0.9, popup=popup,
-                                    tooltip=row['nom_etablissement']).add_to(fg_etablissements)
-            elif mode_affichage_etablissements == 'Isochrones':
-                coeff_row = df_coefficients[df_coefficients['ville'].str.lower() == row.get('ville',
-                                                                                            '').lower()] if df_coefficients is not None else pd.DataFrame()
-                coeff = coeff_row['coefficient'].iloc[0] if not coeff_row.empty else 0.9
-                feature = calculer_isochrone_et_cacher(row.geometry.x, row.geometry.y, (temps_isochrones * coeff) * 60)
-                if feature: folium.GeoJson(feature,
-                                           style_function=lambda x, c=color: {'fillColor': c, 'color': c, 'weight': 2,
-                                                                              'fillOpacity': 0.25}).add_to(
-                    fg_etablissements)
-        if mode_affichage_etablissements == 'Isochrones':
-            for _, row in gdf_etablissements.iterrows():
-                color = legend_enseignes.get(row['nom_etablissement'], 'gray')
-                popup = folium.Popup(
-                    f"<b>{row.get('nom_etablissement', 'N/A')}</b><br>{row.get('adresse_simplifiee', 'N/A')}",
-                    max_width=300)
-                folium.CircleMarker([row.geometry.y, row.geometry.x], radius=4, color=color, fill=True,
-                                    fill_color=color, fill_opacity=0.9, popup=popup,
-                                    tooltip=row['nom_etablissement']).add_to(fg_etablissements)
+    with mesurer("carte.couche_etablissements", mode=mode_affichage_etablissements,
+                 nb_entites=0 if gdf_etablissements is None else len(gdf_etablissements)):
+        if gdf_etablissements is not None and not gdf_etablissements.empty:
+            parametres_mode = {'Points': (None, None), 'Cercles d\'influence': (rayon_cercles, None),
+                               'Isochrones': (None, temps_isochrones)}.get(mode_affichage_etablissements,
+                                                                                      (None, None))
+            try:
+                couche, legend_enseignes = couche_etablissements_serialisee(
+                    empreinte_gdf(gdf_etablissements, ['nom_etablissement', 'adresse_simplifiee', 'ville']),
+                    gdf_etablissements, mode_affichage_etablissements, *parametres_mode,
+                    empreinte_gdf(df_coefficients, ['ville', 'coefficient']), df_coefficients,
+                    moteur_isochrones if mode_affichage_etablissements == 'Isochrones' else None,
+                    fonction_isochrone, alerte, rendu_etablissements)
+            except _CoucheNonMemorisable as e:
+                couche, legend_enseignes = e.resultat
+            CoucheSerialisee(couche).add_to(m)
 
     # --- Couche des Points d'Intérêt (POI) ---
-    if gdf_poi is not None and not gdf_poi.empty:
-        fg_poi = folium.FeatureGroup(name="Points d'Intérêt", show=True).add_to(m)
-
-        for categorie, gdf_categorie in gdf_poi.groupby('categorie'):
-            config = POI_CONFIG.get(categorie, {})
-            icon_config = config.get('icon', {'icon': 'info-sign', 'color': 'gray', 'prefix': 'glyphicon'})
-            singular_name = config.get('singular', categorie)
-
-            for _, poi in gdf_categorie.iterrows():
-                folium.Marker(
-                    location=[poi.geometry.y, poi.geometry.x],
-                    tooltip=f"{singular_name}: {poi['name']}",
-                    icon=folium.Icon(
-                        icon=icon_config['icon'],
-                        color=icon_config['color'],
-                        prefix=icon_config.get('prefix', 'glyphicon')
-                    )
-                ).add_to(fg_poi)
+    with mesurer("carte.couche_poi", nb_entites=0 if gdf_poi is None else len(gdf_poi)):
+        if gdf_poi is not None and not gdf_poi.empty:
+            CoucheSerialisee(couche_poi_serialisee(empreinte_gdf(gdf_poi, ['categorie', 'name']), gdf_poi,
+                                                   rendu_poi)).add_to(m)
+
+    # --- Couche du scoring des emplacements ---
+    with mesurer("carte.couche_scoring"):
+        if resultat_scoring is not None:
+            cle_scoring = (hashlib.md5(np.ascontiguousarray(resultat_scoring["score"]).tobytes()).hexdigest(),
+                           empreinte_gdf(gdf_sites, ['rang', 'score']))
+            for couche in couches_scoring_serialisees(cle_scoring, resultat_scoring, gdf_sites):
+                CoucheSerialisee(couche).add_to(m)
 
     folium.LayerControl().add_to(m)
-    return m, legend_enseignes, colormap, single_value_info
\ No newline at end of file
+    return m, legend_enseignes, colormap, single_value_info
@@ -0,0 +1,271 @@
+# ==============================================
+# 📦 Imports & Librairies
+# ==============================================
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+import folium
+import streamlit as st
+from config import POI_CONFIG, SCORING_CONFIG
+from instrumentation import suivre_cache, marquer_calcul
+
+# La grille est construite en Web Mercator (EPSG:3857), la projection d'affichage de Leaflet :
+# l'image du score se superpose ainsi sans déformation. Le pas est corrigé par le facteur d'échelle
+# à la latitude de la zone pour correspondre à une résolution réelle au sol.
+CRS_GRILLE = "EPSG:3857"
+
+
+# ==============================================
+# Section préparation des entrées
+# ==============================================
+
+@suivre_cache("population_scoring")
+@st.cache_data(show_spinner=False)
+def preparer_population_scoring(_df_iris):
+    """Réduit les IRIS à un point représentatif pondéré par la population (en EPSG:3857)."""
+    marquer_calcul("population_scoring")
+    df = _df_iris[_df_iris['Population_totale'].fillna(0) > 0]
+    points = df.geometry.representative_point().to_crs(CRS_GRILLE)
+    return pd.DataFrame({
+        'x': points.x.to_numpy(),
+        'y': points.y.to_numpy(),
+        'population': df['Population_totale'].to_numpy(dtype=float),
+        'CODE_DEPT': df['CODE_DEPT'].to_numpy()
+    })
+
+
+def zone_depuis_departements(df_departements, codes_deps):
+    """Retourne l'union des départements sélectionnés, en EPSG:3857."""
+    selection = df_departements[df_departements['CODE_DEPT'].isin(codes_deps)]
+    if selection.empty:
+        return None
+    return selection.to_crs(CRS_GRILLE).geometry.union_all()
+
+
+def _coordonnees_projetees(gdf):
+    """Retourne les coordonnées x, y (EPSG:3857) des points d'un GeoDataFrame."""
+    if gdf is None or gdf.empty:
+        return np.empty(0), np.empty(0)
+    points = gdf.geometry.to_crs(CRS_GRILLE)
+    return points.x.to_numpy(), points.y.to_numpy()
+
+
+# ==============================================
+# Section grille et opérations vectorisées
+# ==============================================
+
+def construire_grille(zone, resolution_m):
+    """
+    Pose une grille régulière sur la zone et calcule le masque des cellules intérieures.
+
+    :param zone: Géométrie shapely de la zone, en EPSG:3857.
+    :param resolution_m: Taille d'une cellule au sol (mètres).
+    :return: Dictionnaire décrivant la grille (origine, pas, dimensions, masque, centres).
+    """
+    min_x, min_y, max_x, max_y = zone.bounds
+    # Facteur d'échelle de Mercator à la latitude centrale de la zone
+    lat_centre = np.degrees(2 * np.arctan(np.exp((min_y + max_y) / 2 / 6378137.0)) - np.pi / 2)
+    echelle = 1 / np.cos(np.radians(lat_centre))
+    pas = resolution_m * echelle
+
+    nx = int(np.ceil((max_x - min_x) / pas))
+    ny = int(np.ceil((max_y - min_y) / pas))
+    xs = min_x + (np.arange(nx) + 0.5) * pas
+    ys = min_y + (np.arange(ny) + 0.5) * pas
+    centres_x, centres_y = np.meshgrid(xs, ys)
+
+    shapely.prepare(zone)
+    masque = shapely.contains_xy(zone, centres_x, centres_y)
+
+    return {"x0": min_x, "y0": min_y, "pas": pas, "echelle": echelle, "nx": nx, "ny": ny,
+            "masque": masque, "centres_x": centres_x, "centres_y": centres_y}
+
+
+def _rasteriser_points(grille, x, y, poids=None):
+    """Accumule des points (et leurs poids) dans les cellules de la grille."""
+    valeurs = np.zeros(grille["ny"] * grille["nx"])
+    if len(x) == 0:
+        return valeurs.reshape(grille["ny"], grille["nx"])
+    poids = np.ones(len(x)) if poids is None else np.asarray(poids, dtype=float)
+    valides = np.isfinite(x) & np.isfinite(y)
+    x, y, poids = x[valides], y[valides], poids[valides]
+    ix = np.floor((x - grille["x0"]) / grille["pas"]).astype(int)
+    iy = np.floor((y - grille["y0"]) / grille["pas"]).astype(int)
+    dedans = (ix >= 0) & (ix < grille["nx"]) & (iy >= 0) & (iy < grille["ny"])
+    valeurs += np.bincount(iy[dedans] * grille["nx"] + ix[dedans], weights=poids[dedans],
+                           minlength=grille["ny"] * grille["nx"])
+    return valeurs.reshape(grille["ny"], grille["nx"])
+
+
+def _noyau_disque(rayon_m, resolution_m, decroissance=False):
+    """Noyau circulaire (plat ou à décroissance linéaire) exprimé en cellules."""
+    rayon = max(rayon_m / resolution_m, 0.5)
+    r = int(np.ceil(rayon))
+    dy, dx = np.mgrid[-r:r + 1, -r:r + 1]
+    distance = np.hypot(dx, dy)
+    noyau = (distance <= rayon).astype(float)
+    if decroissance:
+        noyau *= 1 - distance / (rayon + 1)
+    return noyau
+
+
+def _convoluer(valeurs, noyau):
+    """Convolution 2D par FFT, recadrée à la taille de la grille ('same')."""
+    ny, nx = valeurs.shape
+    ky, kx = noyau.shape
+    forme = (ny + ky - 1, nx + kx - 1)
+    resultat = np.fft.irfft2(np.fft.rfft2(valeurs, forme) * np.fft.rfft2(noyau, forme), forme)
+    resultat = resultat[ky // 2:ky // 2 + ny, kx // 2:kx // 2 + nx]
+    # Supprime le bruit numérique de la FFT sur les zones vides
+    return np.where(resultat < 1e-9, 0.0, resultat)
+
+
+def _normaliser(valeurs, masque):
+    """Ramène une couche dans [0, 1] par rapport à son maximum dans la zone."""
+    interieur = valeurs[masque]
+    reference = interieur.max() if interieur.size else 0
+    if reference <= 0:
+        return np.zeros_like(valeurs)
+    return np.clip(valeurs / reference, 0, 1)
+
+
+# ==============================================
+# Section calcul du score
+# ==============================================
+
+def calculer_scores_grille(zone, df_population, gdf_concurrents=None, gdf_poi=None, parametres=None):
+    """
+    Calcule le score de chaque cellule de la grille posée sur la zone.
+
+    :param zone: Géométrie shapely de la zone d'étude, en EPSG:3857.
+    :param df_population: Sortie de preparer_population_scoring (x, y, population).
+    :param gdf_concurrents: GeoDataFrame des établissements concurrents (résultats OSM).
+    :param gdf_poi: GeoDataFrame des POI, avec une colonne 'categorie'.
+    :param parametres: Dictionnaire surchargeant SCORING_CONFIG.
+    :return: Dictionnaire avec la grille, le score (0-100, NaN hors zone) et les couches intermédiaires.
+    """
+    parametres = {**SCORING_CONFIG, **(parametres or {})}
+    poids = {**SCORING_CONFIG["poids"], **parametres.get("poids", {})}
+    resolution = parametres["resolution_m"]
+    grille = construire_grille(zone, resolution)
+    masque = grille["masque"]
+
+    # Population atteignable : somme de la population dans le rayon de captation
+    population = _rasteriser_points(grille, df_population['x'].to_numpy(), df_population['y'].to_numpy(),
+                                    df_population['population'].to_numpy())
+    population = _convoluer(population, _noyau_disque(parametres["rayon_population_m"], resolution))
+
+    # Pression concurrentielle : influence décroissante avec la distance à chaque concurrent
+    x_conc, y_conc = _coordonnees_projetees(gdf_concurrents)
+    concurrence = _rasteriser_points(grille, x_conc, y_conc)
+    concurrence = _convoluer(concurrence, _noyau_disque(parametres["rayon_concurrence_m"], resolution,
+                                                        decroissance=True))
+
+    # Générateurs de flux : POI pondérés par catégorie
+    x_poi, y_poi = _coordonnees_projetees(gdf_poi)
+    poids_poi = np.empty(0)
+    if len(x_poi):
+        poids_poi = gdf_poi['categorie'].map(lambda c: POI_CONFIG.get(c, {}).get('poids', 1.0)).to_numpy(dtype=float)
+    poi = _rasteriser_points(grille, x_poi, y_poi, poids_poi)
+    poi = _convoluer(poi, _noyau_disque(parametres["rayon_poi_m"], resolution, decroissance=True))
+
+    score = (poids["population"] * _normaliser(population, masque)
+             + poids["poi"] * _normaliser(poi, masque)
+             - poids["concurrence"] * _normaliser(concurrence, masque))
+    score = np.where(masque, score, np.nan)
+    if np.isfinite(score).any():
+        score_min, score_max = np.nanmin(score), np.nanmax(score)
+        score = (score - score_min) / (score_max - score_min) * 100 if score_max > score_min else np.where(masque, 50.0, np.nan)
+
+    return {"grille": grille, "score": score, "population": population, "concurrence": concurrence, "poi": poi}
+
+
+def selectionner_meilleurs_sites(resultat, nb_sites=None, distance_min_m=None):
+    """
+    Retient les N meilleures cellules en imposant un écart minimal entre deux sites.
+
+    :return: GeoDataFrame (EPSG:4326) des sites candidats, triés par rang.
+    """
+    nb_sites = nb_sites or SCORING_CONFIG["nb_sites"]
+    distance_min_m = distance_min_m or SCORING_CONFIG["distance_min_sites_m"]
+    grille, score = resultat["grille"], resultat["score"]
+    distance_min = distance_min_m * grille["echelle"]
+
+    score_plat = np.where(np.isfinite(score), score, -np.inf).ravel()
+    nb_candidats = min(len(score_plat), max(nb_sites * 500, 5000))
+    candidats = np.argpartition(-score_plat, nb_candidats - 1)[:nb_candidats] if nb_candidats else np.empty(0, int)
+    candidats = candidats[np.argsort(-score_plat[candidats])]
+
+    centres_x, centres_y = grille["centres_x"].ravel(), grille["centres_y"].ravel()
+    retenus = []
+    for indice in candidats:
+        if not np.isfinite(score_plat[indice]) or len(retenus) >= nb_sites:
+            break
+        if retenus:
+            distances = np.hypot(centres_x[retenus] - centres_x[indice], centres_y[retenus] - centres_y[indice])
+            if distances.min() < distance_min:
+                continue
+        retenus.append(indice)
+
+    retenus = np.array(retenus, dtype=int)
+    sites = gpd.GeoDataFrame({
+        'rang': np.arange(1, len(retenus) + 1),
+        'score': score_plat[retenus].round(1),
+        'population_atteignable': resultat["population"].ravel()[retenus].round(0),
+        'pression_concurrentielle': resultat["concurrence"].ravel()[retenus].round(2),
+        'flux_poi': resultat["poi"].ravel()[retenus].round(2)
+    }, geometry=gpd.points_from_xy(centres_x[retenus], centres_y[retenus]), crs=CRS_GRILLE).to_crs("EPSG:4326")
+    sites['latitude'], sites['longitude'] = sites.geometry.y, sites.geometry.x
+    return sites
+
+
+# ==============================================
+# Section rendu cartographique
+# ==============================================
+
+def _score_en_image(score, couleurs, opacite=0.65):
+    """Convertit la grille de scores en image RGBA (ligne 0 au nord) par interpolation vectorisée."""
+    rgb = np.array([[int(c[i:i + 2], 16) for i in (1, 3, 5)] for c in couleurs], dtype=float)
+    paliers = np.linspace(0, 100, len(couleurs))
+    valeurs = np.nan_to_num(score, nan=0.0)
+    image = np.zeros(score.shape + (4,), dtype=np.uint8)
+    for canal in range(3):
+        image[..., canal] = np.interp(valeurs, paliers, rgb[:, canal]).astype(np.uint8)
+    image[..., 3] = np.where(np.isfinite(score), int(opacite * 255), 0)
+    return image[::-1]
+
+
+def couches_scoring(resultat, gdf_sites=None):
+    """
+    Construit la couche de chaleur du score et celle des sites candidats.
+
+    :return: Liste de couches folium (à ajouter à une carte, ou à sérialiser).
+    """
+    grille = resultat["grille"]
+    x_max = grille["x0"] + grille["nx"] * grille["pas"]
+    y_max = grille["y0"] + grille["ny"] * grille["pas"]
+    coins = gpd.GeoSeries(gpd.points_from_xy([grille["x0"], x_max], [grille["y0"], y_max]),
+                          crs=CRS_GRILLE).to_crs("EPSG:4326")
+
+    couleurs = SCORING_CONFIG["couleurs"]
+    couches = [folium.raster_layers.ImageOverlay(
+        image=_score_en_image(resultat["score"], couleurs),
+        bounds=[[coins.y.iloc[0], coins.x.iloc[0]], [coins.y.iloc[1], coins.x.iloc[1]]],
+        mercator_project=False, name="Score des emplacements", interactive=False
+    )]
+
+    if gdf_sites is not None and not gdf_sites.empty:
+        fg_sites = folium.FeatureGroup(name="Sites candidats", show=True)
+        for _, site in gdf_sites.iterrows():
+            folium.Marker(
+                location=[site['latitude'], site['longitude']],
+                tooltip=f"Site n°{site['rang']} - score {site['score']:.0f}",
+                popup=folium.Popup(
+                    f"<b>Site n°{site['rang']}</b><br>Score : {site['score']:.0f}/100<br>"
+                    f"Population atteignable : {site['population_atteignable']:,.0f}".replace(",", " "),
+                    max_width=300),
+                icon=folium.Icon(icon='star', color='black', prefix='fa')
+            ).add_to(fg_sites)
+        couches.append(fg_sites)
+    return couches
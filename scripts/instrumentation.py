@@ -0,0 +1,187 @@
+# ==============================================
+# 📦 Imports & Librairies
+# ==============================================
+import contextvars
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+
+from config import INSTRUMENTATION_CONFIG
+
+# Instrumentation légère des chemins critiques : durées par étape et par appel externe,
+# succès/échecs de cache, nombre de requêtes et volume reçu. Une "trace" couvre une exécution
+# de page (un rerun Streamlit) ; sans trace active, les fonctions ci-dessous ne font rien.
+
+_TRACE_COURANTE = contextvars.ContextVar("trace_instrumentation", default=None)
+_VERROU_JOURNAL = threading.Lock()
+
+
+# ==============================================
+# Section cycle de vie d'une trace
+# ==============================================
+
+def demarrer_trace(page, session=None):
+    """Ouvre une trace pour l'exécution courante de la page et la retourne."""
+    trace = {"page": page, "session": session, "debut": time.perf_counter(),
+             "horodatage": datetime.now().isoformat(timespec="milliseconds"),
+             "etapes": [], "compteurs": Counter(), "attributs": {}}
+    _TRACE_COURANTE.set(trace)
+    return trace
+
+
+def trace_courante():
+    return _TRACE_COURANTE.get()
+
+
+def terminer_trace(chemin_journal=None):
+    """
+    Clôt la trace courante et l'ajoute au journal JSON lines. Le journal est borné : au-delà de
+    INSTRUMENTATION_CONFIG["taille_max_octets"], il remplace l'archive (.1) et repart de zéro.
+
+    :return: La trace clôturée (ou None si aucune n'était active).
+    """
+    trace = _TRACE_COURANTE.get()
+    if trace is None:
+        return None
+    trace["duree_totale_ms"] = round((time.perf_counter() - trace["debut"]) * 1000, 1)
+    _TRACE_COURANTE.set(None)
+
+    chemin_journal = chemin_journal or INSTRUMENTATION_CONFIG["journal"]
+    if INSTRUMENTATION_CONFIG["actif"] and chemin_journal:
+        ligne = {k: v for k, v in trace.items() if k != "debut"}
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(chemin_journal)), exist_ok=True)
+            with _VERROU_JOURNAL:
+                if os.path.exists(chemin_journal) and \
+                        os.path.getsize(chemin_journal) > INSTRUMENTATION_CONFIG["taille_max_octets"]:
+                    os.replace(chemin_journal, chemin_journal + ".1")
+                with open(chemin_journal, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(ligne, ensure_ascii=False, default=str) + "\n")
+        except OSError:
+            pass  # L'instrumentation ne doit jamais faire échouer la page
+    return trace
+
+
+# ==============================================
+# Section mesures
+# ==============================================
+
+@contextmanager
+def mesurer(etape, **attributs):
+    """Chronomètre un bloc et l'enregistre comme étape de la trace courante."""
+    trace = _TRACE_COURANTE.get()
+    if trace is None:
+        yield attributs
+        return
+    debut = time.perf_counter()
+    try:
+        yield attributs
+    finally:
+        trace["etapes"].append({"etape": etape,
+                                "debut_ms": round((debut - trace["debut"]) * 1000, 1),
+                                "duree_ms": round((time.perf_counter() - debut) * 1000, 1),
+                                **attributs})
+
+
+def compter(nom, valeur=1):
+    """Incrémente un compteur de la trace courante."""
+    trace = _TRACE_COURANTE.get()
+    if trace is not None:
+        trace["compteurs"][nom] += valeur
+
+
+def annoter(**attributs):
+    """Ajoute des attributs libres à la trace courante (ex: nombre d'établissements)."""
+    trace = _TRACE_COURANTE.get()
+    if trace is not None:
+        trace["attributs"].update(attributs)
+
+
+def enregistrer_requete(service, duree_s, octets, statut):
+    """Enregistre un appel à une API externe (durée, volume reçu, code de statut)."""
+    trace = _TRACE_COURANTE.get()
+    if trace is None:
+        return
+    trace["etapes"].append({"etape": f"api.{service}",
+                            "debut_ms": round((time.perf_counter() - duree_s - trace["debut"]) * 1000, 1),
+                            "duree_ms": round(duree_s * 1000, 1), "octets": octets, "statut": statut})
+    trace["compteurs"][f"requetes.{service}"] += 1
+    trace["compteurs"][f"octets.{service}"] += octets
+
+
+def marquer_calcul(nom):
+    """À appeler dans le corps d'une fonction mise en cache : signale un échec de cache (calcul effectif)."""
+    compter(f"cache.{nom}.echec")
+
+
+def suivre_cache(nom):
+    """
+    Décorateur à placer au-dessus de @st.cache_data : chronomètre l'appel et compte les succès
+    de cache, déduits de l'absence de marquer_calcul(nom) pendant l'appel.
+    """
+    def decorateur(fonction):
+        @functools.wraps(fonction)
+        def appel(*args, **kwargs):
+            trace = _TRACE_COURANTE.get()
+            if trace is None:
+                return fonction(*args, **kwargs)
+            echecs_avant = trace["compteurs"][f"cache.{nom}.echec"]
+            with mesurer(f"cache.{nom}") as attributs:
+                resultat = fonction(*args, **kwargs)
+                attributs["succes_cache"] = trace["compteurs"][f"cache.{nom}.echec"] == echecs_avant
+            if attributs["succes_cache"]:
+                trace["compteurs"][f"cache.{nom}.succes"] += 1
+            return resultat
+
+        # Conserve l'accès à la gestion du cache Streamlit (ex: fonction.clear())
+        for attribut in ("clear",):
+            if hasattr(fonction, attribut):
+                setattr(appel, attribut, getattr(fonction, attribut))
+        return appel
+    return decorateur
+
+
+# ==============================================
+# Section agrégation du journal
+# ==============================================
+
+def agreger_journal(chemin_journal=None, centiles=(50, 90, 99)):
+    """
+    Agrège les durées du journal (et de son archive .1) par étape, toutes sessions confondues.
+
+    :return: DataFrame (étape, nombre, centiles en ms), trié par durée p50 décroissante.
+    """
+    import pandas as pd
+
+    chemin_journal = chemin_journal or INSTRUMENTATION_CONFIG["journal"]
+    lignes = []
+    for chemin in (chemin_journal + ".1", chemin_journal):
+        if not os.path.exists(chemin):
+            continue
+        with open(chemin, encoding="utf-8") as f:
+            for ligne in f:
+                trace = json.loads(ligne)
+                lignes.append({"etape": "page." + trace["page"], "duree_ms": trace["duree_totale_ms"]})
+                if trace["attributs"].get("interaction"):
+                    # Durée du rerun selon l'interaction qui l'a déclenché (voir page_osm)
+                    lignes.append({"etape": f"rerun.{trace['attributs']['interaction']}",
+                                   "duree_ms": trace["duree_totale_ms"]})
+                lignes.extend({"etape": e["etape"], "duree_ms": e["duree_ms"]} for e in trace["etapes"])
+    df = pd.DataFrame(lignes)
+    if df.empty:
+        return df
+    agregat = df.groupby("etape")["duree_ms"].describe(percentiles=[c / 100 for c in centiles])
+    colonnes = {"count": "nombre", **{f"{c}%": f"p{c}_ms" for c in centiles}}
+    return agregat.rename(columns=colonnes)[list(colonnes.values())].sort_values(f"p{centiles[0]}_ms",
+                                                                                 ascending=False)
+
+
+if __name__ == "__main__":
+    # Usage : python instrumentation.py [chemin_du_journal]
+    print(agreger_journal(sys.argv[1] if len(sys.argv) > 1 else None).round(1).to_string())
@@ -1,7 +1,8 @@
 import streamlit as st
-import pandas as pd
-from fonctions_cartographie import recherche_etablissements_osm
-from config import POI_CONFIG
+from config import POI_CONFIG, SCORING_CONFIG
+
+# Les dépendances lourdes des fonctions de la page OSM (pandas, géotraitements, clients API) sont
+# importées dans ces fonctions : main.py importe ce module dès la page d'accueil (voir prechauffage.py).
 
 # ==============================================
 # Fonctions pour la page d'accueil (INCHANGÉES)
@@ -30,6 +31,37 @@ def navigation():
     if "OSM" in page_selectionnee: return "osm"
 
 
+def indicateur_prechauffage(etat_prechauffage):
+    """
+    Affiche dans la sidebar l'avancement du préchauffage des données de référence (voir prechauffage.py),
+    rafraîchi toutes les deux secondes tant qu'il n'est pas terminé. À la fin, le fragment relance
+    toute l'application : l'indicateur devient statique et le rafraîchissement périodique s'arrête.
+
+    :param etat_prechauffage: Fonction retournant l'état courant du préchauffage.
+    """
+    def afficher(etat):
+        if etat["statut"] == "pret":
+            st.caption(f"✅ Données de référence prêtes ({sum(etat['durees_s'].values()):.0f} s de préparation)")
+        elif etat["statut"] == "erreur":
+            st.caption(f"⚠️ Préchauffage interrompu ({etat['message']}) : chargement à l'ouverture de la page OSM")
+        else:
+            st.caption(f"⏳ Préparation des données de référence… ({etat['etape'] or 'démarrage'})")
+
+    etat = etat_prechauffage()
+    with st.sidebar:
+        if etat["statut"] in ("pret", "erreur"):
+            afficher(etat)
+        else:
+            @st.fragment(run_every=2)
+            def suivre_prechauffage():
+                etat_courant = etat_prechauffage()
+                if etat_courant["statut"] in ("pret", "erreur"):
+                    st.rerun(scope="app")
+                afficher(etat_courant)
+
+            suivre_prechauffage()
+
+
 # ==============================================
 # Fonctions pour la page OSM (Corrigées et améliorées)
 # ==============================================
@@ -63,8 +95,19 @@ INDICATEURS_CONFIG = {
 }
 
 
-def interface_recherche_osm(df_geo):
-    """Affiche une interface complète pour la recherche OSM et gère l'état via st.session_state."""
+def interface_recherche_osm(df_geo, df_departements=None, gdf_communes=None):
+    """
+    Affiche une interface complète pour la recherche OSM et gère l'état via st.session_state.
+
+    :param df_departements: GeoDataFrame des départements, pour planifier des requêtes par zone
+        (tuiles ou Overpass) au lieu d'une requête par commune.
+    :param gdf_communes: GeoDataFrame des communes, pour renseigner la ville des résultats par zone.
+    """
+    import pandas as pd
+    from fonctions_cartographie import executer_requete_en_cache, planifier_recherche_en_cache
+    from planification_requetes import (STRATEGIES, choisir_plan, resumer_plans, executer_plan_par_lots,
+                                        filtrer_resultats_zone)
+
     st.subheader("Recherche d'établissements")
     if df_geo is None or df_geo.empty:
         st.error("Données géographiques de référence non chargées.")
@@ -101,31 +144,139 @@ def interface_recherche_osm(df_geo):
                 communes_disponibles = sorted(df_geo[df_geo['Nom_Dep'].isin(deps_selectionnes)]['Nom_Ville'].unique())
                 selection_geo = st.multiselect("Puis, choisissez une ou plusieurs communes", communes_disponibles)
 
+    plans = planifier_recherche_en_cache(tuple(noms_etablissements), maille_recherche, tuple(selection_geo),
+                                         df_geo, df_departements, gdf_communes)
+    options_strategies = {"auto": "Automatique (moins coûteuse à couverture complète)", **STRATEGIES}
+    strategie = st.selectbox("Stratégie de requêtes", list(options_strategies), format_func=options_strategies.get,
+                             key="strategie_recherche_osm")
+    plan = choisir_plan(plans, strategie)
+    if plan is not None:
+        with st.expander(f"📐 Plan retenu : {plan['libelle']} — {plan['nb_requetes']} requête(s), "
+                         f"~{round(plan['cout_estime_s'])} s"):
+            st.dataframe(resumer_plans(plans, plan), hide_index=True, use_container_width=True)
+        if plan["couverture"] < 1:
+            st.warning(f"Couverture partielle : {plan['detail']}.")
+
+    mode_progressif = st.toggle("Recherche progressive (résultats au fil de l'eau, interruptible)", value=True,
+                                key="recherche_progressive")
+
     if st.button("Lancer la recherche", type="primary"):
         st.session_state["noms_etablissements_osm"] = noms_etablissements_osm
-        villes_a_chercher = []
-        if selection_geo:
-            if maille_recherche == 'Région':
-                villes_a_chercher = df_geo[df_geo['Nom_Region'].isin(selection_geo)]['Nom_Ville'].tolist()
-            elif maille_recherche == 'Département':
-                villes_a_chercher = df_geo[df_geo['Nom_Dep'].isin(selection_geo)]['Nom_Ville'].tolist()
-            elif maille_recherche == 'Commune':
-                villes_a_chercher = selection_geo
-
-        if noms_etablissements and villes_a_chercher:
-            with st.spinner(f"Recherche en cours..."):
-                df_resultats = recherche_etablissements_osm(noms_etablissements, list(set(villes_a_chercher)))
-            st.session_state["df_etablissements_osm"] = df_resultats if df_resultats is not None else pd.DataFrame()
+        st.session_state.pop("recherche_osm", None)
+        if plan is not None and mode_progressif:
+            demarrer_recherche_progressive(plan)
+        elif plan is not None:
+            resultats, nb_erreurs, saturees = [], 0, []
+            with st.spinner(f"Recherche en cours ({plan['nb_requetes']} requête(s))..."):
+                for _, resultats_lot, erreurs, saturees_lot in executer_plan_par_lots(
+                        plan["requetes"], fonction_requete=executer_requete_en_cache):
+                    resultats.extend(resultats_lot)
+                    nb_erreurs += len(erreurs)
+                    saturees.extend(saturees_lot)
+            if nb_erreurs:
+                st.warning(f"{nb_erreurs} requête(s) en échec.")
+            alerter_troncature(saturees, plan["nb_requetes"])
+            st.session_state["df_etablissements_osm"] = filtrer_resultats_zone(pd.DataFrame(resultats), plan["zone"],
+                                                                                plan["communes"])
         else:
             st.warning("Veuillez entrer un nom d’établissement ET sélectionner une zone.")
             st.session_state["df_etablissements_osm"] = pd.DataFrame()
 
+    suivre_recherche_progressive()
+
     return st.session_state.get("df_etablissements_osm", pd.DataFrame())
 
 
+def alerter_troncature(saturees, nb_requetes):
+    """Signale les tuiles restées saturées à la profondeur maximale (résultats tronqués) et la couverture effective."""
+    if not saturees:
+        return
+    from planification_requetes import couverture_effective
+    st.warning(f"{len(saturees)} tuile(s) encore saturée(s) après subdivision : résultats tronqués, "
+               f"couverture effective estimée à {couverture_effective(nb_requetes, saturees):.0%}.")
+
+
+def demarrer_recherche_progressive(plan):
+    """Initialise l'état d'une recherche progressive : une tâche par requête du plan retenu."""
+    import pandas as pd
+
+    st.session_state["recherche_osm"] = {
+        "taches": plan["requetes"], "zone": plan["zone"], "communes": plan["communes"],
+        "position": 0, "resultats": [], "nb_erreurs": 0, "saturees": [], "statut": "en_cours"
+    }
+    st.session_state["df_etablissements_osm"] = pd.DataFrame()
+
+
+def _changer_statut_recherche(statut):
+    """Callback des boutons de contrôle : exécuté avant le rerun, il interrompt proprement la boucle."""
+    etat = st.session_state.get("recherche_osm")
+    if etat is not None and etat["statut"] in ("en_cours", "en_pause"):
+        etat["statut"] = statut
+
+
+def suivre_recherche_progressive(taille_lot=5):
+    """
+    Poursuit la recherche progressive en cours, lot par lot, en conservant les résultats dans
+    st.session_state : un clic sur Pause ou Arrêter interrompt le script sans perdre les lots terminés.
+    """
+    etat = st.session_state.get("recherche_osm")
+    if etat is None:
+        return
+    import pandas as pd
+    from fonctions_cartographie import executer_requete_en_cache
+    from planification_requetes import executer_plan_par_lots, filtrer_resultats_zone
+
+    total = len(etat["taches"])
+
+    def texte_avancement():
+        return (f"{etat['position']}/{total} requête(s) — {len(etat['resultats'])} établissement(s) trouvé(s)"
+                + (f" — {etat['nb_erreurs']} erreur(s)" if etat['nb_erreurs'] else ""))
+
+    controles = st.empty()
+    if etat["statut"] in ("en_cours", "en_pause"):
+        with controles.container():
+            col1, col2 = st.columns(2)
+            if etat["statut"] == "en_cours":
+                col1.button("⏸️ Pause (afficher la carte partielle)", on_click=_changer_statut_recherche,
+                            args=("en_pause",), use_container_width=True)
+            else:
+                col1.button("▶️ Reprendre la recherche", on_click=_changer_statut_recherche,
+                            args=("en_cours",), use_container_width=True)
+            col2.button("⏹️ Arrêter (garder les résultats)", on_click=_changer_statut_recherche,
+                        args=("annulee",), use_container_width=True)
+    barre = st.progress(etat["position"] / total if total else 1.0, text=texte_avancement())
+
+    if etat["statut"] == "en_cours":
+        for nb_traitees, resultats, erreurs, saturees in executer_plan_par_lots(
+                etat["taches"][etat["position"]:], taille_lot=taille_lot,
+                fonction_requete=executer_requete_en_cache):
+            etat["resultats"].extend(resultats)
+            etat["position"] += nb_traitees
+            etat["nb_erreurs"] += len(erreurs)
+            etat["saturees"].extend(saturees)
+            st.session_state["df_etablissements_osm"] = filtrer_resultats_zone(pd.DataFrame(etat["resultats"]),
+                                                                                etat["zone"], etat["communes"])
+            barre.progress(etat["position"] / total, text=texte_avancement())
+        etat["statut"] = "terminee"
+        controles.empty()
+
+    if etat["statut"] == "en_pause":
+        st.info("Recherche en pause : la carte ci-dessous affiche les résultats partiels.")
+    elif etat["statut"] == "annulee":
+        st.info(f"Recherche arrêtée : {len(etat['resultats'])} établissement(s) conservé(s).")
+    if etat["nb_erreurs"]:
+        st.warning(f"{etat['nb_erreurs']} requête(s) en échec.")
+    alerter_troncature(etat["saturees"], total)
+
+
 def interface_selection_socio(dict_geodatas):
-    """Affiche l'interface de sélection socio-économique et retourne les données filtrées."""
-    gdf_socio_filtre, colonne_a_afficher, nom_indicateur_final, maille_choisie = None, None, None, None
+    """
+    Affiche l'interface de sélection socio-économique et retourne l'indicateur et la maille choisis.
+    Les polygones affichés sont ensuite sélectionnés selon la vue de la carte (selectionner_socio_visible).
+
+    :return: Tuple (colonne, nom de l'indicateur, maille ou "Automatique"), ou (None, None, None) si désactivé.
+    """
+    colonne_a_afficher, nom_indicateur_final, maille_choisie = None, None, None
 
     st.sidebar.subheader("📊 Analyse du Territoire")
     if st.sidebar.toggle("Enrichir avec des données de territoire"):
@@ -138,28 +289,15 @@ def interface_selection_socio(dict_geodatas):
             if type_affichage == "Pourcentage (%)":
                 colonne_a_afficher, nom_indicateur_final = config_choisie['pct'], f"{config_choisie['display']} (%)"
 
-        maille_disponible = ['IRIS', 'Commune', 'Département']
-        maille_choisie = st.sidebar.radio("Niveau d'analyse :", maille_disponible, index=1, horizontal=True)
-        gdf_a_afficher = dict_geodatas.get(maille_choisie)
-
-        if gdf_a_afficher is not None:
-            df_deps = dict_geodatas.get('Département')
-            if df_deps is not None:
-                df_deps['label'] = df_deps['CODE_DEPT'] + ' - ' + df_deps['NOM_COM']
-                deps_selectionnes = st.sidebar.multiselect("Filtrer par département :",
-                                                           options=df_deps['label'].unique().tolist())
-                if deps_selectionnes:
-                    codes_deps = [d.split(' - ')[0] for d in deps_selectionnes]
-                    gdf_socio_filtre = gdf_a_afficher[gdf_a_afficher['CODE_DEPT'].isin(codes_deps)]
-                else:
-                    st.sidebar.info("Sélectionnez au moins un département pour afficher les données sur la carte.")
-            else:
-                gdf_socio_filtre = gdf_a_afficher
-        else:
-            st.sidebar.error(f"Données non disponibles pour la maille {maille_choisie}")
-
-    return gdf_socio_filtre, colonne_a_afficher, nom_indicateur_final, maille_choisie
+        maille_disponible = ['Automatique'] + [m for m in ['IRIS', 'Commune', 'Département'] if m in dict_geodatas]
+        maille_choisie = st.sidebar.radio("Niveau d'analyse :", maille_disponible, index=0, horizontal=True,
+                                          help="En automatique, la maille suit le zoom de la carte.")
+        if len(maille_disponible) == 1:
+            st.sidebar.error("Données de territoire non disponibles.")
+            return None, None, None
+        st.sidebar.caption("La couche suit la partie visible de la carte.")
 
+    return colonne_a_afficher, nom_indicateur_final, maille_choisie
 
 
 def interface_selection_poi():
@@ -172,4 +310,90 @@ def interface_selection_poi():
         "Afficher les générateurs de flux :",
         options=list(POI_CONFIG.keys())
     )
-    return selection
\ No newline at end of file
+    return selection
+
+
+def interface_scoring_sites(dict_geodatas):
+    """
+    Affiche dans la sidebar les paramètres du scoring des emplacements.
+    Retourne None si le scoring est désactivé, sinon un dictionnaire de paramètres
+    (codes des départements de la zone, pondérations, rayons, catégories de POI).
+    """
+    st.sidebar.subheader("🎯 Scoring des emplacements")
+    if not st.sidebar.toggle("Rechercher des zones blanches"):
+        return None
+
+    df_deps = dict_geodatas.get('Département')
+    if df_deps is None or df_deps.empty:
+        st.sidebar.error("Données départementales indisponibles pour définir la zone.")
+        return None
+
+    labels = sorted((df_deps['CODE_DEPT'] + ' - ' + df_deps['NOM_COM']).unique().tolist())
+    zone_labels = st.sidebar.multiselect("Zone à analyser (départements) :", options=labels, key="zone_scoring")
+    if not zone_labels:
+        st.sidebar.info("Sélectionnez au moins un département pour calculer le score.")
+        return None
+
+    resolution = st.sidebar.select_slider("Résolution de la grille (m) :", options=[100, 200, 500, 1000],
+                                          value=SCORING_CONFIG["resolution_m"])
+    st.sidebar.markdown("Pondérations")
+    poids = {
+        "population": st.sidebar.slider("Population atteignable", 0.0, 3.0, SCORING_CONFIG["poids"]["population"], 0.1),
+        "concurrence": st.sidebar.slider("Pression concurrentielle", 0.0, 3.0, SCORING_CONFIG["poids"]["concurrence"], 0.1),
+        "poi": st.sidebar.slider("Générateurs de flux (POI)", 0.0, 3.0, SCORING_CONFIG["poids"]["poi"], 0.1)
+    }
+    rayon_population = st.sidebar.slider("Rayon de captation (m) :", 500, 10000,
+                                         SCORING_CONFIG["rayon_population_m"], 250)
+    categories_poi = st.sidebar.multiselect("Générateurs de flux pris en compte :", options=list(POI_CONFIG.keys()),
+                                            default=list(POI_CONFIG.keys()), key="poi_scoring")
+    nb_sites = st.sidebar.slider("Nombre de sites candidats :", 1, 50, SCORING_CONFIG["nb_sites"])
+
+    return {
+        "codes_deps": [label.split(' - ')[0] for label in zone_labels],
+        "categories_poi": categories_poi,
+        "nb_sites": nb_sites,
+        "parametres": {"resolution_m": resolution, "poids": poids, "rayon_population_m": rayon_population}
+    }
+
+
+def interface_debug_performances(trace):
+    """
+    Affiche dans la sidebar l'interrupteur du mode debug et, s'il est actif, le détail de la trace
+    de l'exécution courante (étapes, appels externes, caches, volumes).
+    """
+    st.sidebar.subheader("🛠️ Performances")
+    if not st.sidebar.toggle("Mode debug", key="debug_performances") or trace is None:
+        return
+    import pandas as pd
+    from passerelle_api import etat_passerelle
+    from fonctions_api import DISJONCTEUR_ORS
+
+    with st.sidebar.expander("Détail de la dernière exécution", expanded=True):
+        st.metric("Durée totale", f"{trace.get('duree_totale_ms', 0):,.0f} ms".replace(",", " "))
+        if trace["attributs"].get("interaction"):
+            st.caption(f"Interaction : {trace['attributs']['interaction']}")
+        df_etapes = pd.DataFrame(trace["etapes"])
+        if not df_etapes.empty:
+            st.markdown("**Étapes et appels externes**")
+            st.dataframe(df_etapes.sort_values("debut_ms"), hide_index=True)
+
+        compteurs = trace["compteurs"]
+        if compteurs:
+            st.markdown("**Caches**")
+            noms_caches = sorted({cle.split('.')[1] for cle in compteurs if cle.startswith("cache.")})
+            st.dataframe(pd.DataFrame([{"cache": nom, "succès": compteurs.get(f"cache.{nom}.succes", 0),
+                                        "échecs": compteurs.get(f"cache.{nom}.echec", 0)} for nom in noms_caches]),
+                         hide_index=True)
+            st.markdown("**Requêtes et volumes**")
+            services = sorted({cle.split('.')[1] for cle in compteurs if cle.startswith(("requetes.", "octets."))})
+            st.dataframe(pd.DataFrame([{"service": nom, "requêtes": compteurs.get(f"requetes.{nom}", 0),
+                                        "fusionnées": compteurs.get(f"passerelle.{nom}.fusionnees", 0),
+                                        "attente (ms)": compteurs.get(f"passerelle.{nom}.attente_ms", 0),
+                                        "Ko reçus": round(compteurs.get(f"octets.{nom}", 0) / 1024, 1)}
+                                       for nom in services]), hide_index=True)
+
+        st.markdown("**Passerelle API (toutes sessions)**")
+        st.dataframe(pd.DataFrame(etat_passerelle()), hide_index=True)
+        etat_ors = DISJONCTEUR_ORS.etat_courant()
+        st.caption(f"Disjoncteur ORS : {etat_ors['etat']} ({etat_ors['echecs_consecutifs']} échec(s) consécutif(s))"
+                   + (f" — {etat_ors['message']}" if etat_ors['message'] else ""))
@@ -1,10 +1,10 @@
 # =======================
 # 📦 Imports & Librairies
 # =======================
-from interface import personnalisation_page, navigation
-from page_insee import page_insee
-from page_osm import page_osm
-from page_acceuil import page_accueil
+# Les modules des pages (et leurs dépendances lourdes : geopandas, folium...) sont importés à la
+# navigation ; le préchauffage les importe en arrière-plan dès le démarrage du serveur.
+from interface import personnalisation_page, navigation, indicateur_prechauffage
+from prechauffage import demarrer_prechauffage, etat_prechauffage
 
 # =======================
 # 📁 Chemins des fichiers
@@ -15,6 +15,11 @@ path_communes_france = "../data/Communes_France_Metro.xlsx"
 path_iris_socio = "../data/iris_socio_data_final.parquet"
 path_coeff_trafic = "../data/coefficient_temps_trajet.xlsx"
 
+# =======================
+# 🔥 Préchauffage des données de référence
+# =======================
+demarrer_prechauffage(path_communes_france, path_iris_socio, path_coeff_trafic)
+
 # =======================
 # 🎨 Personnalisation de la page
 # =======================
@@ -24,11 +29,14 @@ personnalisation_page()
 # 🚀 Navigation
 # ===================
 page = navigation()
+indicateur_prechauffage(etat_prechauffage)
 
 if page == "accueil":
+    from page_acceuil import page_accueil
     page_accueil()
 elif page == "insee":
+    from page_insee import page_insee
     page_insee(path_etablissement, path_centres_departements)
 elif page == "osm":
+    from page_osm import page_osm
     page_osm(path_communes_france, path_iris_socio, path_coeff_trafic)
-
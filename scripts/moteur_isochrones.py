@@ -0,0 +1,213 @@
+# ==============================================
+# 📦 Imports & Librairies
+# ==============================================
+import argparse
+import functools
+import heapq
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import shapely
+from config import MOTEUR_ISOCHRONES_CONFIG
+
+# Moteur d'isochrones hors ligne, alternative au serveur ORS :
+#   1. une étape préalable (en ligne de commande) convertit un extrait OSM routier en graphe CSR
+#      (tableaux NumPy : indptr, voisins, temps de parcours en secondes, coordonnées des nœuds) ;
+#   2. à l'exécution, un Dijkstra borné part du nœud le plus proche de chaque établissement, et
+#      l'enveloppe concave des nœuds atteints forme l'isochrone.
+#
+# Exemple (depuis le dossier scripts/, extrait au format OSM XML, ex: export Overpass ou osmium) :
+#   python moteur_isochrones.py --extrait ../data/rhone.osm --sortie ../data/graphe_routier.npz
+
+
+# ==============================================
+# Section construction du graphe (hors ligne)
+# ==============================================
+
+def graphe_depuis_aretes(lon, lat, origines, destinations, temps_s):
+    """
+    Construit les tableaux CSR d'un graphe orienté à partir de ses arêtes.
+
+    :param lon, lat: Coordonnées des nœuds (EPSG:4326).
+    :param origines, destinations: Indices des nœuds de chaque arête.
+    :param temps_s: Temps de parcours de chaque arête (secondes).
+    :return: Dictionnaire de tableaux {lon, lat, indptr, voisins, temps_s}.
+    """
+    ordre = np.argsort(origines, kind="stable")
+    indptr = np.zeros(len(lon) + 1, dtype=np.int64)
+    np.add.at(indptr, np.asarray(origines) + 1, 1)
+    return {"lon": np.asarray(lon, dtype=np.float64), "lat": np.asarray(lat, dtype=np.float64),
+            "indptr": np.cumsum(indptr), "voisins": np.asarray(destinations, dtype=np.int32)[ordre],
+            "temps_s": np.asarray(temps_s, dtype=np.float32)[ordre]}
+
+
+def _voie_carrossable(donnees):
+    """Arête d'un graphe OSM brut (non simplifié) ouverte aux voitures : type de voie routier, accès non interdit."""
+    config = MOTEUR_ISOCHRONES_CONFIG
+    return donnees.get("highway") in config["voies_carrossables"] and \
+        donnees.get("access") not in config["acces_interdits"]
+
+
+def construire_graphe(chemin_extrait, chemin_sortie):
+    """
+    Convertit un extrait OSM (XML) en graphe routier CSR pondéré par les temps de parcours
+    (vitesses maximales OSM, sinon vitesses moyennes par type de voie) et l'enregistre en .npz.
+    Seules les voies carrossables sont gardées : un extrait brut contient aussi chemins, pistes
+    cyclables et voies privées, qui étendraient les isochrones au-delà du réseau routier.
+    """
+    import osmnx as ox  # Nécessaire uniquement pour cette étape hors ligne
+
+    graphe = ox.graph_from_xml(chemin_extrait, simplify=False, retain_all=True)
+    graphe.remove_edges_from([(u, v, k) for u, v, k, donnees in graphe.edges(keys=True, data=True)
+                              if not _voie_carrossable(donnees)])
+    graphe = ox.simplify_graph(ox.truncate.largest_component(graphe, strongly=False))
+    graphe = ox.add_edge_travel_times(
+        ox.add_edge_speeds(graphe, fallback=MOTEUR_ISOCHRONES_CONFIG["vitesse_defaut_kmh"]))
+    noeuds = list(graphe.nodes)
+    index = {noeud: i for i, noeud in enumerate(noeuds)}
+    aretes = [(index[u], index[v], donnees["travel_time"]) for u, v, donnees in graphe.edges(data=True)]
+    origines, destinations, temps_s = (np.array(colonne) for colonne in zip(*aretes))
+    tableaux = graphe_depuis_aretes([graphe.nodes[n]["x"] for n in noeuds], [graphe.nodes[n]["y"] for n in noeuds],
+                                    origines, destinations, temps_s)
+    os.makedirs(os.path.dirname(os.path.abspath(chemin_sortie)), exist_ok=True)
+    np.savez_compressed(chemin_sortie, **tableaux)
+    return len(noeuds), len(aretes)
+
+
+# ==============================================
+# Section calcul des isochrones
+# ==============================================
+
+# Les calculs de distance se font en coordonnées locales métriques (projection équirectangulaire
+# centrée sur le graphe) : en degrés, un écart est-ouest serait surestimé d'un facteur 1/cos(lat).
+METRES_PAR_DEGRE = 111_000
+
+
+def _echelle_locale(graphe):
+    """Mètres par degré de longitude et de latitude, à la latitude moyenne du graphe."""
+    return np.array([METRES_PAR_DEGRE * np.cos(np.radians(graphe["lat"].mean())), METRES_PAR_DEGRE])
+
+
+@functools.lru_cache(maxsize=2)
+def charger_graphe(chemin):
+    """Charge un graphe CSR (une fois par processus) et prépare l'index spatial de ses nœuds."""
+    with np.load(chemin) as donnees:
+        graphe = {cle: donnees[cle] for cle in donnees.files}
+    # Listes Python : l'accès élément par élément y est bien plus rapide que sur des tableaux NumPy
+    graphe["listes"] = (graphe["indptr"].tolist(), graphe["voisins"].tolist(), graphe["temps_s"].tolist())
+    graphe["origines"] = np.repeat(np.arange(len(graphe["lon"])), np.diff(graphe["indptr"]))
+    graphe["echelle"] = _echelle_locale(graphe)
+    graphe["x"], graphe["y"] = graphe["lon"] * graphe["echelle"][0], graphe["lat"] * graphe["echelle"][1]
+    graphe["index_noeuds"] = shapely.STRtree(shapely.points(graphe["x"], graphe["y"]))
+    return graphe
+
+
+def noeuds_les_plus_proches(graphe, lon, lat):
+    """Retourne, pour chaque point, l'indice du nœud le plus proche et la distance (en mètres)."""
+    points = shapely.points(np.asarray(lon, dtype=float) * graphe["echelle"][0],
+                            np.asarray(lat, dtype=float) * graphe["echelle"][1])
+    (indices_points, indices_noeuds), distances = graphe["index_noeuds"].query_nearest(
+        points, return_distance=True, all_matches=False)
+    noeuds = np.full(len(points), -1, dtype=np.int64)
+    ecarts = np.full(len(points), np.inf)
+    noeuds[indices_points], ecarts[indices_points] = indices_noeuds, distances
+    return noeuds, ecarts
+
+
+def dijkstra_borne(graphe, source, limite_s):
+    """Dijkstra depuis un nœud, arrêté au temps limite ; retourne les indices des nœuds atteints."""
+    indptr, voisins, temps_s = graphe["listes"]
+    distances = {source: 0.0}
+    tas = [(0.0, source)]
+    while tas:
+        distance, noeud = heapq.heappop(tas)
+        if distance > distances[noeud]:
+            continue
+        for k in range(indptr[noeud], indptr[noeud + 1]):
+            voisin, nouvelle = voisins[k], distance + temps_s[k]
+            if nouvelle <= limite_s and nouvelle < distances.get(voisin, float("inf")):
+                distances[voisin] = nouvelle
+                heapq.heappush(tas, (nouvelle, voisin))
+    return np.fromiter(distances.keys(), dtype=np.int64, count=len(distances))
+
+
+def _points_enveloppe(graphe, atteints, pas_ancrage_m):
+    """
+    Réduit les nœuds atteints aux points utiles à l'enveloppe : la frontière (nœuds ayant une arête
+    vers un nœud non atteint) et un semis d'ancrages intérieurs, un par cellule de pas_ancrage_m,
+    qui garde l'enveloppe fidèle là où la zone atteinte touche le bord du graphe.
+    """
+    atteint = np.zeros(len(graphe["lon"]), dtype=bool)
+    atteint[atteints] = True
+    origines = graphe["origines"]
+    frontiere = np.unique(origines[atteint[origines] & ~atteint[graphe["voisins"]]])
+    cellules = np.floor(graphe["x"][atteints] / pas_ancrage_m) * 1e9 + np.floor(graphe["y"][atteints] / pas_ancrage_m)
+    _, premiers = np.unique(cellules, return_index=True)
+    selection = np.union1d(frontiere, atteints[premiers])
+    return shapely.multipoints(np.column_stack([graphe["x"][selection], graphe["y"][selection]]))
+
+
+def isochrone_locale(chemin_graphe, longitude, latitude, temps_secondes):
+    """
+    Calcule une isochrone sur le graphe local, au format de la feature GeoJSON renvoyée par ORS.
+
+    :return: Feature GeoJSON, ou None si l'établissement est trop loin du réseau du graphe.
+    """
+    config = MOTEUR_ISOCHRONES_CONFIG
+    graphe = charger_graphe(chemin_graphe)
+    noeuds, ecarts = noeuds_les_plus_proches(graphe, [longitude], [latitude])
+    if noeuds[0] < 0 or ecarts[0] > config["distance_max_reseau_m"]:
+        return None
+    atteints = dijkstra_borne(graphe, int(noeuds[0]), temps_secondes)
+    enveloppe = shapely.concave_hull(_points_enveloppe(graphe, atteints, config["pas_ancrage_m"]),
+                                     ratio=config["ratio_enveloppe"])
+    # Marge autour des nœuds extrêmes (et surface non nulle quand peu de nœuds sont atteints)
+    polygone = shapely.transform(enveloppe.buffer(config["marge_m"]), lambda coords: coords / graphe["echelle"])
+    return {"type": "Feature", "properties": {"value": temps_secondes, "moteur": "local"},
+            "geometry": shapely.geometry.mapping(polygone)}
+
+
+def _isochrone_locale_tache(arguments):
+    return isochrone_locale(*arguments)
+
+
+def creer_pool_isochrones(chemin_graphe, processus):
+    """
+    Pool de processus de calcul, dont chacun charge le graphe une seule fois. Les processus sont
+    lancés en "spawn" : un fork du serveur Streamlit, multi-thread, hériterait de verrous tenus par
+    ses autres threads. L'appelant conserve le pool entre les calculs et le ferme (shutdown).
+    """
+    return ProcessPoolExecutor(max_workers=processus, mp_context=multiprocessing.get_context("spawn"),
+                               initializer=charger_graphe, initargs=(chemin_graphe,))
+
+
+def calculer_isochrones_locales(chemin_graphe, points, processus=None, pool=None):
+    """
+    Calcule les isochrones de plusieurs établissements, en parallèle au-delà d'un seuil.
+
+    :param points: Liste de tuples (longitude, latitude, temps_secondes).
+    :param processus: Nombre de processus (MOTEUR_ISOCHRONES_CONFIG par défaut).
+    :param pool: Pool (voir creer_pool_isochrones) à utiliser ; sans pool, un pool est créé pour
+        cet appel puis fermé.
+    :return: Liste des features GeoJSON (ou None hors du graphe), dans l'ordre des points.
+    """
+    processus = processus or MOTEUR_ISOCHRONES_CONFIG["processus"]
+    taches = [(chemin_graphe, lon, lat, temps) for lon, lat, temps in points]
+    if processus <= 1 or len(taches) < MOTEUR_ISOCHRONES_CONFIG["seuil_parallelisme"]:
+        return [_isochrone_locale_tache(tache) for tache in taches]
+    chunksize = max(1, len(taches) // (4 * processus))
+    if pool is None:
+        with creer_pool_isochrones(chemin_graphe, processus) as pool_temporaire:
+            return list(pool_temporaire.map(_isochrone_locale_tache, taches, chunksize=chunksize))
+    return list(pool.map(_isochrone_locale_tache, taches, chunksize=chunksize))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Construit le graphe routier du moteur d'isochrones local.")
+    parser.add_argument("--extrait", required=True, help="Extrait OSM au format XML (.osm)")
+    parser.add_argument("--sortie", default=MOTEUR_ISOCHRONES_CONFIG["graphe"], help="Fichier .npz du graphe")
+    args = parser.parse_args()
+    nb_noeuds, nb_aretes = construire_graphe(args.extrait, args.sortie)
+    print(f"Graphe enregistré dans {args.sortie} : {nb_noeuds} nœuds, {nb_aretes} arêtes.")
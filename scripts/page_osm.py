@@ -2,39 +2,98 @@ import streamlit as st
 import geopandas as gpd
 import pandas as pd
 from streamlit_folium import st_folium
-import time
+import os
+import uuid
 
 # Imports depuis vos modules personnalisés
 # Assurez-vous que tous ces imports sont bien présents en haut de votre fichier page_osm.py
 from fonctions_basiques import (
     charger_communes,
-    extraction_adresse_OSM,
+    normaliser_resultats,
     choix_centre_OSM,
     charger_donnees_iris_socio,
     charger_coefficients_trafic,
-    preparer_donnees_socio
+    preparer_donnees_socio,
+    selectionner_socio_visible,
+    socio_maille_superieure,
+    zoom_pour_emprise
 )
+from fonctions_api import DISJONCTEUR_ORS
 from fonctions_cartographie import (
     transfo_geodataframe,
     creer_carte_enrichie,
-    rechercher_poi_osm  # Nouvel import
+    empreinte_gdf,
+    rechercher_poi_osm,  # Nouvel import
+    scorer_emplacements_en_cache,
+    volume_carte,
+    volume_transmis
 )
 from interface import (
     interface_recherche_osm,
     interface_selection_socio,
     interface_selection_poi,  # Nouvel import
+    interface_scoring_sites,
+    interface_debug_performances,
     POI_CONFIG  # On importe aussi la config
 )
+from budget_carte import adapter_au_budget, formater_volume
+from config import SCORING_CONFIG, MOTEUR_ISOCHRONES_CONFIG
+from instrumentation import demarrer_trace, terminer_trace, mesurer, annoter
+from prechauffage import etat_prechauffage
 
 
 def page_osm(path_communes, path_iris_socio, path_coeff_trafic):
     """
     Page principale pour l'analyse concurrentielle, incluant l'affichage du tableau corrigé et les POI.
+    Chaque exécution est tracée (durées par étape, caches, requêtes) pour le panneau de debug et le journal.
     """
+    id_session = st.session_state.setdefault("id_session", uuid.uuid4().hex[:12])
+    trace = demarrer_trace("osm", session=id_session)
+    annoter(prechauffage=etat_prechauffage()["statut"])
+    try:
+        contenu_page_osm(path_communes, path_iris_socio, path_coeff_trafic)
+    finally:
+        terminer_trace()
+    interface_debug_performances(trace)
+
+
+def _type_interaction(parametres):
+    """
+    Déduit l'interaction à l'origine du rerun en comparant les paramètres de la carte à ceux du
+    rerun précédent : noms des paramètres modifiés, "premier_affichage" ou "aucun_changement".
+    """
+    valeurs = {nom: repr(valeur) for nom, valeur in parametres.items()}
+    precedentes = st.session_state.get("parametres_carte_precedents")
+    st.session_state["parametres_carte_precedents"] = valeurs
+    if precedentes is None:
+        return "premier_affichage"
+    modifies = sorted(nom for nom, valeur in valeurs.items() if precedentes.get(nom) != valeur)
+    return "+".join(modifies) if modifies else "aucun_changement"
+
+
+def _vue_carte(retour_carte, gdf_etablissements):
+    """
+    Vue courante de la carte : celle renvoyée par st_folium au rerun précédent (déplacement, zoom),
+    sinon l'emprise des établissements.
+
+    :return: Tuple (emprise (min_lon, min_lat, max_lon, max_lat), zoom, centre (lat, lon) ou None).
+    """
+    if retour_carte and retour_carte.get("bounds") and retour_carte.get("zoom") is not None:
+        sud_ouest, nord_est = retour_carte["bounds"]["_southWest"], retour_carte["bounds"]["_northEast"]
+        if sud_ouest.get("lat") is not None and nord_est.get("lat") is not None:
+            centre = retour_carte.get("center") or {}
+            return ((sud_ouest["lng"], sud_ouest["lat"], nord_est["lng"], nord_est["lat"]), int(retour_carte["zoom"]),
+                    (centre["lat"], centre["lng"]) if centre.get("lat") is not None else None)
+    emprise = tuple(gdf_etablissements.total_bounds)
+    return emprise, zoom_pour_emprise(emprise), None
+
+
+def contenu_page_osm(path_communes, path_iris_socio, path_coeff_trafic):
+    """Contenu de la page OSM (recherche, résultats, carte)."""
     st.title("🗺️ Analyse Concurrentielle via OpenStreetMap")
 
     # --- Chargement et préparation des données ---
-    with st.spinner("Chargement des données initiales..."):
+    with st.spinner("Chargement des données initiales..."), mesurer("chargement_donnees"):
         df_coefficients = charger_coefficients_trafic(path_coeff_trafic)
         df_communes = charger_communes(path_communes)
         df_iris_base = charger_donnees_iris_socio(path_iris_socio)
@@ -42,20 +101,30 @@ def page_osm(path_communes, path_iris_socio, path_coeff_trafic):
     dict_geodatas = preparer_donnees_socio(df_iris_base, df_communes)
 
     # --- Interface Sidebar ---
-    gdf_socio_filtre, indicateur, nom_indicateur, maille = interface_selection_socio(dict_geodatas)
+    indicateur, nom_indicateur, maille_demandee = interface_selection_socio(dict_geodatas)
     poi_selectionnes = interface_selection_poi()
+    parametres_scoring = interface_scoring_sites(dict_geodatas)
 
     # --- PARTIE 1 : RECHERCHE ---
     with st.expander("🚀 Lancer une nouvelle analyse", expanded=True):
-        df_etablissements_osm = interface_recherche_osm(df_communes)
+        with mesurer("recherche"):
+            df_etablissements_osm = interface_recherche_osm(df_communes, dict_geodatas.get('Département'),
+                                                            dict_geodatas.get('Commune'))
 
     # --- PARTIE 2 : RÉSULTATS ---
     if df_etablissements_osm is not None and not df_etablissements_osm.empty:
         st.header("Résultats de l'analyse")
 
-        # Préparation des données et choix du centre
-        df_etablissements_osm[["adresse_simplifiee", "precision_geocodage"]] = df_etablissements_osm.apply(
-            extraction_adresse_OSM, axis=1)
+        # Préparation des données (dédoublonnage, adresses) et choix du centre
+        with mesurer("normalisation", nb_resultats=len(df_etablissements_osm)) as attributs:
+            df_etablissements_osm, rapport_doublons = normaliser_resultats(df_etablissements_osm)
+            attributs.update(rapport_doublons)
+        annoter(nb_etablissements=len(df_etablissements_osm))
+        nb_doublons = sum(rapport_doublons.values())
+        if nb_doublons:
+            st.caption(f"🧹 {nb_doublons} doublon(s) retiré(s) : {rapport_doublons['identifiant_osm']} par "
+                       f"identifiant OSM, {rapport_doublons['proximite']} par proximité (même enseigne) — "
+                       f"{len(df_etablissements_osm)} établissement(s) conservé(s).")
         lat_centre_OSM, lon_centre_OSM = choix_centre_OSM(df_etablissements_osm)
         gdf_etablissements_osm = transfo_geodataframe(df_etablissements_osm, "longitude", "latitude")
 
@@ -71,22 +140,51 @@ def page_osm(path_communes, path_iris_socio, path_coeff_trafic):
             bbox_poi = (bounds[0] - marge, bounds[1] - marge, bounds[2] + marge, bounds[3] + marge)
 
             liste_gdf_poi = []
-            with st.spinner("Recherche des points d'intérêt..."):
+            with st.spinner("Recherche des points d'intérêt..."), mesurer("poi", nb_categories=len(poi_selectionnes)):
                 for categorie in poi_selectionnes:
                     tags = POI_CONFIG[categorie]['tags']
                     gdf_resultat = rechercher_poi_osm(bbox_poi, tags)
                     if not gdf_resultat.empty:
                         gdf_resultat['categorie'] = categorie
                         liste_gdf_poi.append(gdf_resultat)
-                    time.sleep(1)
 
             if liste_gdf_poi:
                 gdf_poi_final = pd.concat(liste_gdf_poi, ignore_index=True)
                 st.info(f"{len(gdf_poi_final)} point(s) d'intérêt trouvé(s) dans la zone.")
 
+        # Scoring des emplacements sur la zone choisie
+        resultat_scoring, gdf_sites = None, None
+        if parametres_scoring:
+            with st.spinner("Calcul du score des emplacements..."), mesurer("scoring"):
+                resultat_scoring, gdf_sites = scorer_emplacements_en_cache(
+                    tuple(parametres_scoring['codes_deps']), tuple(parametres_scoring['categories_poi']),
+                    parametres_scoring['parametres'], parametres_scoring['nb_sites'],
+                    empreinte_gdf(gdf_etablissements_osm, ['nom_etablissement']), dict_geodatas['Département'],
+                    dict_geodatas['IRIS'], gdf_etablissements_osm)
+
         # --- CARTE INTERACTIVE ---
         st.markdown("---")
         st.subheader("Carte Interactive")
+
+        # Vue de la carte (une clé par jeu d'établissements et centre : une nouvelle recherche repart de leur emprise)
+        empreinte_etablissements = empreinte_gdf(gdf_etablissements_osm, ['nom_etablissement'])
+        cle_carte = (f"carte_osm_{empreinte_etablissements[1][:12] if empreinte_etablissements else 'vide'}"
+                     f"_{lat_centre_OSM:.4f}_{lon_centre_OSM:.4f}")
+        emprise_vue, zoom_vue, centre_vue = _vue_carte(st.session_state.get(cle_carte), gdf_etablissements_osm)
+
+        # Couche socio-économique : polygones de la partie visible, maille selon le zoom en automatique
+        gdf_socio_filtre, maille, info_socio = None, None, {}
+        if indicateur and maille_demandee:
+            with mesurer("couche_socio.selection", zoom=zoom_vue) as attributs:
+                gdf_socio_filtre, maille, info_socio = selectionner_socio_visible(
+                    dict_geodatas, maille_demandee, emprise_vue, zoom_vue)
+                attributs.update(maille=maille, nb_polygones=info_socio["nb_polygones"])
+            if info_socio["tronque"]:
+                st.caption(f"⚠️ {info_socio['nb_dans_emprise']} zones {maille} dans la vue : seules les "
+                           f"{info_socio['nb_polygones']} plus centrales sont affichées. Zoomez pour le détail.")
+            elif maille != info_socio.get("maille_demandee", maille):
+                st.caption(f"ℹ️ Trop de zones {info_socio['maille_demandee']} dans la vue : affichage à la maille "
+                           f"{maille}. Zoomez pour le détail.")
         if nom_indicateur and maille: st.write(f"Avec couche de données : **{nom_indicateur}** (maille {maille})")
 
         st.markdown("**Mode d'affichage des concurrents :**")
@@ -94,23 +192,72 @@ def page_osm(path_communes, path_iris_socio, path_coeff_trafic):
                                   ('Points', 'Cercles d\'influence', 'Isochrones'), horizontal=True,
                                   label_visibility="collapsed")
 
-        rayon_cercles, temps_isochrones = None, None
+        rayon_cercles, temps_isochrones, moteur_isochrones = None, None, 'ORS'
         if mode_affichage == 'Cercles d\'influence':
             rayon_cercles = st.slider("Rayon d'influence (m) :", 100, 5000, 1000, 100)
         elif mode_affichage == 'Isochrones':
             temps_isochrones = st.slider("Temps de trajet en voiture (min) :", 2, 20, 10, 1)
+            if os.path.exists(MOTEUR_ISOCHRONES_CONFIG["graphe"]):
+                moteur_isochrones = st.radio("Moteur de calcul :", ('ORS', 'Local'), horizontal=True,
+                                             format_func={'ORS': "Serveur ORS",
+                                                          'Local': "Graphe routier local (hors ligne)"}.get)
+            etat_ors = DISJONCTEUR_ORS.etat_courant()
+            if moteur_isochrones == 'ORS' and etat_ors["etat"] == "ouvert":
+                st.warning("🔴 Service d'isochrones (ORS) indisponible : les isochrones déjà calculées sont "
+                           "affichées, les autres établissements sont représentés par un cercle de repli. "
+                           f"Dernière erreur : {etat_ors['message']}")
+
+        # Budget de volume : au-delà, couches simplifiées, regroupées ou agrégées avant le rendu
+        with mesurer("carte.budget") as attributs:
+            rendu = adapter_au_budget(
+                gdf_socio_filtre, gdf_etablissements_osm, mode_affichage, gdf_poi_final, resultat_scoring, maille,
+                socio_plus_grossier=lambda m: socio_maille_superieure(dict_geodatas, m, emprise_vue, zoom_vue))
+            attributs.update(octets_estimes=sum(rendu["volume_estime"].values()), degradations=len(rendu["degradations"]))
+        gdf_socio_filtre, maille = rendu["gdf_socio"], rendu["maille_socio"]
 
-        map_object, legend_enseignes, legend_socio_color, legend_socio_single = creer_carte_enrichie(
-            gdf_etablissements=gdf_etablissements_osm, lat_centre=lat_centre_OSM, lon_centre=lon_centre_OSM,
-            gdf_socio=gdf_socio_filtre, colonne_socio=indicateur, nom_indicateur_socio=nom_indicateur,
-            gdf_poi=gdf_poi_final,
-            mode_affichage_etablissements=mode_affichage, rayon_cercles=rayon_cercles,
-            temps_isochrones=temps_isochrones, df_coefficients=df_coefficients
-        )
+        annoter(interaction=_type_interaction({
+            "etablissements": len(gdf_etablissements_osm), "indicateur_socio": (maille, indicateur,
+                                                                               None if gdf_socio_filtre is None
+                                                                               else len(gdf_socio_filtre)),
+            "poi": 0 if gdf_poi_final is None else len(gdf_poi_final), "scoring": parametres_scoring,
+            "mode_affichage": mode_affichage, "rayon_cercles": rayon_cercles, "temps_isochrones": temps_isochrones,
+            "moteur_isochrones": moteur_isochrones, "vue_carte": info_socio.get("emprise")}))
+        with mesurer("carte.construction"):
+            map_object, legend_enseignes, legend_socio_color, legend_socio_single = creer_carte_enrichie(
+                gdf_etablissements=gdf_etablissements_osm,
+                lat_centre=centre_vue[0] if centre_vue else lat_centre_OSM,
+                lon_centre=centre_vue[1] if centre_vue else lon_centre_OSM, zoom_depart=zoom_vue,
+                gdf_socio=gdf_socio_filtre, colonne_socio=indicateur, nom_indicateur_socio=nom_indicateur,
+                gdf_poi=gdf_poi_final,
+                mode_affichage_etablissements=mode_affichage, rayon_cercles=rayon_cercles,
+                temps_isochrones=temps_isochrones, df_coefficients=df_coefficients,
+                resultat_scoring=resultat_scoring, gdf_sites=gdf_sites, moteur_isochrones=moteur_isochrones,
+                rendu_etablissements=rendu["rendu_etablissements"], rendu_poi=rendu["rendu_poi"],
+                tolerance_socio_m=rendu["tolerance_socio_m"]
+            )
+        # Volume transmis au navigateur, estimé d'après les fragments des couches en cache (sans nouveau rendu)
+        volume_fragments = volume_carte(map_object)
+        if rendu["degradations"]:
+            st.info(f"🪶 Carte allégée pour rester sous le budget de {formater_volume(rendu['budget_octets'])} "
+                    f"(volume prévu sans allègement : {formater_volume(rendu['volume_initial'])}) :\n- "
+                    + "\n- ".join(rendu["degradations"]))
+        if sum(rendu["volume_estime"].values()) > rendu["budget_octets"]:
+            st.warning("⚠️ La carte dépasse le budget malgré les allègements : réduisez la zone ou le nombre "
+                       "d'établissements pour un affichage fluide.")
+        st.caption(f"📦 Volume estimé de la carte : {formater_volume(volume_fragments)} (prévu : "
+                   f"{formater_volume(sum(rendu['volume_estime'].values()))}, "
+                   f"budget : {formater_volume(rendu['budget_octets'])})")
 
         col_carte, col_legende = st.columns([3, 1])
-        with col_carte:
-            st_folium(map_object, width=800, height=600, returned_objects=[])
+        with col_carte, mesurer("carte.affichage"):
+            # Avec une couche socio, les déplacements et zooms relancent la page pour qu'elle suive la vue
+            # (voir _vue_carte) ; sans elle, la carte ne renvoie rien et ne relance pas la page
+            st_folium(map_object, key=cle_carte, width=800, height=600, center=centre_vue, zoom=zoom_vue,
+                      returned_objects=["bounds", "zoom", "center"] if indicateur and maille_demandee else [])
+        if st.session_state.get("debug_performances"):
+            # Volume réellement envoyé par st_folium (nouvelle génération du script, seulement en mode debug)
+            with mesurer("carte.volume_transmis") as attributs:
+                attributs.update(octets=volume_transmis(map_object), octets_estimes=volume_fragments)
         with col_legende:
             st.write("**Légende**")
             if legend_enseignes:
@@ -134,5 +281,19 @@ def page_osm(path_communes, path_iris_socio, path_coeff_trafic):
             elif legend_socio_single:
                 st.write(f"**{legend_socio_single['label']}**");
                 st.markdown(f"Valeur unique : **{'{:,.0f}'.format(legend_socio_single['value']).replace(',', ' ')}**")
+            if resultat_scoring is not None:
+                st.markdown("<hr style='margin:0.5em 0;'>", unsafe_allow_html=True)
+                st.write("**Score des emplacements**")
+                st.markdown(
+                    f'<div style="height: 25px; border: 1px solid #ccc; border-radius: 5px; background: linear-gradient(to right, {", ".join(SCORING_CONFIG["couleurs"])});"/>',
+                    unsafe_allow_html=True)
+                c1, c2 = st.columns(2);
+                c1.markdown("<small>0</small>", unsafe_allow_html=True);
+                c2.markdown('<div style="text-align: right;"><small>100</small></div>', unsafe_allow_html=True)
+
+        # Tableau des sites candidats
+        if gdf_sites is not None and not gdf_sites.empty:
+            st.subheader("🎯 Sites candidats")
+            st.dataframe(gdf_sites.drop(columns=['geometry']), hide_index=True)
     else:
         st.info("👋 Bienvenue ! Lancez une recherche dans le panneau ci-dessus pour commencer.")
\ No newline at end of file
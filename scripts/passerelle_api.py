@@ -0,0 +1,168 @@
+# ==============================================
+# 📦 Imports & Librairies
+# ==============================================
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+
+from config import PASSERELLE_CONFIG
+from instrumentation import compter
+
+# Passerelle commune à tout le processus (donc à toutes les sessions Streamlit) pour les API
+# externes : les requêtes identiques en cours sont fusionnées en un seul appel, et chaque service
+# est limité par un seau à jetons, au lieu d'une pause propre à chaque session. En mode batch
+# (plusieurs processus), les seaux sont remplacés par des limiteurs partagés entre processus.
+# La variable d'environnement PASSERELLE_LIMITES=0 désactive la limitation (serveurs factices).
+
+_VERROU = threading.Lock()
+_EN_VOL = {}
+_SEAUX = {}
+_METRIQUES = defaultdict(lambda: {"appels": 0, "fusionnees": 0, "attentes": 0, "attente_totale_s": 0.0,
+                                  "attente_max_s": 0.0, "file": 0, "file_max": 0})
+
+
+class _SeauJetons:
+    """Seau à jetons réservable : chaque appel prend un jeton, quitte à rendre le solde négatif."""
+
+    def __init__(self, debit_par_s, rafale):
+        self.debit_par_s, self.rafale = debit_par_s, rafale
+        self.jetons, self.mise_a_jour = float(rafale), time.monotonic()
+        self.verrou = threading.Lock()
+
+    def reserver(self):
+        """Réserve un jeton et retourne le délai (s) à attendre avant de l'utiliser."""
+        with self.verrou:
+            maintenant = time.monotonic()
+            self.jetons = min(self.rafale, self.jetons + (maintenant - self.mise_a_jour) * self.debit_par_s)
+            self.mise_a_jour = maintenant
+            self.jetons -= 1
+            return max(0.0, -self.jetons / self.debit_par_s)
+
+
+class LimiteurPartage:
+    """
+    Limiteur commun à plusieurs processus (mode batch) : chaque appel réserve le prochain créneau,
+    espacé de 1/débit, sous un verrou d'un multiprocessing.Manager. Même interface que _SeauJetons.
+    """
+
+    def __init__(self, verrou, prochain_creneau, debit_par_s):
+        self.verrou, self.prochain_creneau, self.debit_par_s = verrou, prochain_creneau, debit_par_s
+
+    def reserver(self):
+        """Réserve un créneau et retourne le délai (s) à attendre avant de l'utiliser."""
+        with self.verrou:
+            maintenant = time.time()
+            creneau = max(self.prochain_creneau.value, maintenant)
+            self.prochain_creneau.value = creneau + 1 / self.debit_par_s
+            return creneau - maintenant
+
+
+class _AppelEnVol:
+    def __init__(self):
+        self.termine = threading.Event()
+        self.resultat, self.erreur = None, None
+
+
+def _seau(service):
+    if os.environ.get("PASSERELLE_LIMITES", "1") == "0" or service not in PASSERELLE_CONFIG:
+        return None
+    with _VERROU:
+        if service not in _SEAUX:
+            _SEAUX[service] = _SeauJetons(**PASSERELLE_CONFIG[service])
+        return _SEAUX[service]
+
+
+def creer_limiteurs_partages(manager, services=("nominatim", "overpass")):
+    """
+    Crée, pour des processus de travail, un limiteur commun par service : le débit de
+    PASSERELLE_CONFIG s'applique alors à l'ensemble des processus et non à chacun.
+
+    :param manager: multiprocessing.Manager démarré, qui doit rester actif tant que les processus tournent.
+    :return: Dictionnaire {service: LimiteurPartage}, à transmettre à installer_limiteurs dans chaque processus.
+    """
+    return {service: LimiteurPartage(manager.Lock(), manager.Value('d', 0.0),
+                                     PASSERELLE_CONFIG[service]["debit_par_s"])
+            for service in services}
+
+
+def installer_limiteurs(limiteurs):
+    """Remplace les seaux à jetons du processus par les limiteurs donnés (voir creer_limiteurs_partages)."""
+    with _VERROU:
+        _SEAUX.update(limiteurs)
+
+
+def cle_requete(methode, url, **kwargs):
+    """Clé d'identité d'une requête HTTP (hors en-têtes et délai d'expiration)."""
+    contenu = {k: v for k, v in kwargs.items() if k not in ("headers", "timeout")}
+    return json.dumps([methode, url, contenu], sort_keys=True, default=str)
+
+
+def executer(service, cle, appel):
+    """
+    Exécute appel() via la passerelle : si une requête de même clé est déjà en cours, attend et
+    partage son résultat ; sinon attend son tour auprès du limiteur du service puis l'exécute.
+
+    :return: Le résultat de appel() (ou lève son exception, y compris pour les appels fusionnés).
+    """
+    with _VERROU:
+        vol = _EN_VOL.get(cle)
+        meneur = vol is None
+        if meneur:
+            vol = _EN_VOL[cle] = _AppelEnVol()
+        _METRIQUES[service]["appels" if meneur else "fusionnees"] += 1
+
+    if not meneur:
+        compter(f"passerelle.{service}.fusionnees")
+        vol.termine.wait()
+        if vol.erreur is not None:
+            raise vol.erreur
+        return vol.resultat
+
+    try:
+        seau = _seau(service)
+        attente = seau.reserver() if seau is not None else 0.0
+        if attente > 0:
+            _attendre(service, attente)
+        vol.resultat = appel()
+        return vol.resultat
+    except Exception as e:
+        vol.erreur = e
+        raise
+    finally:
+        with _VERROU:
+            del _EN_VOL[cle]
+        vol.termine.set()
+
+
+def _attendre(service, attente):
+    """Patiente pour le limiteur en tenant à jour la profondeur de file et les temps d'attente."""
+    metriques = _METRIQUES[service]
+    with _VERROU:
+        metriques["file"] += 1
+        metriques["file_max"] = max(metriques["file_max"], metriques["file"])
+    try:
+        time.sleep(attente)
+    finally:
+        with _VERROU:
+            metriques["file"] -= 1
+            metriques["attentes"] += 1
+            metriques["attente_totale_s"] += attente
+            metriques["attente_max_s"] = max(metriques["attente_max_s"], attente)
+    compter(f"passerelle.{service}.attente_ms", round(attente * 1000, 1))
+
+
+def etat_passerelle():
+    """
+    Métriques cumulées de la passerelle depuis le démarrage du processus.
+
+    :return: Liste de dictionnaires par service (appels, requêtes fusionnées, file d'attente
+        courante et maximale, temps d'attente moyen et maximal).
+    """
+    with _VERROU:
+        return [{"service": service, "appels": m["appels"], "fusionnées": m["fusionnees"],
+                 "file": m["file"], "file max": m["file_max"], "attentes": m["attentes"],
+                 "attente moy. (ms)": round(m["attente_totale_s"] / m["attentes"] * 1000, 1) if m["attentes"] else 0.0,
+                 "attente max (ms)": round(m["attente_max_s"] * 1000, 1)}
+                for service, m in sorted(_METRIQUES.items())]
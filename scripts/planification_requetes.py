@@ -0,0 +1,245 @@
+# ==============================================
+# 📦 Imports & Librairies
+# ==============================================
+import numpy as np
+import pandas as pd
+import requests
+import shapely
+from config import PLANIFICATION_CONFIG
+from fonctions_api import requete_nominatim, requete_nominatim_emprise, requete_overpass_enseignes
+
+# Planification de la recherche d'établissements : une sélection de zone (Région, Département,
+# Commune) est traduite en plusieurs plans de requêtes, dont on estime le nombre de requêtes,
+# le coût et la couverture, puis le moins coûteux à couverture complète est retenu. La couverture
+# des tuiles est une estimation : celles encore saturées à la profondeur maximale sont signalées
+# à l'exécution et retirées de la couverture effective (voir couverture_effective).
+#
+# Stratégies :
+#   - "communes" : une requête Nominatim par enseigne × commune (stratégie historique, plafonnée) ;
+#   - "emprises" : requêtes Nominatim bornées (viewbox) sur des tuiles couvrant la zone ;
+#   - "overpass" : une requête Overpass unique sur les zones administratives des départements.
+
+STRATEGIES = {
+    "communes": "Une requête par commune",
+    "emprises": "Tuiles Nominatim (viewbox)",
+    "overpass": "Requête Overpass par zone"
+}
+
+
+# ==============================================
+# Section construction des plans
+# ==============================================
+
+def _zone_selectionnee(maille, selection_geo, df_communes, df_departements):
+    """Retourne les départements (GeoDataFrame en EPSG:4326) couvrant la sélection, ou None."""
+    if df_departements is None or maille not in ('Région', 'Département') or not selection_geo:
+        return None
+    if maille == 'Région':
+        noms_deps = df_communes[df_communes['Nom_Region'].isin(selection_geo)]['Nom_Dep'].unique()
+    else:
+        noms_deps = selection_geo
+    deps = df_departements[df_departements['Nom_Dep'].isin(noms_deps)]
+    return deps.to_crs("EPSG:4326") if not deps.empty else None
+
+
+def _tuiles(zone, taille_km):
+    """Découpe l'emprise de la zone en tuiles carrées et ne garde que celles qui la touchent."""
+    min_lon, min_lat, max_lon, max_lat = zone.bounds
+    pas_lat = taille_km / 111.0
+    pas_lon = taille_km / (111.0 * np.cos(np.radians((min_lat + max_lat) / 2)))
+    lons = np.arange(min_lon, max_lon, pas_lon)
+    lats = np.arange(min_lat, max_lat, pas_lat)
+    grille_lon, grille_lat = np.meshgrid(lons, lats)
+    boites = shapely.box(grille_lon, grille_lat, grille_lon + pas_lon, grille_lat + pas_lat).ravel()
+    shapely.prepare(zone)
+    return [tuple(b.bounds) for b in boites[shapely.intersects(zone, boites)]]
+
+
+def _plan(strategie, requetes, couverture, cout_s, detail, zone=None, communes=None):
+    return {"strategie": strategie, "libelle": STRATEGIES[strategie], "requetes": requetes,
+            "nb_requetes": len(requetes), "couverture": couverture, "cout_estime_s": cout_s, "detail": detail,
+            "zone": zone, "communes": communes}
+
+
+def planifier_recherche(noms_etablissements, maille, selection_geo, df_communes, df_departements=None,
+                        gdf_communes=None):
+    """
+    Construit les plans de requêtes possibles pour une sélection de zone.
+
+    :param df_departements: GeoDataFrame des départements (sortie de preparer_donnees_socio), pour les
+        stratégies par zone ; sans lui, seule la stratégie par commune est proposée.
+    :param gdf_communes: GeoDataFrame des communes (NOM_COM), pour renseigner la ville des résultats
+        par zone qui n'en ont pas (voir completer_villes).
+    :return: Liste de plans (dictionnaires), dans l'ordre de STRATEGIES.
+    """
+    config = PLANIFICATION_CONFIG
+    if maille == 'Région':
+        villes = df_communes[df_communes['Nom_Region'].isin(selection_geo)]['Nom_Ville'].tolist()
+    elif maille == 'Département':
+        villes = df_communes[df_communes['Nom_Dep'].isin(selection_geo)]['Nom_Ville'].tolist()
+    else:
+        villes = list(selection_geo)
+    villes = list(dict.fromkeys(villes))
+    if not noms_etablissements or not villes:
+        return []
+
+    # Stratégie historique : une requête par enseigne × commune, plafonnée
+    villes_retenues = villes[:config["limite_communes"]]
+    requetes = [{"type": "commune", "nom": nom, "ville": ville} for nom in noms_etablissements for ville in villes_retenues]
+    plans = [_plan("communes", requetes, len(villes_retenues) / len(villes),
+                   len(requetes) * config["cout_nominatim_s"],
+                   f"{len(villes_retenues)} commune(s) interrogée(s) sur {len(villes)}")]
+
+    deps = _zone_selectionnee(maille, selection_geo, df_communes, df_departements)
+    if deps is None:
+        return plans
+    zone = deps.geometry.union_all()
+    codes = sorted(deps['CODE_DEPT'].astype(str).unique())
+    communes = None
+    if gdf_communes is not None:
+        communes = gdf_communes[gdf_communes['CODE_DEPT'].isin(codes)][['NOM_COM', 'geometry']].to_crs("EPSG:4326")
+
+    # Requêtes Nominatim bornées sur des tuiles couvrant la zone
+    tuiles = _tuiles(zone, config["taille_tuile_km"])
+    requetes = [{"type": "emprise", "nom": nom, "viewbox": tuile, "profondeur": 0}
+                for nom in noms_etablissements for tuile in tuiles]
+    plans.append(_plan("emprises", requetes, 1.0, len(requetes) * config["cout_nominatim_s"],
+                       f"{len(tuiles)} tuile(s) de {config['taille_tuile_km']} km, subdivisées si saturées "
+                       f"(couverture réduite si certaines le restent)", zone, communes))
+
+    # Une seule requête Overpass sur les zones administratives des départements
+    plans.append(_plan("overpass", [{"type": "overpass", "noms": list(noms_etablissements), "codes_deps": codes}],
+                       1.0, config["cout_overpass_s"] + len(codes) * config["cout_overpass_par_dep_s"],
+                       f"{len(codes)} département(s) en une requête", zone, communes))
+    return plans
+
+
+def choisir_plan(plans, strategie="auto"):
+    """Retourne le plan demandé ou, en automatique, le moins coûteux parmi les plans à couverture maximale."""
+    if not plans:
+        return None
+    if strategie != "auto":
+        return next((p for p in plans if p["strategie"] == strategie), plans[0])
+    couverture_max = max(p["couverture"] for p in plans)
+    return min((p for p in plans if p["couverture"] >= couverture_max - 1e-9), key=lambda p: p["cout_estime_s"])
+
+
+def resumer_plans(plans, plan_retenu=None):
+    """Tableau comparatif des plans (requêtes, coût, couverture) par rapport à la stratégie par commune."""
+    if not plans:
+        return pd.DataFrame()
+    reference = plans[0]["nb_requetes"]
+    return pd.DataFrame([{
+        "": "✅" if plan_retenu is not None and p["strategie"] == plan_retenu["strategie"] else "",
+        "Stratégie": p["libelle"], "Requêtes": p["nb_requetes"],
+        "vs par commune": f"{p['nb_requetes'] / reference:.0%}" if reference else "-",
+        "Durée estimée (s)": round(p["cout_estime_s"]), "Couverture": f"{p['couverture']:.0%}",
+        "Détail": p["detail"]
+    } for p in plans])
+
+
+# ==============================================
+# Section exécution
+# ==============================================
+
+def executer_requete(requete):
+    """
+    Exécute une requête d'un plan. Une tuile saturée (autant de résultats que la limite Nominatim)
+    est découpée en quatre et réinterrogée, jusqu'à la profondeur maximale configurée.
+
+    :return: Tuple (liste de résultats au format des résultats de recherche, profondeurs des tuiles
+        encore saturées à la profondeur maximale, dont les résultats sont donc tronqués).
+    :raises requests.exceptions.RequestException: En cas d'échec d'une requête.
+    """
+    if requete["type"] == "commune":
+        return requete_nominatim(requete["nom"], requete["ville"]), []
+    if requete["type"] == "overpass":
+        return requete_overpass_enseignes(requete["noms"], requete["codes_deps"]), []
+
+    limite = PLANIFICATION_CONFIG["limite_nominatim"]
+    resultats = requete_nominatim_emprise(requete["nom"], requete["viewbox"], limite)
+    if len(resultats) < limite:
+        return resultats, []
+    if requete["profondeur"] >= PLANIFICATION_CONFIG["profondeur_max_tuiles"]:
+        return resultats, [requete["profondeur"]]
+    min_lon, min_lat, max_lon, max_lat = requete["viewbox"]
+    mid_lon, mid_lat = (min_lon + max_lon) / 2, (min_lat + max_lat) / 2
+    resultats, saturees = [], []
+    for viewbox in [(min_lon, min_lat, mid_lon, mid_lat), (mid_lon, min_lat, max_lon, mid_lat),
+                    (min_lon, mid_lat, mid_lon, max_lat), (mid_lon, mid_lat, max_lon, max_lat)]:
+        resultats_tuile, saturees_tuile = executer_requete(
+            {**requete, "viewbox": viewbox, "profondeur": requete["profondeur"] + 1})
+        resultats.extend(resultats_tuile)
+        saturees.extend(saturees_tuile)
+    return resultats, saturees
+
+
+def couverture_effective(nb_requetes, saturees):
+    """
+    Couverture d'un plan exécuté : la surface des tuiles restées saturées (résultats tronqués) est
+    retirée, une tuile de profondeur p valant 1/4^p de la tuile initiale d'une requête.
+    """
+    if not nb_requetes:
+        return 1.0
+    return max(0.0, 1 - sum(0.25 ** profondeur for profondeur in saturees) / nb_requetes)
+
+
+def executer_plan_par_lots(requetes, taille_lot=5, fonction_requete=None):
+    """
+    Exécute les requêtes d'un plan par lots et produit les résultats au fil de l'eau.
+
+    :param fonction_requete: Fonction (requete) -> (résultats, tuiles saturées) ; executer_requete par
+        défaut (l'application fournit sa version mise en cache).
+    :return: Générateur de tuples (nombre de requêtes du lot, résultats du lot, erreurs du lot,
+        profondeurs des tuiles saturées du lot).
+    """
+    fonction_requete = fonction_requete or executer_requete
+    for debut in range(0, len(requetes), taille_lot):
+        lot = requetes[debut:debut + taille_lot]
+        resultats, erreurs, saturees = [], [], []
+        for requete in lot:
+            try:
+                resultats_requete, saturees_requete = fonction_requete(requete)
+            except requests.exceptions.RequestException as e:
+                erreurs.append(e)
+                continue
+            resultats.extend(resultats_requete)
+            saturees.extend(saturees_requete)
+        yield len(lot), resultats, erreurs, saturees
+
+
+def filtrer_resultats_zone(df_resultats, zone, communes=None, marge_deg=0.005):
+    """
+    Retire les résultats hors de la zone (les tuiles débordent des limites départementales) et
+    renseigne leur ville manquante d'après les communes du plan.
+    """
+    if zone is None or df_resultats.empty:
+        return df_resultats
+    zone_elargie = zone.buffer(marge_deg)
+    shapely.prepare(zone_elargie)
+    dedans = shapely.contains_xy(zone_elargie, df_resultats['longitude'].to_numpy(),
+                                 df_resultats['latitude'].to_numpy())
+    return completer_villes(df_resultats[dedans].reset_index(drop=True), communes)
+
+
+def completer_villes(df_resultats, communes, distance_max_deg=0.01):
+    """
+    Renseigne la ville des résultats qui n'en ont pas (objets OSM sans addr:city) par la commune
+    la plus proche du point : celle qui le contient, ou une voisine si les contours simplifiés
+    le laissent juste à l'extérieur. La ville sert au coefficient de trafic des isochrones.
+
+    :param communes: GeoDataFrame (NOM_COM, geometry) en EPSG:4326, ou None.
+    """
+    if communes is None or communes.empty or df_resultats.empty:
+        return df_resultats
+    manquantes = np.flatnonzero(df_resultats['ville'].fillna('').astype(str).str.strip().eq('').to_numpy())
+    if not len(manquantes):
+        return df_resultats
+    points = shapely.points(df_resultats['longitude'].to_numpy()[manquantes],
+                            df_resultats['latitude'].to_numpy()[manquantes])
+    indices_points, indices_communes = shapely.STRtree(communes.geometry.values).query_nearest(
+        points, max_distance=distance_max_deg, all_matches=False)
+    df_resultats = df_resultats.copy()
+    colonne = df_resultats.columns.get_loc('ville')
+    df_resultats.iloc[manquantes[indices_points], colonne] = communes['NOM_COM'].to_numpy()[indices_communes]
+    return df_resultats
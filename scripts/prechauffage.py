@@ -0,0 +1,64 @@
+# ==============================================
+# 📦 Imports & Librairies
+# ==============================================
+import importlib
+import threading
+import time
+
+import streamlit as st
+
+# Préchauffage au démarrage du serveur : un thread d'arrière-plan importe les modules lourds de la
+# page OSM et remplit les caches Streamlit des données de référence (communes, coefficients de
+# trafic, IRIS, préparation socio-économique). Les caches étant partagés entre sessions, le premier
+# analyste qui ouvre la page OSM retrouve ces données prêtes ; s'il arrive avant la fin, ses appels
+# attendent le calcul en cours au lieu de le relancer.
+
+_VERROU = threading.Lock()
+_ETAT = {"statut": "en_attente", "etape": None, "durees_s": {}, "message": None}
+
+
+def etat_prechauffage():
+    """Retourne une copie de l'état du préchauffage (statut, étape en cours, durée de chaque étape)."""
+    with _VERROU:
+        return {**_ETAT, "durees_s": dict(_ETAT["durees_s"])}
+
+
+def _executer_etape(nom, fonction):
+    with _VERROU:
+        _ETAT["etape"] = nom
+    debut = time.perf_counter()
+    resultat = fonction()
+    with _VERROU:
+        _ETAT["durees_s"][nom] = round(time.perf_counter() - debut, 2)
+    return resultat
+
+
+def _prechauffer(path_communes, path_iris_socio, path_coeff_trafic):
+    with _VERROU:
+        _ETAT["statut"] = "en_cours"
+    try:
+        _executer_etape("imports", lambda: importlib.import_module("page_osm"))
+        from fonctions_basiques import (charger_communes, charger_coefficients_trafic, charger_donnees_iris_socio,
+                                        preparer_donnees_socio)
+        df_communes = _executer_etape("communes", lambda: charger_communes(path_communes))
+        _executer_etape("coefficients_trafic", lambda: charger_coefficients_trafic(path_coeff_trafic))
+        df_iris_base = _executer_etape("iris_socio", lambda: charger_donnees_iris_socio(path_iris_socio))
+        _executer_etape("preparation_socio", lambda: preparer_donnees_socio(df_iris_base, df_communes))
+        statut, message = "pret", None
+    except Exception as e:  # Le préchauffage ne doit jamais empêcher l'application de fonctionner
+        statut, message = "erreur", f"{type(e).__name__}: {e}"
+    with _VERROU:
+        _ETAT.update(statut=statut, message=message, etape=None)
+
+
+@st.cache_resource(show_spinner=False)
+def demarrer_prechauffage(path_communes, path_iris_socio, path_coeff_trafic):
+    """
+    Lance le préchauffage en arrière-plan, une seule fois par processus serveur (cache_resource).
+
+    :return: Le thread de préchauffage.
+    """
+    thread = threading.Thread(target=_prechauffer, args=(path_communes, path_iris_socio, path_coeff_trafic),
+                              name="prechauffage", daemon=True)
+    thread.start()
+    return thread